@@ -1,33 +1,70 @@
+from .censor import AhoCorasick, censor_stream, kmp_censor_stream
+from .compact import CompactLCP
 from .divsufsort import bw_transform, divsufsort, inverse_bw_transform, sa_search
+from .external import bw_transform_file, divsufsort_file
+from .fmindex import FMIndex
+from .lz77 import lz77_compress, lz77_decompress
+from .rlbwt import RLBWTIndex
 from .stringalg import (
+    divsufsort_many,
     kasai,
-    kmp_censor_stream,
+    kasai_many,
+    lcp_intervals,
     lcp_query,
     lcp_segtree,
+    lcp_sparse_table,
     lempel_ziv_complexity,
     lempel_ziv_factorization,
     levenshtein,
+    levenshtein_many,
     longest_previous_factor,
+    lz77_factorization,
     min_rotation,
+    min_rotation_many,
     most_frequent_substrings,
+    plcp,
+    sa_search_many,
+    sparse_suffix_array,
 )
-from .wonderstring import WonderString, common_substrings
+from .wonderstring import WonderString, common_substrings, iter_common_substrings
+from .documents import DocumentIndex
 
 __all__ = [
     "divsufsort",
     "bw_transform",
     "inverse_bw_transform",
     "sa_search",
+    "divsufsort_file",
+    "bw_transform_file",
+    "sa_search_many",
+    "sparse_suffix_array",
+    "divsufsort_many",
     "kasai",
+    "kasai_many",
+    "CompactLCP",
+    "plcp",
     "lcp_segtree",
+    "lcp_sparse_table",
     "lcp_query",
+    "lcp_intervals",
     "levenshtein",
+    "levenshtein_many",
     "most_frequent_substrings",
     "WonderString",
     "common_substrings",
+    "iter_common_substrings",
+    "FMIndex",
+    "RLBWTIndex",
+    "DocumentIndex",
     "min_rotation",
+    "min_rotation_many",
     "longest_previous_factor",
     "lempel_ziv_factorization",
     "lempel_ziv_complexity",
+    "lz77_factorization",
+    "lz77_compress",
+    "lz77_decompress",
     "kmp_censor_stream",
+    "censor_stream",
+    "AhoCorasick",
 ]
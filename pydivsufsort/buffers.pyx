@@ -0,0 +1,72 @@
+# cython: language_level=3, wraparound=False, boundscheck=False
+
+"""
+Conversion of the inputs to numpy arrays without copying them
+"""
+
+cimport numpy as np
+import numpy as np
+
+np.import_array()
+
+import mmap
+import warnings
+from array import array
+
+
+cdef extern from "Python.h":
+    bint PyUnicode_IS_ASCII(object o)
+    void* PyUnicode_DATA(object o)
+    Py_ssize_t PyUnicode_GET_LENGTH(object o)
+
+
+def str_array(str s not None):
+    """
+    Read-only uint8 view of an ascii str.
+
+    CPython stores ascii strings as one byte per character (PEP 393),
+    so the characters can be used in place without encoding them.
+    """
+    if not PyUnicode_IS_ASCII(s):
+        raise TypeError("str must only contain ascii chars")
+    cdef np.npy_intp shape[1]
+    shape[0] = PyUnicode_GET_LENGTH(s)
+    cdef np.ndarray arr = np.PyArray_SimpleNewFromData(
+        1, shape, np.NPY_UINT8, PyUnicode_DATA(s)
+    )
+    # the array keeps the string alive
+    np.set_array_base(arr, s)
+    np.PyArray_CLEARFLAGS(arr, np.NPY_ARRAY_WRITEABLE)
+    return arr
+
+
+_BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap, array)
+
+
+def as_array(inp):
+    """
+    Contiguous 1D numpy view of inp, without copying it when possible.
+
+    Supports numpy arrays, ascii str, and objects implementing the buffer
+    protocol (bytes, bytearray, memoryview, mmap, array.array...).
+    The view is read-only if the input is.
+    Only non-contiguous inputs are copied, and the sequences without
+    the buffer protocol (lists, tuples...) are converted with numpy.
+    """
+    if isinstance(inp, np.ndarray):
+        # in my tests, converting to contiguous and using [::1]
+        # gives *slightly* better performance than using [:]
+        return np.ascontiguousarray(inp)
+    if isinstance(inp, str):
+        return str_array(inp)
+    if isinstance(inp, _BUFFER_TYPES):
+        arr = np.asarray(memoryview(inp))
+        return np.ascontiguousarray(arr.reshape(-1) if arr.ndim != 1 else arr)
+    if isinstance(inp, (list, tuple)):
+        return np.ascontiguousarray(inp)
+    try:
+        memoryview(inp)
+    except TypeError:
+        return np.ascontiguousarray(inp)
+    warnings.warn("input type not recognized, handled as a buffer of char", stacklevel=3)
+    return np.frombuffer(inp, dtype=np.uint8)
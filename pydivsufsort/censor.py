@@ -0,0 +1,110 @@
+import numpy as np
+
+from .buffers import as_array
+from .stringalg import _aho_corasick, _aho_corasick_censor, _pack
+
+
+def _encode(s):
+    return s.encode("utf-8") if isinstance(s, str) else s
+
+
+class AhoCorasick:
+    """
+    Compiled Aho-Corasick automaton, to censor many patterns at once.
+
+    Building the automaton takes time proportional to the total length
+    of the patterns times the number of distinct bytes they use, so it
+    is meant to be built once and reused on many streams.
+
+    Parameters
+    ----------
+
+    patterns : list or tuple
+        list of non-empty str (encoded in UTF-8) or bytes, or a packed
+        tuple (offsets, data) where the i-th pattern is
+        data[offsets[i]:offsets[i+1]]
+    """
+
+    def __init__(self, patterns):
+        if not isinstance(patterns, tuple):
+            patterns = [_encode(p) for p in patterns]
+        offsets, data = _pack(patterns)
+        if (np.diff(offsets) == 0).any():
+            raise ValueError("patterns must not be empty")
+        self.byte_class, self.delta, self.depth, self.match_len = _aho_corasick(
+            data, offsets
+        )
+
+    @property
+    def n_states(self):
+        return len(self.depth)
+
+    def censor_stream(self, stream, replacement=b""):
+        """
+        Censors a stream of chunks.
+
+        Matches can span several chunks: the bytes that could start
+        a match are held back until the next chunk. Each occurrence is
+        replaced by `replacement`, and overlapping occurrences, including
+        a pattern inside a longer one, are replaced once. str chunks are
+        processed as UTF-8 and give str outputs, other chunks (bytes,
+        bytearray, memoryview...) give bytes. Empty outputs are skipped.
+        """
+        replacement = _encode(replacement)
+        carry = b""
+        state = 0
+        deleted_end = -self.n_states - 1
+        pending = np.empty(0, dtype=np.int64)
+        is_str = False
+        for chunk in stream:
+            is_str = isinstance(chunk, str)
+            data = chunk.encode("utf-8") if is_str else as_array(chunk)
+            out, state, carry, deleted_end, pending = _aho_corasick_censor(
+                self.byte_class,
+                self.delta,
+                self.depth,
+                self.match_len,
+                carry,
+                data,
+                replacement,
+                state,
+                deleted_end,
+                pending,
+            )
+            if out:
+                yield out.decode("utf-8") if is_str else out
+        # the pending groups are replaced at the end of the stream
+        out = b""
+        run = -len(carry)
+        for start, end in pending.reshape(-1, 2).tolist():
+            out += carry[len(carry) + run : len(carry) + start] + replacement
+            run = end
+        out += carry[len(carry) + run :]
+        if out:
+            yield out.decode("utf-8") if is_str else out
+
+    def censor(self, text, replacement=b""):
+        """Censors a single str or bytes-like text"""
+        out = self.censor_stream([text], replacement)
+        return ("" if isinstance(text, str) else b"").join(out)
+
+
+def censor_stream(patterns, stream, replacement=b""):
+    """
+    Censors a stream (like a generator of str or bytes) with the
+    Aho-Corasick algorithm.
+
+    `patterns` is a list of patterns or an `AhoCorasick` automaton,
+    which avoids building it again. See `AhoCorasick.censor_stream`.
+    """
+    if not isinstance(patterns, AhoCorasick):
+        patterns = AhoCorasick(patterns)
+    return patterns.censor_stream(stream, replacement)
+
+
+def kmp_censor_stream(censor, stream):
+    """
+    Censors text from a stream of str.
+    Same as `censor_stream` with a single pattern.
+    """
+    return censor_stream([censor], stream)
@@ -0,0 +1,106 @@
+import numpy as np
+
+# values >= ESCAPE are stored in the exception table
+ESCAPE = 255
+
+
+class CompactLCP:
+    """
+    LCP array stored with one byte per value.
+
+    Values smaller than 255 are stored directly, the others are stored
+    in a sorted exception table. Natural texts rarely have LCP values
+    above 255, so this takes a bit more than one byte per suffix instead
+    of 4 or 8.
+
+    Indexing with an int returns an int, indexing with a slice or an array
+    returns a decoded numpy array, and `np.asarray` decodes the whole array.
+    `most_frequent_substrings` and `lcp_intervals` scan the bytes and the
+    exception table without decoding. The other functions that accept
+    a CompactLCP, like `lcp_segtree` and `lcp_sparse_table`, decode
+    the whole array at each call.
+
+    Parameters
+    ----------
+
+    lcp : np.ndarray
+        LCP array to encode
+
+    Attributes
+    ----------
+
+    values : np.ndarray
+        min(lcp, 255) as uint8
+    exception_rows : np.ndarray
+        sorted indices where values is 255
+    exception_values : np.ndarray
+        lcp[exception_rows]
+    """
+
+    def __init__(self, lcp):
+        lcp = np.asarray(lcp)
+        values = np.minimum(lcp, ESCAPE).astype(np.uint8)
+        rows = np.flatnonzero(values == ESCAPE).astype(lcp.dtype)
+        self._set(values, rows, lcp[rows])
+
+    def _set(self, values, exception_rows, exception_values):
+        self.values = values
+        self.exception_rows = exception_rows
+        self.exception_values = exception_values
+        return self
+
+    @classmethod
+    def from_arrays(cls, values, exception_rows, exception_values):
+        """Builds a CompactLCP from its attributes, without checking them"""
+        return cls.__new__(cls)._set(values, exception_rows, exception_values)
+
+    @property
+    def dtype(self):
+        """dtype of the decoded values"""
+        return self.exception_values.dtype
+
+    @property
+    def nbytes(self):
+        return (
+            self.values.nbytes
+            + self.exception_rows.nbytes
+            + self.exception_values.nbytes
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    def _decode(self, rows, out):
+        """replaces the escaped values in out, whose indices are rows"""
+        escaped = out == ESCAPE
+        out[escaped] = self.exception_values[
+            np.searchsorted(self.exception_rows, rows[escaped])
+        ]
+        return out
+
+    def __getitem__(self, key):
+        n = len(self)
+        if isinstance(key, slice):
+            rows = np.arange(*key.indices(n))
+        elif np.ndim(key) == 0:
+            key = int(key)
+            value = int(self.values[key])
+            if value < ESCAPE:
+                return value
+            row = np.searchsorted(self.exception_rows, key % n)
+            return int(self.exception_values[row])
+        else:
+            key = np.asarray(key)
+            if key.dtype == bool:
+                rows = np.flatnonzero(key)
+            else:
+                rows = np.where(key < 0, key + n, key)
+        return self._decode(rows, self.values[rows].astype(self.dtype))
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.values.astype(self.dtype)
+        out[self.exception_rows] = self.exception_values
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __repr__(self):
+        return f"CompactLCP(n={len(self)}, exceptions={len(self.exception_rows)})"
@@ -3,17 +3,13 @@ Interface to the functions of libdivsufsort
 """
 
 import ctypes
-import warnings
-from array import array
+import os
 
 import numpy as np
 
+from .buffers import as_array
 from .dll import libdivsufsort, libdivsufsort64
-
-
-def _pointer_frombuffer(inp):
-    inp = (ctypes.c_uint8 * len(inp)).from_buffer(inp)
-    return ctypes.byref(inp)
+from .suffixsort import sais
 
 
 _SIGNED_TO_UNSIGNED = {
@@ -32,6 +28,20 @@ def _as_unsigned(inp: np.ndarray):
     return inp.astype(_SIGNED_TO_UNSIGNED[dtype]) ^ lastbit
 
 
+def _alphabet_bytes(inp: np.ndarray):
+    """
+    Returns the number of bytes (a power of 2) needed to store
+    the range of values of inp
+    inp is supposed unsigned
+    """
+    if inp.dtype == np.dtype("uint8") or len(inp) == 0:
+        return 1
+    n_bits = int(inp.max() - inp.min()).bit_length()
+    n_bytes = (n_bits + 7) // 8
+    # power of 2
+    return 1 << (n_bytes - 1).bit_length()
+
+
 def _minimize_dtype(inp: np.ndarray):
     """
     Returns an array with a smaller dtype and big endian
@@ -39,12 +49,8 @@ def _minimize_dtype(inp: np.ndarray):
     """
     if inp.dtype == np.dtype("uint8"):
         return inp
-    inp_min = inp.min()
-    n_bits = int(inp.max() - inp_min).bit_length()
-    n_bytes = (n_bits + 7) // 8
-    # power of 2
-    n_bytes = 1 << (n_bytes - 1).bit_length()
-    return (inp - inp_min).astype(f">u{n_bytes}")
+    n_bytes = _alphabet_bytes(inp)
+    return (inp - inp.min()).astype(f">u{n_bytes}")
 
 
 _SUPPORTED_DTYPES = {
@@ -52,68 +58,160 @@ _SUPPORTED_DTYPES = {
 }
 
 
-def _get_bytes_pointer(inp):
-    """Returns pointer to bytes-like input"""
-    if isinstance(inp, np.ndarray):
-        assert inp.dtype == np.uint8
-        # https://stackoverflow.com/q/60848009/5133167
-        if not inp.flags["C_CONTIGUOUS"]:
-            # Make a contiguous copy of the numpy array.
-            inp = np.ascontiguousarray(inp)
-        return ctypes.pointer(np.ctypeslib.as_ctypes(inp))
-    elif isinstance(inp, array):
-        assert inp.typecode == "B"
-        return _pointer_frombuffer(inp)
-    elif isinstance(inp, bytearray):
-        return _pointer_frombuffer(inp)
-    elif isinstance(inp, bytes):
-        return inp
-    elif isinstance(inp, str):
-        try:
-            ans = inp.encode("ascii")
-            if len(inp) > 999:
-                warnings.warn("converting str argument uses more memory", stacklevel=2)
-            return ans
-        except UnicodeEncodeError:
-            raise TypeError("str must only contain ascii chars")
-    else:
-        warnings.warn(
-            "input type not recognized, handled as a buffer of char", stacklevel=2
-        )
-        return _pointer_frombuffer(inp)
+def _get_bytes_pointer(inp: np.ndarray):
+    """Returns pointer to an uint8 array, which can be read-only"""
+    if inp.dtype != np.uint8:
+        raise TypeError(DTYPE_NOT_SUPPORTED_MSG)
+    return ctypes.c_void_p(inp.ctypes.data)
 
 
 def _cast(inp):
     return _minimize_dtype(_as_unsigned(inp))
 
 
-def divsufsort(inp, force64=False):
-    if isinstance(inp, np.ndarray):
-        if inp.dtype == np.uint8:
-            pass
-        elif inp.dtype in _SUPPORTED_DTYPES:
-            inp = _cast(inp)
-            dtype = inp.dtype
-            out = divsufsort(inp.view("uint8"))
-            return out[out % dtype.itemsize == 0] // dtype.itemsize
-        else:
-            raise TypeError(inp.dtype)
+def _sa_dtype(n, force64=False, out=None):
+    """
+    dtype of the suffix array: int32 when possible, int64 otherwise.
+    A preallocated numpy out array imposes its dtype.
+    """
+    if isinstance(out, np.ndarray):
+        dtype = out.dtype
+        if dtype not in (np.dtype(np.int32), np.dtype(np.int64)):
+            raise TypeError(f"out must be int32 or int64, not {dtype}")
+        if dtype == np.int32 and n > np.iinfo(np.int32).max:
+            raise ValueError("the input is too long for an int32 output")
+        return dtype
+    if n <= np.iinfo(np.int32).max and not force64:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
+def _output_buffer(out, n, dtype):
+    """
+    Returns a writable numpy view of the first n elements of out.
+    out can be a numpy array or any writable buffer (bytearray, mmap...)
+    """
+    if isinstance(out, np.ndarray):
+        if out.dtype != dtype:
+            raise TypeError(f"out must have dtype {dtype}, not {out.dtype}")
+        arr = out
+    else:
+        arr = np.frombuffer(out, dtype=dtype)
+    if arr.ndim != 1 or not arr.flags["C_CONTIGUOUS"]:
+        raise ValueError("out must be a contiguous 1D buffer")
+    if not arr.flags["WRITEABLE"]:
+        raise ValueError("out must be writable")
+    if len(arr) < n:
+        raise ValueError(f"out is too small: {len(arr)} < {n}")
+    return arr if len(arr) == n else arr[:n]
+
+
+def _output_pointer(arr):
+    """Returns pointer to a numpy output buffer"""
+    # as_ctypes does not support empty arrays
+    return ctypes.c_void_p(arr.ctypes.data)
+
+
+def _integer_alphabet(inp: np.ndarray, dtype):
+    """
+    Returns the input mapped to an integer alphabet [0, upper]
+    with the given dtype, and upper.
+    inp is supposed unsigned
+    """
+    n = len(inp)
+    inp_min = inp.min()
+    upper = int(inp.max() - inp_min)
+    # keep the buckets of SA-IS in O(n)
+    if upper > max(n, 256):
+        _, codes = np.unique(inp, return_inverse=True)
+        return codes.astype(dtype, copy=False), int(codes.max())
+    return (inp - inp_min).astype(dtype), upper
+
+
+def _divsufsort_integer(inp: np.ndarray, force64=False, out=None):
+    """
+    Suffix array of an array whose alphabet does not fit in bytes
+    inp is supposed unsigned
+    """
+    n = len(inp)
+    dtype = _sa_dtype(n, force64, out)
+    codes, upper = _integer_alphabet(inp, dtype)
+    if out is not None:
+        out = _output_buffer(out, n, dtype)
+    return sais(codes, upper, out)
+
+
+# below this length, the threads cost more than they save: the sort takes
+# a few tens of milliseconds, and the merge adds 50% to 100% more work
+_PARALLEL_MIN_LENGTH = 1 << 20
+
+
+def _available_cores():
+    """number of cores the process can run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def divsufsort(inp, force64=False, out=None, n_threads=1):
+    """
+    Suffix array of inp.
+
+    If `out` is given, the suffix array is written into it instead of
+    a newly allocated array. It can be an int32 or int64 numpy array
+    or any writable buffer (bytearray, mmap...) of at least `len(inp)`
+    elements. The returned array is a view of `out`.
+
+    With `n_threads` (None for all the cores), a byte string is cut into
+    one block per thread. The blocks are sorted in parallel with
+    libdivsufsort, then merged in parallel by comparing their suffixes.
+    This does 1.5 to 2 times the total work of the single-threaded sort,
+    so it only helps with several cores: `n_threads` is capped by the
+    number of cores available to the process, and texts shorter than
+    1 MiB are sorted with a single thread. It also uses about three times
+    the memory of the suffix array. Texts with a large average LCP
+    (above 256) are sorted with a single thread, since the comparisons
+    would be too slow.
+    """
+    inp = as_array(inp)
+    if inp.dtype == np.uint8:
+        pass
+    elif inp.dtype in _SUPPORTED_DTYPES:
+        inp = _as_unsigned(inp)
+        if _alphabet_bytes(inp) > 1:
+            return _divsufsort_integer(inp, force64, out)
+        inp = _minimize_dtype(inp)
+    else:
+        raise TypeError(inp.dtype)
 
     n = len(inp)
     inp_p = _get_bytes_pointer(inp)
-    if n <= np.iinfo(np.int32).max and not force64:
-        out = (ctypes.c_int32 * n)()
-        out_p = ctypes.byref(out)
+    dtype = _sa_dtype(n, force64, out)
+    if out is None:
+        out = np.empty(n, dtype=dtype)
+    else:
+        out = _output_buffer(out, n, dtype)
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    # with more threads than cores, the merge is not paid back
+    n_threads = min(n_threads, _available_cores())
+    if n_threads > 1 and n >= _PARALLEL_MIN_LENGTH:
+        # imported here since the blocks are sorted with this function
+        from .external import _divsufsort_parallel
+
+        if _divsufsort_parallel(inp, out, n_threads):
+            return out
+
+    out_p = _output_pointer(out)
+    if dtype == np.int32:
         retval = libdivsufsort.divsufsort(inp_p, out_p, ctypes.c_int32(n))
     else:
-        out = (ctypes.c_int64 * n)()
-        out_p = ctypes.byref(out)
         retval = libdivsufsort64.divsufsort64(inp_p, out_p, ctypes.c_int64(n))
 
     if retval:
         raise Exception("libdivsufsort error", retval)  # pragma: no cover
 
-    return np.ctypeslib.as_array(out)
+    return out
 
 
 DTYPE_NOT_SUPPORTED_MSG = (
@@ -122,16 +220,34 @@ DTYPE_NOT_SUPPORTED_MSG = (
 )
 
 
-def bw_transform(inp, sa=None, force64=False):
-    # TODO: inplace computation
-    if isinstance(inp, np.ndarray):
-        if inp.dtype == np.uint8:
-            pass
-        if inp.dtype in _SUPPORTED_DTYPES:
-            inp = _cast(inp)
-            dtype = inp.dtype
-            if dtype != np.uint8:
-                raise TypeError(DTYPE_NOT_SUPPORTED_MSG)
+def _inplace_buffer(inp):
+    """Returns a writable uint8 numpy view of inp, for inplace computations"""
+    if isinstance(inp, np.ndarray) and inp.dtype != np.uint8:
+        raise TypeError("inplace computation requires an uint8 array")
+    if isinstance(inp, (bytes, str)):
+        raise TypeError("inplace computation requires a mutable buffer")
+    return _output_buffer(inp, len(inp), np.dtype(np.uint8))
+
+
+def bw_transform(inp, sa=None, force64=False, out=None, inplace=False):
+    """
+    Burrows-Wheeler transform of inp.
+
+    Returns the primary index and the transformed string.
+
+    If `out` is given, the transformed string is written into it.
+    It can be an uint8 numpy array or any writable buffer (bytearray,
+    mmap...) of at least `len(inp)` bytes.
+    If `inplace` is True, the input is overwritten with the transform,
+    so the only memory used is the suffix array.
+    Note that libdivsufsort uses `sa` as scratch space in that case:
+    the suffix array passed is overwritten too.
+    """
+    if inplace:
+        out = inp = _inplace_buffer(inp)
+    inp = as_array(inp)
+    if inp.dtype in _SUPPORTED_DTYPES:
+        inp = _cast(inp)
 
     if sa is None:
         sa_p = None
@@ -141,8 +257,11 @@ def bw_transform(inp, sa=None, force64=False):
     n = len(inp)
     inp_p = _get_bytes_pointer(inp)
 
-    out = (ctypes.c_uint8 * n)()
-    out_p = ctypes.byref(out)
+    if out is None:
+        out = np.empty(n, dtype=np.uint8)
+    else:
+        out = _output_buffer(out, n, np.dtype(np.uint8))
+    out_p = _output_pointer(out)
     if (
         sa is not None
         and sa.dtype == np.int32
@@ -164,16 +283,26 @@ def bw_transform(inp, sa=None, force64=False):
     if retval:
         raise Exception("libdivsufsort error", retval)  # pragma: no cover
 
-    return idx.value, np.ctypeslib.as_array(out)
+    return idx.value, out
 
 
-def inverse_bw_transform(idx, bwt, force64=False):
-    # TODO: inplace computation
+def inverse_bw_transform(idx, bwt, force64=False, out=None, inplace=False):
+    """
+    Inverse Burrows-Wheeler transform.
+
+    `out` and `inplace` behave like in `bw_transform`.
+    """
+    if inplace:
+        out = bwt = _inplace_buffer(bwt)
+    bwt = as_array(bwt)
     n = len(bwt)
     bwt_p = _get_bytes_pointer(bwt)
 
-    out = (ctypes.c_uint8 * n)()
-    out_p = ctypes.byref(out)
+    if out is None:
+        out = np.empty(n, dtype=np.uint8)
+    else:
+        out = _output_buffer(out, n, np.dtype(np.uint8))
+    out_p = _output_pointer(out)
 
     if n <= np.iinfo(np.int32).max and not force64:
         retval = libdivsufsort.inverse_bw_transform(
@@ -187,31 +316,36 @@ def inverse_bw_transform(idx, bwt, force64=False):
     if retval:
         raise Exception("libdivsufsort error", retval)  # pragma: no cover
 
-    return np.ctypeslib.as_array(out)
+    return out
 
 
 def sa_search(inp, sa, pattern):
+    inp = as_array(inp)
+    pattern = _cast(as_array(pattern))
     n = len(inp)
     m = len(pattern)
 
     inp_p = _get_bytes_pointer(inp)
     sa_p = ctypes.pointer(np.ctypeslib.as_ctypes(sa))
-    if isinstance(pattern, np.ndarray):
-        pattern = _cast(pattern)
     pat_p = _get_bytes_pointer(pattern)
 
+    # sa can be a sparse suffix array, with fewer rows than characters
+    size = len(sa)
+
     if sa.dtype == np.int32:
         n = ctypes.c_int32(n)
         m = ctypes.c_int32(m)
+        size = ctypes.c_int32(size)
         left = ctypes.c_int32()
         left_p = ctypes.byref(left)
-        retval = libdivsufsort.sa_search(inp_p, n, pat_p, m, sa_p, n, left_p)
+        retval = libdivsufsort.sa_search(inp_p, n, pat_p, m, sa_p, size, left_p)
     else:
         n = ctypes.c_int64(n)
         m = ctypes.c_int64(m)
+        size = ctypes.c_int64(size)
         left = ctypes.c_int64()
         left_p = ctypes.byref(left)
-        retval = libdivsufsort64.sa_search64(inp_p, n, pat_p, m, sa_p, n, left_p)
+        retval = libdivsufsort64.sa_search64(inp_p, n, pat_p, m, sa_p, size, left_p)
 
     if retval < 0:
         raise Exception("libdivsufsort error", retval)  # pragma: no cover
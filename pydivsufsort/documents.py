@@ -0,0 +1,166 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .stringalg import _doc_search_many, _pack, kasai
+from .suffixsort import sais
+from .wonderstring import SearchResult
+
+LocateResult = namedtuple("LocateResult", ("doc_ids", "offsets"))
+
+
+def _generalized_string(text, starts):
+    """
+    Concatenation of the documents where document d is followed by
+    the separator d, and characters are shifted above the separators.
+    Since all the separators are distinct and smaller than the characters,
+    no common prefix can extend past the end of a document.
+    """
+    n_docs = len(starts) - 1
+    n = len(text) + n_docs
+    dtype = np.int32 if n + n_docs + 256 < 2**31 else np.int64
+    separators = starts[1:] + np.arange(n_docs)
+    s = np.empty(n, dtype=dtype)
+    is_char = np.ones(n, dtype=bool)
+    is_char[separators] = False
+    s[is_char] = text
+    s += n_docs
+    s[separators] = np.arange(n_docs)
+    return s, separators
+
+
+class DocumentIndex:
+    """
+    Generalized suffix array over a collection of documents.
+
+    Occurrences never span two documents, and are reported as
+    (document id, offset in the document) pairs.
+
+    Parameters
+    ----------
+
+    documents : list or tuple
+        list of strings, or a packed tuple (offsets, data) where
+        the i-th document is data[offsets[i]:offsets[i+1]] (uint8 only)
+
+    Attributes
+    ----------
+
+    text : np.ndarray
+        concatenation of the documents
+    starts : np.ndarray
+        document d is text[starts[d]:starts[d + 1]]
+    suffix_array : np.ndarray
+        positions in `text` of the suffixes of all the documents, in
+        lexicographic order. Each suffix ends with its document.
+    doc_ids : np.ndarray
+        document of each suffix array row, using the smallest unsigned dtype
+    """
+
+    def __init__(self, documents):
+        starts, text = _pack(documents)
+        if not isinstance(text, np.ndarray):
+            text = np.frombuffer(text, dtype=np.uint8)
+        self.starts = starts
+        self.text = text[: starts[len(starts) - 1]]
+        n_docs = len(starts) - 1
+
+        s, separators = _generalized_string(self.text, starts)
+        # the first rows are the separators, in document order
+        sa = sais(s, n_docs + 255)[n_docs:]
+        doc_ids = np.searchsorted(separators, sa)
+        self.doc_ids = doc_ids.astype(np.min_scalar_type(max(n_docs - 1, 0)))
+        sa -= doc_ids.astype(sa.dtype)
+        self.suffix_array = sa
+
+    def __len__(self):
+        """number of documents"""
+        return len(self.starts) - 1
+
+    @property
+    def lcp_array(self):
+        """LCP array of `suffix_array`, bounded by the ends of the documents"""
+        if not hasattr(self, "_lcp_array"):
+            s, separators = _generalized_string(self.text, self.starts)
+            sa = np.concatenate(
+                [separators, self.suffix_array + self.doc_ids.astype(s.dtype)]
+            ).astype(s.dtype)
+            self._lcp_array = kasai(s, sa)[len(self) :]
+        return self._lcp_array
+
+    def document(self, doc_id):
+        """content of a document"""
+        return self.text[self.starts[doc_id] : self.starts[doc_id + 1]]
+
+    def search_many(self, patterns, n_threads=1):
+        """
+        Search many patterns at once.
+
+        Parameters
+        ----------
+
+        patterns : list or tuple
+            list of patterns, or a packed tuple (offsets, data) where
+            the i-th pattern is data[offsets[i]:offsets[i+1]]
+        n_threads : int (default 1)
+            number of threads, None for all the cores
+
+        Returns
+        -------
+        count : np.ndarray
+            number of occurrences of each pattern
+        position : np.ndarray
+            position of the first occurrence of each pattern in the suffix array
+        """
+        offsets, data = _pack(patterns)
+        return SearchResult(
+            *_doc_search_many(
+                self.text,
+                self.suffix_array,
+                self.doc_ids,
+                self.starts,
+                data,
+                offsets,
+                n_threads,
+            )
+        )
+
+    def search(self, pattern):
+        """
+        Returns
+        -------
+        count : int
+            number of occurrences of pattern
+        position : int
+            position of the first occurrence in the suffix array
+        """
+        count, position = self.search_many([pattern])
+        return SearchResult(int(count[0]), int(position[0]))
+
+    def locate(self, pattern):
+        """
+        Occurrences of pattern, in suffix array order.
+
+        Returns
+        -------
+        doc_ids : np.ndarray
+            document of each occurrence
+        offsets : np.ndarray
+            position of each occurrence in its document
+        """
+        count, position = self.search(pattern)
+        rows = slice(position, position + count)
+        doc_ids = self.doc_ids[rows]
+        return LocateResult(doc_ids, self.suffix_array[rows] - self.starts[doc_ids])
+
+    def documents(self, pattern, return_counts=False):
+        """
+        Documents that contain pattern, each reported once, in increasing order.
+
+        If `return_counts` is True, also returns the number of occurrences
+        in each of these documents.
+        """
+        count, position = self.search(pattern)
+        return np.unique(
+            self.doc_ids[position : position + count], return_counts=return_counts
+        )
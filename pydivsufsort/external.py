@@ -0,0 +1,229 @@
+"""
+Suffix sorting by blocks, for inputs that do not fit in memory
+and to use several cores
+
+The suffix array is built in blocks: each block is sorted with
+libdivsufsort, then the sorted blocks are merged. For files, the text is
+memory-mapped and the sorted blocks are written to a temporary file, so
+only the arrays of one block are held in memory; the text, the sorted
+blocks and the outputs are accessed through memory-mapped files, whose
+pages the OS can evict at any time. In memory, the blocks are sorted
+and merged in parallel.
+"""
+
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+from .buffers import as_array
+from .divsufsort import divsufsort
+from .stringalg import (
+    _fix_undecided_ranges,
+    _merge_runs,
+    _run_in_threads,
+    _undecided_ranges,
+    kasai,
+)
+
+# integers used per position of a block: its suffix array, and the
+# permuted LCP array and LCP array computed to check the order
+_BLOCK_INTEGERS = 3
+
+# above this average LCP, comparing the suffixes directly during the merge
+# is slower than sorting the whole text with libdivsufsort
+_MAX_MEAN_LCP = 256
+
+
+def _open_text(inp):
+    """Returns a read-only uint8 view of inp, mapping it if it is a path"""
+    if isinstance(inp, (str, os.PathLike)):
+        with open(inp, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return np.empty(0, dtype=np.uint8)
+            inp = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    text = as_array(inp)
+    if text.dtype != np.uint8:
+        raise TypeError("only uint8 strings are supported")
+    return text
+
+
+def _create_array(path, dtype, n):
+    """Disk-backed array of n elements"""
+    if n == 0:
+        open(path, "wb").close()
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="w+", shape=(n,))
+
+
+def _open_array(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def _sort_block(text, start, end, runs, lcp):
+    """
+    Sorts the suffixes starting in [start, end), cut at the end of the block,
+    into runs[start:end] as positions in the block, and writes their LCP
+    array to lcp.
+    """
+    block = text[start:end]
+    kasai(block, divsufsort(block, out=runs[start:end]), out=lcp)
+
+
+def _finish_block(text, start, end, runs, lcp):
+    """
+    Fixes the order of runs[start:end] sorted by `_sort_block`,
+    and turns it into positions in the text.
+    """
+    block_sa = runs[start:end]
+    # the order of the suffixes that share a cut suffix as prefix
+    # depends on the text after the block
+    starts, ends = _undecided_ranges(block_sa, lcp)
+    if len(starts):
+        _fix_undecided_ranges(text, block_sa, lcp, starts, ends, start)
+    block_sa += block_sa.dtype.type(start)
+
+
+def _divsufsort_parallel(text, out, n_threads):
+    """
+    Sorts the suffixes of text into out, with one block per thread.
+    `out` holds the LCP arrays of the blocks until the merge.
+
+    Returns False without a result if the text is too repetitive
+    for the merge to be fast.
+    """
+    n = len(text)
+    bounds = n * np.arange(n_threads + 1, dtype=np.int64) // n_threads
+    runs = np.empty_like(out)
+    lcp_sums = np.zeros(n_threads, dtype=np.float64)
+
+    def sort_blocks(first, last):
+        for b in range(first, last):
+            lcp = out[bounds[b] : bounds[b + 1]]
+            _sort_block(text, bounds[b], bounds[b + 1], runs, lcp)
+            lcp_sums[b] = lcp.sum(dtype=np.float64)
+
+    def finish_blocks(first, last):
+        for b in range(first, last):
+            lcp = out[bounds[b] : bounds[b + 1]]
+            _finish_block(text, bounds[b], bounds[b + 1], runs, lcp)
+
+    _run_in_threads(sort_blocks, n_threads, n_threads)
+    if lcp_sums.sum() > _MAX_MEAN_LCP * n:
+        return False
+    _run_in_threads(finish_blocks, n_threads, n_threads)
+    _merge_runs(text, runs, bounds, out, None, n_threads)
+    return True
+
+
+def divsufsort_file(
+    inp, sa_path, lcp_path=None, memory_limit=1 << 30, force64=False, tmp_dir=None
+):
+    """
+    Suffix array of a text larger than memory, written to a file.
+
+    The suffix array (and the LCP array if `lcp_path` is given) is written
+    as a raw array that can be opened with `np.memmap` or `np.fromfile`.
+    Blocks of about `memory_limit / 12` positions (`memory_limit / 24`
+    with int64 suffix arrays) are sorted in memory
+    with libdivsufsort, then merged by comparing the suffixes in the
+    mapped text, so the merge is slower on very repetitive texts.
+
+    Parameters
+    ----------
+
+    inp : str, Path, mmap or bytes-like
+        path of the text, or the text itself
+    sa_path : str or Path
+        output file for the suffix array
+    lcp_path : str or Path (default None)
+        output file for the LCP array, computed during the merge
+    memory_limit : int (default 1 GiB)
+        number of bytes used by the blocks
+    force64 : bool (default False)
+        use int64 even if int32 is enough
+    tmp_dir : str or Path (default None)
+        directory of the temporary file holding the sorted blocks,
+        which has the size of the suffix array
+
+    Returns
+    -------
+    sa : np.memmap
+        read-only mapping of the suffix array file
+    lcp : np.memmap
+        read-only mapping of the LCP array file, only if `lcp_path` is given
+    """
+    text = _open_text(inp)
+    n = len(text)
+    dtype = np.int32 if n <= np.iinfo(np.int32).max and not force64 else np.int64
+    block_bytes = _BLOCK_INTEGERS * np.dtype(dtype).itemsize
+    block_size = max(1, min(memory_limit // block_bytes, np.iinfo(np.int32).max))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        runs = _create_array(os.path.join(tmp, "runs"), dtype, n)
+        bounds = np.arange(0, n + block_size, block_size, dtype=np.int64)
+        bounds[-1] = n
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            lcp = np.empty(end - start, dtype=dtype)
+            _sort_block(text, start, end, runs, lcp)
+            _finish_block(text, start, end, runs, lcp)
+            del lcp
+
+        sa = _create_array(sa_path, dtype, n)
+        lcp = None if lcp_path is None else _create_array(lcp_path, dtype, n)
+        _merge_runs(text, runs, bounds, sa, lcp)
+        del runs, sa, lcp
+
+    if lcp_path is None:
+        return _open_array(sa_path, dtype)
+    return _open_array(sa_path, dtype), _open_array(lcp_path, dtype)
+
+
+def bw_transform_file(inp, out_path, sa_path=None, memory_limit=1 << 30, **kwargs):
+    """
+    Burrows-Wheeler transform of a text larger than memory, written to a file.
+
+    The output is the same as `bw_transform`. The suffix array is read from
+    `sa_path` if the file exists (as int32 or int64 depending on its size,
+    ValueError if it matches neither), otherwise it is computed with
+    `divsufsort_file` (into `sa_path` if given, else into a temporary file).
+    Additional arguments are passed to `divsufsort_file`.
+
+    Returns
+    -------
+    idx : int
+        primary index
+    """
+    text = _open_text(inp)
+    n = len(text)
+    with tempfile.TemporaryDirectory(dir=kwargs.get("tmp_dir")) as tmp:
+        if sa_path is None:
+            sa_path = os.path.join(tmp, "sa")
+        if os.path.exists(sa_path):
+            size = os.path.getsize(sa_path)
+            if size not in (4 * n, 8 * n):
+                raise ValueError(
+                    f"{sa_path} has {size} bytes, which is not a suffix array "
+                    f"of {n} int32 or int64"
+                )
+            sa = _open_array(sa_path, np.int64 if size == 8 * n else np.int32)
+        else:
+            sa = divsufsort_file(text, sa_path, memory_limit=memory_limit, **kwargs)
+
+        idx = 0
+        chunk = max(1, memory_limit // (sa.itemsize + 2))
+        with open(out_path, "wb") as f:
+            if n:
+                f.write(text[n - 1 :].tobytes())
+            for start in range(0, n, chunk):
+                positions = np.asarray(sa[start : start + chunk])
+                first = np.flatnonzero(positions == 0)
+                if len(first):
+                    idx = start + int(first[0]) + 1
+                    positions = np.delete(positions, first[0])
+                f.write(text[positions - 1].tobytes())
+        del sa
+    return idx
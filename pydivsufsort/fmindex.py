@@ -0,0 +1,141 @@
+import numpy as np
+
+from .divsufsort import bw_transform, divsufsort
+from .stringalg import (
+    _fm_backward_search,
+    _fm_locate,
+    _fm_occ_tables,
+    handle_input,
+)
+
+
+def _check_uint8(inp):
+    inp = handle_input(inp)
+    if isinstance(inp, np.ndarray) and inp.dtype != np.uint8:
+        raise TypeError("only uint8 strings are supported")
+    return inp
+
+
+class FMIndex:
+    """
+    Compressed full-text index built on the Burrows-Wheeler transform.
+
+    Only the BWT, blocked occurrence tables and a sampled suffix array
+    are stored: the text and the suffix array can be freed once the index
+    is built. For small alphabets, the index takes about 1 to 2 bytes
+    per character.
+
+    Parameters
+    ----------
+
+    inp : string
+        string to index (uint8 only)
+    sample_rate : int (default 32)
+        one suffix array value out of `sample_rate` text positions is stored.
+        `locate` takes O(sample_rate) steps per occurrence.
+    block_size : int (default 256)
+        occurrence counts are stored every `block_size` characters.
+        Must be a power of 2 dividing 65536. Each rank query scans at most
+        `block_size` characters, and the tables use 2 * sigma / block_size
+        bytes per character where sigma is the number of distinct symbols.
+    sa : np.ndarray (default None)
+        suffix array of `inp`, computed if not provided
+    """
+
+    def __init__(self, inp, sample_rate=32, block_size=256, sa=None):
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be positive")
+        block_shift = int(block_size).bit_length() - 1
+        if block_size != 1 << block_shift or block_shift > 16:
+            raise ValueError("block_size must be a power of 2 dividing 65536")
+
+        inp = _check_uint8(inp)
+        if sa is None:
+            sa = divsufsort(inp)
+        n = len(inp)
+
+        self.n = n
+        self.sample_rate = sample_rate
+        self.block_shift = block_shift
+        self.primary, self.bwt = bw_transform(inp, sa)
+
+        counts = np.bincount(self.bwt, minlength=256)
+        symbols = np.flatnonzero(counts)
+        self.code = np.full(256, -1, dtype=np.int16)
+        self.code[symbols] = np.arange(len(symbols))
+        # rows of the BWT matrix starting with c are [C[c], C[c] + counts[c])
+        # row 0 is the empty suffix
+        self.C = np.zeros(256, dtype=np.int64)
+        self.C[1:] = np.cumsum(counts)[:-1]
+        self.C += 1
+        self.superblocks, self.blocks = _fm_occ_tables(
+            self.bwt, self.code, max(len(symbols), 1), block_shift
+        )
+
+        # row r of the BWT matrix corresponds to sa[r - 1]
+        sampled = np.zeros(n + 1, dtype=bool)
+        sampled[1:] = sa % sample_rate == 0
+        self.samples = np.ascontiguousarray(sa[sampled[1:]])
+        marks = np.packbits(sampled, bitorder="little")
+        marks = np.concatenate([marks, np.zeros(-len(marks) % 8 + 8, np.uint8)])
+        self.marks = marks.view("<u8")
+        self.marks_rank = np.zeros(len(self.marks) + 1, dtype=sa.dtype)
+        np.cumsum(
+            np.unpackbits(marks, bitorder="little").reshape(-1, 64).sum(axis=1),
+            out=self.marks_rank[1:],
+        )
+
+    @property
+    def nbytes(self):
+        """memory used by the index"""
+        return sum(
+            arr.nbytes
+            for arr in [
+                self.bwt,
+                self.code,
+                self.C,
+                self.superblocks,
+                self.blocks,
+                self.samples,
+                self.marks,
+                self.marks_rank,
+            ]
+        )
+
+    def _range(self, pattern):
+        return _fm_backward_search(
+            self.bwt,
+            self.primary,
+            self.C,
+            self.code,
+            self.superblocks,
+            self.blocks,
+            self.block_shift,
+            _check_uint8(pattern),
+        )
+
+    def count(self, pattern):
+        """Number of occurrences of pattern, in O(len(pattern))"""
+        lo, hi = self._range(pattern)
+        return hi - lo
+
+    def locate(self, pattern):
+        """
+        Positions of the occurrences of pattern, in suffix array order.
+        Each occurrence takes O(sample_rate) steps.
+        """
+        lo, hi = self._range(pattern)
+        return _fm_locate(
+            self.bwt,
+            self.primary,
+            self.C,
+            self.code,
+            self.superblocks,
+            self.blocks,
+            self.block_shift,
+            self.marks,
+            self.marks_rank,
+            self.samples,
+            lo,
+            hi,
+        )
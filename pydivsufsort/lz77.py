@@ -0,0 +1,59 @@
+"""
+LZ77 compression with the factors of `lz77_factorization`
+
+The factors are found with the suffix array, so compressing takes
+linear time after sorting the suffixes and finds the longest match
+at any distance, which suits very repetitive data like logs.
+"""
+
+from .buffers import as_array
+from .stringalg import _lz77_decode, _lz77_encode, longest_previous_factor
+
+_MAGIC = b"LZ77\x01"
+
+
+def lz77_compress(s, min_match=4):
+    """
+    Compresses a byte string.
+
+    At each position, the longest previous factor is copied if it has
+    at least `min_match` bytes, otherwise the byte is stored as a literal.
+    The output is the length of s followed by sequences of
+    (number of literals, literals, match length, distance), with
+    the integers encoded as varints.
+
+    Parameters
+    ----------
+
+    s : bytes-like or str
+        uint8 string
+    min_match : int (default 4)
+        shortest copied factor, shorter factors cost more than literals
+
+    Returns
+    -------
+    data : bytes
+    """
+    s = as_array(s)
+    if s.dtype != "uint8":
+        raise TypeError("only uint8 strings are supported")
+    if min_match < 1:
+        raise ValueError("min_match must be positive")
+    lpf, sources = longest_previous_factor(s, return_sources=True)
+    return _MAGIC + _lz77_encode(s, lpf, sources, min_match)
+
+
+def lz77_decompress(data):
+    """Decompresses the output of `lz77_compress`, as bytes"""
+    data = as_array(data)
+    if bytes(data[: len(_MAGIC)]) != _MAGIC:
+        raise ValueError("not LZ77 data")
+    pos = len(_MAGIC)
+    n = shift = 0
+    while pos < len(data):
+        n |= int(data[pos] & 0x7F) << shift
+        pos += 1
+        shift += 7
+        if data[pos - 1] < 0x80:
+            return _lz77_decode(data, pos, n)
+    raise ValueError("corrupted LZ77 data")
@@ -0,0 +1,151 @@
+import numpy as np
+
+from .divsufsort import bw_transform, divsufsort
+from .fmindex import _check_uint8
+from .stringalg import _rl_backward_search, _rl_locate
+from .storage import load_arrays, save_arrays
+
+
+class RLBWTIndex:
+    """
+    Run-length compressed BWT index (r-index), for highly repetitive texts.
+
+    The BWT is stored as r runs, with the text positions of the suffixes
+    at the ends of the runs (to find one occurrence during the search)
+    and at the starts of the runs (to find the others with the phi
+    function). The index takes O(r) space instead of O(n): about
+    50 bytes per run, which is much less than a byte per character
+    when the text is made of many similar versions.
+
+    Predecessor queries are binary searches over the runs, so `count`
+    takes O(m log r) time for a pattern of length m, and `locate` takes
+    O(log r) more per occurrence.
+
+    Parameters
+    ----------
+
+    inp : string
+        string to index (uint8 only)
+    sa : np.ndarray (default None)
+        suffix array of `inp`, computed if not provided
+    """
+
+    _ARRAYS = [
+        "run_starts",
+        "run_chars",
+        "C",
+        "char_offsets",
+        "char_runs",
+        "char_cumlen",
+        "end_samples",
+        "phi_keys",
+        "phi_values",
+    ]
+
+    def __init__(self, inp, sa=None):
+        inp = _check_uint8(inp)
+        if sa is None:
+            sa = divsufsort(inp)
+        n = len(inp)
+        primary, bwt = bw_transform(inp, sa)
+
+        # last column of the BWT matrix with n + 1 rows, -1 is the sentinel
+        last = np.empty(n + 1, dtype=np.int16)
+        last[:primary] = bwt[:primary]
+        last[primary] = -1
+        last[primary + 1 :] = bwt[primary:]
+        starts = np.flatnonzero(last[1:] != last[:-1]) + 1
+        self.run_starts = np.concatenate([[0], starts, [n + 1]]).astype(np.int64)
+        starts = self.run_starts[:-1]
+        ends = self.run_starts[1:] - 1
+        self.run_chars = last[starts]
+        del last
+
+        counts = np.bincount(bwt, minlength=256)
+        # rows starting with c are [C[c], C[c] + counts[c]), row 0 is the sentinel
+        self.C = np.ones(256, dtype=np.int64)
+        self.C[1:] += np.cumsum(counts)[:-1]
+
+        # the runs of each character, in order, and the number of
+        # occurrences of the character in its previous runs
+        lengths = ends - starts + 1
+        chars = self.run_chars.astype(np.int64)
+        order = np.argsort(chars, kind="stable")
+        order = order[chars[order] >= 0]
+        run_counts = np.bincount(chars[order], minlength=256)
+        self.char_offsets = np.zeros(257, dtype=np.int64)
+        np.cumsum(run_counts, out=self.char_offsets[1:])
+        self.char_runs = order.astype(np.int64)
+        cumlen = np.cumsum(lengths[order]) - lengths[order]
+        self.char_cumlen = cumlen - np.repeat(
+            cumlen[self.char_offsets[:-1][run_counts > 0]], run_counts[run_counts > 0]
+        )
+
+        # row j > 0 corresponds to sa[j - 1], row 0 to the position n
+        def positions(rows):
+            out = np.full(len(rows), n, dtype=np.int64)
+            out[rows > 0] = sa[rows[rows > 0] - 1]
+            return out
+
+        self.end_samples = positions(ends)
+        rows = starts[starts > 0]
+        keys = positions(rows)
+        order = np.argsort(keys)
+        self.phi_keys = keys[order]
+        self.phi_values = positions(rows - 1)[order]
+
+    @property
+    def n(self):
+        """length of the text"""
+        return int(self.run_starts[-1]) - 1
+
+    @property
+    def n_runs(self):
+        """number of runs of the BWT, counting the sentinel"""
+        return len(self.run_chars)
+
+    @property
+    def nbytes(self):
+        """memory used by the index"""
+        return sum(getattr(self, name).nbytes for name in self._ARRAYS)
+
+    def save(self, path):
+        """Save the index, see `WonderString.save`"""
+        arrays = {name: getattr(self, name) for name in self._ARRAYS}
+        save_arrays(path, arrays, {"type": type(self).__name__})
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        """Load an index saved with `save`, mapping it in memory if `mmap`"""
+        metadata, arrays = load_arrays(path, mmap)
+        if metadata.get("type") != cls.__name__:
+            raise ValueError(f"{path} does not contain a {cls.__name__}")
+        self = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(self, name, arrays[name])
+        return self
+
+    def _search(self, pattern):
+        return _rl_backward_search(
+            self.run_starts,
+            self.run_chars,
+            self.C,
+            self.char_offsets,
+            self.char_runs,
+            self.char_cumlen,
+            self.end_samples,
+            _check_uint8(pattern),
+        )
+
+    def count(self, pattern):
+        """Number of occurrences of pattern, in O(len(pattern) log r)"""
+        lo, hi, _ = self._search(pattern)
+        return hi - lo
+
+    def locate(self, pattern):
+        """
+        Positions of the occurrences of pattern, in suffix array order.
+        Each occurrence takes O(log r).
+        """
+        lo, hi, toehold = self._search(pattern)
+        return _rl_locate(self.phi_keys, self.phi_values, toehold, max(hi - lo, 0))
@@ -0,0 +1,109 @@
+"""
+On-disk format for indexes made of numpy arrays
+
+The file starts with a fixed-size preamble:
+
+- 8 bytes: magic `PYDSSIDX`
+- 4 bytes: format version (little endian uint32)
+- 4 bytes: length of the header (little endian uint32)
+
+followed by a JSON header describing the arrays, and then the raw arrays.
+Each array starts at an offset aligned to ALIGNMENT bytes, so that it can be
+mapped with `np.memmap` without any parsing or copy.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"PYDSSIDX"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_arrays(path, arrays, metadata=None):
+    """
+    Parameters
+    ----------
+
+    path : str or Path
+    arrays : dict
+        name -> np.ndarray
+    metadata : dict (default None)
+        JSON serializable information stored in the header
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+
+    # offsets are relative to the start of the data section
+    # so that they do not depend on the size of the header
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = {
+            "dtype": arr.dtype.str,
+            "shape": list(arr.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + arr.nbytes)
+    header = json.dumps({"metadata": metadata or {}, "arrays": layout}).encode()
+    header = header.ljust(_align(_PREAMBLE.size + len(header)) - _PREAMBLE.size)
+    data_start = _PREAMBLE.size + len(header)
+
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            arr.tofile(f)
+        # make sure the file covers the padding of the last array
+        f.truncate(data_start + offset)
+
+
+def load_arrays(path, mmap=True):
+    """
+    Parameters
+    ----------
+
+    path : str or Path
+    mmap : bool (default True)
+        map the arrays in memory instead of reading them.
+        The mapping is copy-on-write: the file is never modified.
+
+    Returns
+    -------
+    metadata : dict
+    arrays : dict
+        name -> np.ndarray
+    """
+    with open(path, "rb") as f:
+        magic, version, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a pydivsufsort index")
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"unsupported index version {version}, expected {FORMAT_VERSION}"
+            )
+        header = json.loads(f.read(header_size))
+        data_start = _PREAMBLE.size + header_size
+
+        arrays = {}
+        for name, desc in header["arrays"].items():
+            dtype = np.dtype(desc["dtype"])
+            shape = tuple(desc["shape"])
+            offset = data_start + desc["offset"]
+            if mmap and np.prod(shape, dtype=np.int64) > 0:
+                arr = np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=shape)
+            else:
+                f.seek(offset)
+                count = int(np.prod(shape, dtype=np.int64))
+                arr = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+            arrays[name] = arr
+
+    return header["metadata"], arrays
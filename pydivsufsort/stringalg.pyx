@@ -5,8 +5,11 @@ import numpy as np
 
 np.import_array()
 
-import warnings
-from .divsufsort import divsufsort 
+import ctypes
+
+from .divsufsort import divsufsort
+from .dll import libdivsufsort, libdivsufsort64
+from .suffixsort cimport _sais
 
 ctypedef np.uint64_t ull
 
@@ -24,146 +27,343 @@ ctypedef fused string_t:
     np.int32_t
     np.int64_t
 
-def handle_input(s):
-    if isinstance(s, np.ndarray):
-        # in my tests, converting to contiguous and using [::1]
-        # gives *slightly* better performance than using [:]
-        if not s.flags["C_CONTIGUOUS"]:
-            # Make a contiguous copy of the numpy array.
-            s = np.ascontiguousarray(s)
-    if isinstance(s, str):
-        try:
-            s = s.encode("ascii")
-            if len(s) > 999:
-                warnings.warn("converting str argument uses more memory")
-        except UnicodeEncodeError:
-            raise TypeError("str must only contain ascii chars")
-    return s
-
-
-"""
-TODO: reuse rank array for kasai and lcp_segtree
-"""
-
-def _kasai(string_t[::1] s not None, sa_t[::1] sa not None):
-
-    cdef ull i, j, n, k
-    cdef np.ndarray[sa_t, ndim=1] lcp = np.empty_like(sa) 
-    cdef np.ndarray[sa_t, ndim=1] rank = np.empty_like(sa)
-        
-    n = len(sa)
+from .buffers import as_array
+from .compact import ESCAPE, CompactLCP
+
+# every entry point converts its inputs with the same zero-copy layer
+handle_input = as_array
+
+
+cdef void _phi_range(
+        const sa_t[::1] sa,
+        sa_t[::1] phi,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    """phi[sa[i]] = sa[i + 1], and n for the last suffix which has no successor"""
+    cdef ull n = sa.shape[0]
+    cdef ull i
+    for i in range(start, end):
+        phi[sa[i]] = sa[i + 1] if i + 1 < n else n
 
-    for i in range(n):
-        rank[sa[i]] = i
+
+cdef void _plcp_range(
+        const string_t[::1] s,
+        sa_t[::1] plcp,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    """
+    Overwrites phi[i] with plcp[i] = lcp(s[i:], s[phi[i]:]) for i in [start, end).
+    Since plcp[i + 1] >= plcp[i] - 1, this takes O(end - start + max(plcp)) time.
+
+    Kärkkäinen, Juha, Giovanni Manzini, and Simon J. Puglisi.
+    "Permuted longest-common-prefix array." Combinatorial Pattern Matching
+    (CPM 2009). Springer, 2009.
+    """
+    cdef ull n = plcp.shape[0]
+    cdef ull i, j, k
 
     k = 0
-    for i in range(n):
-        if rank[i] == n - 1:
-            lcp[n-1] = k = 0
+    for i in range(start, end):
+        j = plcp[i]
+        if j == n:
+            plcp[i] = k = 0
             continue
-        j = sa[rank[i] + 1]
-        while i + k < n and j + k < n and s[i+k] == s[j+k]:
+        while i + k < n and j + k < n and s[i + k] == s[j + k]:
             k += 1
-        lcp[rank[i]] = k
+        plcp[i] = k
         if k:
             k -= 1
 
-    return lcp
 
-def _kasai_bytes(const unsigned char[::1] s not None, sa_t[::1] sa not None):
-    """Same as _kasai but with a const first argument.
-    
-    TODO: Cython does not support const fused types arguments YET
-    but it will be fixed in the 0.30 release
-    <https://github.com/pandas-dev/pandas/issues/31710>
-    """
-        
-    cdef ull i, j, n, k
-    cdef np.ndarray[sa_t, ndim=1] lcp = np.empty_like(sa) 
-    cdef np.ndarray[sa_t, ndim=1] rank = np.empty_like(sa)
-        
-    n = len(sa)
-
-    for i in range(n):
-        rank[sa[i]] = i
+cdef void _kasai_range(
+        const string_t[::1] s,
+        const sa_t[::1] sa,
+        const sa_t[::1] rank,
+        sa_t[::1] lcp,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    """Kasai's algorithm for the suffixes starting in [start, end)"""
+    cdef ull n = sa.shape[0]
+    cdef ull i, j, k
 
     k = 0
-    for i in range(n):
-        if rank[i] == n - 1:
-            lcp[n-1] = k = 0
+    for i in range(start, end):
+        if <ull>rank[i] == n - 1:
+            lcp[n - 1] = k = 0
             continue
         j = sa[rank[i] + 1]
-        while i + k < n and j + k < n and s[i+k] == s[j+k]:
+        while i + k < n and j + k < n and s[i + k] == s[j + k]:
             k += 1
         lcp[rank[i]] = k
         if k:
             k -= 1
 
-    return lcp
 
-def kasai(s, sa=None):
+cdef void _gather_range(
+        const sa_t[::1] values,
+        const sa_t[::1] index,
+        sa_t[::1] out,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    cdef ull i
+    for i in range(start, end):
+        out[i] = values[index[i]]
+
+
+# Each thread handles a range of text positions and restarts from k = 0,
+# which only costs O(max lcp) extra character comparisons per thread.
+
+def _plcp(
+        const string_t[::1] s not None,
+        const sa_t[::1] sa not None,
+        sa_t[::1] out,
+        n_threads=1,
+    ):
+    def run_phi(ull start, ull end):
+        with nogil:
+            _phi_range(sa, out, start, end)
+
+    def run_plcp(ull start, ull end):
+        with nogil:
+            _plcp_range(s, out, start, end)
+
+    _run_in_threads(run_phi, sa.shape[0], n_threads)
+    _run_in_threads(run_plcp, sa.shape[0], n_threads)
+
+
+def _lcp(
+        const string_t[::1] s not None,
+        const sa_t[::1] sa not None,
+        rank,
+        sa_t[::1] out,
+        n_threads=1,
+    ):
+    cdef const sa_t[::1] rank_view
+    cdef sa_t[::1] plcp
+
+    if rank is not None:
+        rank_view = rank
+
+        def run_kasai(ull start, ull end):
+            with nogil:
+                _kasai_range(s, sa, rank_view, out, start, end)
+
+        _run_in_threads(run_kasai, sa.shape[0], n_threads)
+        return
+
+    plcp = np.empty(sa.shape[0], dtype=np.asarray(sa).dtype)
+    _plcp(s, sa, plcp, n_threads)
+
+    def run_gather(ull start, ull end):
+        with nogil:
+            _gather_range(plcp, sa, out, start, end)
+
+    _run_in_threads(run_gather, sa.shape[0], n_threads)
+
+
+def _lcp_buffer(sa, out):
+    sa = np.ascontiguousarray(sa)
+    if out is None:
+        return sa, np.empty_like(sa)
+    if out.shape != sa.shape or out.dtype != sa.dtype:
+        raise ValueError("out must have the same dtype and length as the suffix array")
+    return sa, out
+
+
+def plcp(s, sa=None, out=None, n_threads=1):
+    """
+    Permuted LCP array: plcp[i] is the longest common prefix of s[i:]
+    and of the suffix that follows it in the suffix array.
+    The LCP array is plcp[sa].
+
+    Only `out` is used as working memory, which makes it the leanest
+    way to get the LCP information.
+
+    Parameters
+    ----------
+
+    s : string
+    sa : np.ndarray (default None)
+        suffix array, computed if not provided
+    out : np.ndarray (default None)
+        preallocated output with the same dtype and length as `sa`
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    plcp : np.ndarray
+    """
     s = handle_input(s)
     if sa is None:
         sa = divsufsort(s)
-    if isinstance(s, bytes):
-        return _kasai_bytes(s, sa)
-    return _kasai(s, sa)
+    sa, out = _lcp_buffer(sa, out)
+    _plcp(s, sa, out, n_threads)
+    return out
+
+
+cdef void _compact_gather_range(
+        const sa_t[::1] plcp,
+        const sa_t[::1] sa,
+        np.uint8_t[::1] values,
+        np.uint8_t escape,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    cdef ull i
+    for i in range(start, end):
+        values[i] = <np.uint8_t>plcp[sa[i]] if plcp[sa[i]] < escape else escape
+
+
+def _compact_lcp(s, const sa_t[::1] sa not None, n_threads=1):
+    """CompactLCP built from the permuted LCP array"""
+    plcp = np.empty(sa.shape[0], dtype=np.asarray(sa).dtype)
+    cdef sa_t[::1] plcp_view = plcp
+    values = np.empty(sa.shape[0], dtype=np.uint8)
+    cdef np.uint8_t[::1] values_view = values
+    cdef np.uint8_t escape = ESCAPE
+    _plcp(s, sa, plcp_view, n_threads)
+
+    def run_gather(ull start, ull end):
+        with nogil:
+            _compact_gather_range(plcp_view, sa, values_view, escape, start, end)
+
+    _run_in_threads(run_gather, sa.shape[0], n_threads)
+    rows = np.flatnonzero(values == ESCAPE).astype(plcp.dtype)
+    return CompactLCP.from_arrays(values, rows, plcp[np.asarray(sa)[rows]])
+
+
+def kasai(s, sa=None, rank=None, out=None, n_threads=1, compact=False):
+    """
+    LCP array: lcp[i] is the longest common prefix of the suffixes
+    starting at sa[i] and sa[i + 1], and lcp[-1] = 0.
+
+    Without `rank`, the LCP array is computed with the Phi algorithm
+    and n extra integers. With `rank`, Kasai's algorithm reuses it
+    and no extra memory is needed.
+    With `compact`, the LCP array is returned as a `CompactLCP`
+    with one byte per value, computed with the Phi algorithm.
+    `most_frequent_substrings` and `lcp_intervals` read it directly,
+    but `lcp_segtree`, `lcp_sparse_table` and the other consumers decode
+    the whole array first.
 
-def _lcp_segtree(
-        string_t[::1] s not None,
-        np.ndarray[sa_t, ndim=1] sa not None,
-        np.ndarray[sa_t, ndim=1] lcp not None
-    ):
+    Parameters
+    ----------
 
-    cdef ull i, j, n, k
-    
-    cdef np.ndarray[sa_t, ndim=1] segtree = np.concatenate([np.empty_like(lcp), lcp])
-    cdef np.ndarray rank = np.empty_like(sa)
-        
-    n = len(sa)
-    for i in range(n-1, 0, -1):
+    s : string
+    sa : np.ndarray (default None)
+        suffix array, computed if not provided
+    rank : np.ndarray (default None)
+        inverse suffix array, as returned by `lcp_segtree`
+    out : np.ndarray (default None)
+        preallocated output with the same dtype and length as `sa`
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+    compact : bool (default False)
+        return a `CompactLCP`, incompatible with `out`
+
+    Returns
+    -------
+    lcp : np.ndarray or CompactLCP
+    """
+    s = handle_input(s)
+    if sa is None:
+        sa = divsufsort(s)
+    if compact:
+        if out is not None:
+            raise ValueError("out cannot be used with compact=True")
+        return _compact_lcp(s, np.ascontiguousarray(sa), n_threads)
+    sa, out = _lcp_buffer(sa, out)
+    if rank is not None:
+        rank = np.ascontiguousarray(rank, dtype=sa.dtype)
+    _lcp(s, sa, rank, out, n_threads)
+    return out
+
+
+cdef void _segtree_range(sa_t[::1] segtree, ull start, ull end) noexcept nogil:
+    cdef ull i
+    for i in range(start, end):
         segtree[i] = min(segtree[i << 1], segtree[i << 1 | 1])
-    
-    for i in range(n):
-        rank[sa[i]] = i
 
-    return rank, segtree
 
+def _lcp_segtree(const sa_t[::1] lcp not None, n_threads=1):
+    """
+    Bottom-up segment tree with the leaves in segtree[n:].
+    The nodes of [(hi + 1) // 2, hi) only depend on nodes >= hi,
+    so they are built level by level, each level in parallel.
+    """
+    cdef ull n = lcp.shape[0]
+    cdef ull lo, hi
+    segtree = np.empty(2 * n, dtype=np.asarray(lcp).dtype)
+    segtree[n:] = lcp
+    cdef sa_t[::1] segtree_view = segtree
+
+    hi = n
+    while hi > 1:
+        lo = (hi + 1) >> 1
+
+        def run(ull start, ull end):
+            with nogil:
+                _segtree_range(segtree_view, lo + start, lo + end)
+
+        _run_in_threads(run, hi - lo, n_threads)
+        hi = lo
+
+    return segtree
 
-def lcp_segtree(s, sa=None, lcp=None):
+
+def _lcp_arrays(s, sa, lcp, rank, n_threads=1):
+    """
+    Computes the missing arrays among sa, lcp and rank,
+    sharing the rank array between kasai and the LCP structures.
+    """
     s = handle_input(s)
     if sa is None:
         sa = divsufsort(s)
+    if rank is None:
+        rank = _inverse_suffix_array(np.ascontiguousarray(sa), n_threads)
     if lcp is None:
-        lcp = kasai(s, sa)
-    if isinstance(s, bytes):
-        # tofix
-        s = bytearray(s)
-    return _lcp_segtree(s, sa, lcp)
+        lcp = kasai(s, sa, rank=rank, n_threads=n_threads)
+    # a CompactLCP is decoded
+    return sa, np.ascontiguousarray(lcp), rank
 
 
-def _lcp_query(
-        np.ndarray[sa_t, ndim=1] rank not None,
-        np.ndarray[sa_t, ndim=1] segtree not None,
-        queries
-    ):
-    cdef sa_t n, q, i
+def lcp_segtree(s, sa=None, lcp=None, rank=None, n_threads=1):
+    """
+    Segment tree for LCP queries with `lcp_query`.
 
+    `rank` (the inverse suffix array) is computed if not provided,
+    and reused to compute the LCP array if needed.
+    """
+    sa, lcp, rank = _lcp_arrays(s, sa, lcp, rank, n_threads)
+    return rank, _lcp_segtree(np.ascontiguousarray(lcp), n_threads)
+
+
+cdef void _segtree_query_range(
+        const sa_t[::1] rank,
+        const sa_t[::1] segtree,
+        const np.int64_t[:, ::1] queries,
+        sa_t[::1] ans,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    cdef ull n = rank.shape[0]
+    cdef ull i
     # note: l and r could hold 2*n-1
     # fortunately, n is at most int64
     cdef ull l, r
+    cdef sa_t res
 
-    n = len(rank)
-    q = len(queries)
-
-    cdef np.ndarray[sa_t, ndim=1] ans = np.empty(q, dtype=segtree.dtype)
-
-    # TODO: parallelize
-    # prange throws a lot of errors
-    for i in range(q):
-        l, r = queries[i]
+    for i in range(start, end):
+        l = queries[i, 0]
+        r = queries[i, 1]
         res = n - max(l, r)
-        l, r = rank[l], rank[r]
+        l = rank[l]
+        r = rank[r]
         if r < l:
             l, r = r, l
         l += n
@@ -177,66 +377,714 @@ def _lcp_query(
                 r -= 1
                 if segtree[r] < res:
                     res = segtree[r]
-            l >>= 1 
-            r >>= 1 
+            l >>= 1
+            r >>= 1
         ans[i] = res
+
+
+def _lcp_query(
+        const sa_t[::1] rank not None,
+        const sa_t[::1] segtree not None,
+        const np.int64_t[:, ::1] queries not None,
+        n_threads=1,
+    ):
+    ans = np.empty(queries.shape[0], dtype=np.asarray(segtree).dtype)
+    cdef sa_t[::1] ans_view = ans
+
+    def run(ull start, ull end):
+        with nogil:
+            _segtree_query_range(rank, segtree, queries, ans_view, start, end)
+
+    _run_in_threads(run, queries.shape[0], n_threads)
     return ans
 
-def lcp_query(segtree, queries):
-    return _lcp_query(*segtree, queries)
 
-def _levenshtein(string_t[::1] a not None, string_t[::1] b not None):
-    cdef ull n, m, i, j, d
-    n = len(a)
-    m = len(b)
-    cdef np.ndarray[np.uint64_t, ndim=2] temp = np.empty((n+1, m+1), dtype=np.uint64)
-    for i in range(n):
-        temp[i][0] = i
-    for j in range(m):
-        temp[0][j] = j
-    for i in range(n):
-        for j in range(m):
-            temp[i+1][j+1] = min(temp[i][j+1] + 1, temp[i+1][j] + 1, temp[i][j] + (a[i] != b[j]))
-    return temp[n][m]
+cdef extern from *:
+    """
+    static inline int _log2_floor(unsigned long long x) {
+    #if defined(_MSC_VER)
+        int k = 0;
+        while (x >>= 1) k++;
+        return k;
+    #else
+        return 63 - __builtin_clzll(x);
+    #endif
+    }
+    """
+    int _log2_floor(ull x) nogil
+
+
+cdef void _inverse_range(const sa_t[::1] sa, sa_t[::1] rank, ull start, ull end) noexcept nogil:
+    cdef ull i
+    for i in range(start, end):
+        rank[sa[i]] = i
+
+
+def _inverse_suffix_array(const sa_t[::1] sa not None, n_threads=1):
+    rank = np.empty(sa.shape[0], dtype=np.asarray(sa).dtype)
+    cdef sa_t[::1] rank_view = rank
+
+    def run(ull start, ull end):
+        with nogil:
+            _inverse_range(sa, rank_view, start, end)
+
+    _run_in_threads(run, sa.shape[0], n_threads)
+    return rank
+
+
+cdef void _sparse_level_range(sa_t[:, ::1] table, ull k, ull start, ull end) noexcept nogil:
+    cdef ull n = table.shape[1]
+    cdef ull half = 1ULL << (k - 1)
+    cdef ull i
+    for i in range(start, end):
+        if i + half < n:
+            table[k, i] = min(table[k - 1, i], table[k - 1, i + half])
+        else:
+            table[k, i] = table[k - 1, i]
+
+
+def _lcp_sparse_table(const sa_t[::1] lcp not None, n_threads=1):
+    """
+    table[k, i] is the minimum of lcp[i:i + 2**k]
+    (only meaningful when i + 2**k <= n)
+    """
+    cdef ull n = lcp.shape[0]
+    cdef ull levels = _log2_floor(n) + 1 if n else 1
+    cdef ull k
+    table = np.empty((levels, n), dtype=np.asarray(lcp).dtype)
+    table[0] = lcp
+    cdef sa_t[:, ::1] table_view = table
+
+    for k in range(1, levels):
+
+        def run(ull start, ull end):
+            with nogil:
+                _sparse_level_range(table_view, k, start, end)
+
+        _run_in_threads(run, n, n_threads)
+    return table
+
+
+cdef void _sparse_table_query_range(
+        const sa_t[::1] rank,
+        const sa_t[:, ::1] table,
+        const np.int64_t[:, ::1] queries,
+        sa_t[::1] ans,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    cdef ull n = rank.shape[0]
+    cdef ull i, l, r, k
+    cdef sa_t res
+
+    for i in range(start, end):
+        l = queries[i, 0]
+        r = queries[i, 1]
+        if l == r:
+            ans[i] = n - l
+            continue
+        l = rank[l]
+        r = rank[r]
+        if r < l:
+            l, r = r, l
+        # minimum of lcp[l:r]
+        k = _log2_floor(r - l)
+        res = table[k, l]
+        if table[k, r - (1ULL << k)] < res:
+            res = table[k, r - (1ULL << k)]
+        ans[i] = res
+
+
+def _sparse_table_query(
+        const sa_t[::1] rank not None,
+        const sa_t[:, ::1] table not None,
+        const np.int64_t[:, ::1] queries not None,
+        n_threads=1,
+    ):
+    ans = np.empty(queries.shape[0], dtype=np.asarray(table).dtype)
+    cdef sa_t[::1] ans_view = ans
+
+    def run(ull start, ull end):
+        with nogil:
+            _sparse_table_query_range(rank, table, queries, ans_view, start, end)
+
+    _run_in_threads(run, queries.shape[0], n_threads)
+    return ans
+
+
+def lcp_sparse_table(s, sa=None, lcp=None, rank=None, n_threads=1):
+    """
+    Sparse table for LCP queries with `lcp_query`.
+
+    Queries take O(1) time instead of O(log n) with `lcp_segtree`,
+    but the table uses n * (log2(n) + 1) integers instead of 2 * n.
+    """
+    sa, lcp, rank = _lcp_arrays(s, sa, lcp, rank, n_threads)
+    return rank, _lcp_sparse_table(np.ascontiguousarray(lcp), n_threads)
+
+
+def lcp_query(segtree, queries, n_threads=1):
+    """
+    Parameters
+    ----------
+
+    segtree : tuple
+        structure returned by `lcp_segtree` or `lcp_sparse_table`
+    queries : np.ndarray
+        (q, 2) array of pairs of positions in the string
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    lcp : np.ndarray
+        length of the longest common prefix of the suffixes
+        starting at each pair of positions
+    """
+    rank, tree = segtree
+    queries = np.ascontiguousarray(queries, dtype=np.int64).reshape(-1, 2)
+    if len(queries) and (queries.min() < 0 or queries.max() >= len(rank)):
+        raise IndexError("query out of bounds")
+    if tree.ndim == 2:
+        return _sparse_table_query(rank, tree, queries, n_threads)
+    return _lcp_query(rank, tree, queries, n_threads)
+
+
+cdef sa_t _segtree_min(const sa_t[::1] segtree, ull l, ull r) noexcept nogil:
+    """minimum of lcp[l:r], for l < r"""
+    cdef ull n = segtree.shape[0] >> 1
+    cdef sa_t res = segtree[n + l]
+    l += n
+    r += n
+    while l < r:
+        if l & 1:
+            res = min(res, segtree[l])
+            l += 1
+        if r & 1:
+            r -= 1
+            res = min(res, segtree[r])
+        l >>= 1
+        r >>= 1
+    return res
+
+
+cdef inline bint _min_at_least(
+    const sa_t[::1] segtree,
+    const sa_t[:, ::1] table,
+    bint sparse,
+    ull l,
+    ull r,
+    sa_t length,
+) noexcept nogil:
+    """whether min(lcp[l:r]) >= length, for l < r"""
+    cdef int k
+    if sparse:
+        k = _log2_floor(r - l)
+        return min(table[k, l], table[k, r - (1ULL << k)]) >= length
+    return _segtree_min(segtree, l, r) >= length
+
+
+cdef void _lcp_interval_around(
+    const sa_t[::1] segtree,
+    const sa_t[:, ::1] table,
+    bint sparse,
+    ull row,
+    sa_t length,
+    ull* lo,
+    ull* hi,
+) noexcept nogil:
+    """
+    Largest range [lo, hi) of rows around row whose suffixes
+    share a prefix of the given length with the suffix at row.
+    Each bound is found by exponential search, so the number of
+    range minimum queries is logarithmic in the size of the range.
+    """
+    cdef ull n = table.shape[1] if sparse else segtree.shape[0] >> 1
+    cdef ull good, bad, step, mid
+    # smallest good with min(lcp[good:row]) >= length
+    good = row
+    bad = row
+    step = 1
+    while good > 0:
+        mid = good - step if good > step else 0
+        if not _min_at_least(segtree, table, sparse, mid, row, length):
+            bad = mid
+            break
+        good = mid
+        step <<= 1
+    while bad != row and bad + 1 < good:
+        mid = (bad + good) >> 1
+        if _min_at_least(segtree, table, sparse, mid, row, length):
+            good = mid
+        else:
+            bad = mid
+    lo[0] = good
+    # largest good with min(lcp[row:good]) >= length, lcp[n - 1] is 0
+    good = row
+    bad = row
+    step = 1
+    while good + 1 < n:
+        mid = min(good + step, n - 1)
+        if not _min_at_least(segtree, table, sparse, row, mid, length):
+            bad = mid
+            break
+        good = mid
+        step <<= 1
+    while bad != row and good + 1 < bad:
+        mid = (bad + good) >> 1
+        if _min_at_least(segtree, table, sparse, row, mid, length):
+            good = mid
+        else:
+            bad = mid
+    hi[0] = good + 1
+
+
+cdef inline void _match_rows(
+    const sa_t[::1] segtree,
+    const sa_t[:, ::1] table,
+    bint sparse,
+    ull n,
+    ull row,
+    sa_t length,
+    ull* lo,
+    ull* hi,
+) noexcept nogil:
+    """rows of the suffixes that start like the suffix at row, for length chars"""
+    if length:
+        _lcp_interval_around(segtree, table, sparse, row, length, lo, hi)
+    else:
+        lo[0] = 0
+        hi[0] = n
+
+
+def _matching_statistics(
+    const string_t[::1] s not None,
+    const sa_t[::1] sa not None,
+    const sa_t[::1] rank not None,
+    const sa_t[::1] segtree not None,
+    const sa_t[:, ::1] table not None,
+    const string_t[::1] query not None,
+):
+    """
+    Longest prefix of each suffix of query that occurs in s.
+
+    The match of query[i + 1:] is at least the match of query[i:] minus
+    its first character, found with the suffix link rank[sa[row] + 1],
+    so the matches are extended at most 2 * len(query) times. Each extension
+    compares the next character of the current suffix, and otherwise
+    searches the rows of the current match by binary search.
+
+    Returns
+    -------
+    lengths : np.ndarray
+    lo, hi : np.ndarray
+        the occurrences of query[i:i + lengths[i]] are sa[lo[i]:hi[i]]
+    """
+    cdef ull n = sa.shape[0]
+    cdef ull m = query.shape[0]
+    cdef bint sparse = table.shape[0] > 0, known
+    lengths_arr = np.zeros(m, dtype=np.asarray(sa).dtype)
+    lo_arr = np.zeros(m, dtype=np.int64)
+    hi_arr = np.zeros(m, dtype=np.int64)
+    cdef sa_t[::1] lengths = lengths_arr
+    cdef np.int64_t[::1] lo_out = lo_arr, hi_out = hi_arr
+    cdef ull i, row = 0, lo, hi, a, b, mid, pos
+    cdef sa_t length = 0
+    cdef string_t c
+    if n == 0:
+        return lengths_arr, lo_arr, hi_arr
+
+    with nogil:
+        for i in range(m):
+            if length > 1:
+                row = rank[sa[row] + 1]
+                length -= 1
+            else:
+                length = 0
+            # whether [lo, hi) are the rows of the current match
+            known = False
+            while i + length < m:
+                c = query[i + length]
+                pos = sa[row] + length
+                if pos < n and s[pos] == c:
+                    length += 1
+                    known = False
+                    continue
+                _match_rows(segtree, table, sparse, n, row, length, &lo, &hi)
+                known = True
+                # first row of [lo, hi) whose character at offset length is >= c,
+                # the suffixes of the given length coming first
+                a = lo
+                b = hi
+                while a < b:
+                    mid = (a + b) >> 1
+                    pos = sa[mid] + length
+                    if pos < n and s[pos] >= c:
+                        b = mid
+                    else:
+                        a = mid + 1
+                if a == hi or s[sa[a] + length] != c:
+                    break
+                row = a
+                length += 1
+                known = False
+            if not known:
+                _match_rows(segtree, table, sparse, n, row, length, &lo, &hi)
+            lengths[i] = length
+            lo_out[i] = lo
+            hi_out[i] = hi
+    return lengths_arr, lo_arr, hi_arr
+
+
+cdef inline ull _band_bound(ull r, ull value, ull m, ull rest) noexcept nogil:
+    """Lower bound on the distance through cell (r, j) of the given value"""
+    return value + (m - r - rest if m - r > rest else rest - (m - r))
+
+
+cdef inline ull _block_bound(ull score, ull first, ull last, ull m, ull rest) noexcept nogil:
+    """
+    Lower bound on the distance through rows [first, last] of a column
+    where row `last` has the value `score`
+    """
+    cdef ull best = min(
+        _band_bound(first, score - min(score, last - first), m, rest),
+        _band_bound(last, score, m, rest),
+    )
+    # the bound is minimal where the remaining rows and columns are equal
+    if m >= rest and first <= m - rest <= last:
+        best = min(best, _band_bound(m - rest, score - min(score, last - m + rest), m, rest))
+    return best
+
+
+cdef ull _myers_distance(
+        const ull[:, ::1] peq,
+        ull m,
+        const string_t[::1] text,
+        ull start,
+        ull end,
+        ull max_distance,
+        ull* pv,
+        ull* mv,
+        ull* scores,
+    ) noexcept nogil:
+    """
+    Levenshtein distance between the pattern encoded in peq
+    and text[start:end], computed 64 rows at a time.
+    Returns max_distance + 1 as soon as the distance is known to exceed it.
+
+    Myers, Gene. "A fast bit-vector algorithm for approximate string
+    matching based on dynamic programming." Journal of the ACM (1999).
+
+    Hyyrö, Heikki. "A bit-vector algorithm for computing Levenshtein
+    and Damerau edit distances." Nordic Journal of Computing (2003).
+    """
+    cdef ull n = end - start
+    cdef ull words = (m + 63) >> 6
+    cdef ull last_bit = (m - 1) & 63
+    cdef ull j, w, bit, eq, xv, xh, ph, mh, lower, row
+    cdef int hin, hout
+
+    if m == 0:
+        return min(n, max_distance + 1)
+    if n > m + max_distance or m > n + max_distance:
+        return max_distance + 1
+
+    for w in range(words):
+        pv[w] = ~0ULL
+        mv[w] = 0
+        scores[w] = min((w + 1) << 6, m)
+
+    for j in range(n):
+        # the first row of the matrix increases by one at each column
+        hin = 1
+        for w in range(words):
+            eq = peq[text[start + j], w]
+            xv = eq | mv[w]
+            if hin < 0:
+                eq |= 1
+            xh = (((eq & pv[w]) + pv[w]) ^ pv[w]) | eq
+            ph = mv[w] | ~(xh | pv[w])
+            mh = pv[w] & xh
+            bit = 63 if w + 1 < words else last_bit
+            hout = <int>((ph >> bit) & 1) - <int>((mh >> bit) & 1)
+            ph <<= 1
+            mh <<= 1
+            if hin < 0:
+                mh |= 1
+            elif hin > 0:
+                ph |= 1
+            pv[w] = mh | ~(xv | ph)
+            mv[w] = ph & xv
+            scores[w] += hout
+            hin = hout
+
+        # every alignment crosses column j + 1 at some row r, and then
+        # costs at least |(m - r) - (n - j - 1)| to reach the end.
+        # Cells of a block are within 63 of the one at the end of the block.
+        lower = _band_bound(0, j + 1, m, n - j - 1)
+        for w in range(words):
+            bit = 63 if w + 1 < words else last_bit
+            row = (w << 6) + bit + 1
+            lower = min(lower, _block_bound(scores[w], row - bit, row, m, n - j - 1))
+        if lower > max_distance:
+            return max_distance + 1
+
+    return scores[words - 1]
+
+
+def _match_table(const string_t[::1] pattern not None, ull sigma):
+    """peq[c, w] has bit i set if pattern[64 * w + i] == c"""
+    cdef ull m = pattern.shape[0]
+    cdef ull i
+    peq = np.zeros((sigma, max((m + 63) >> 6, 1)), dtype=np.uint64)
+    cdef ull[:, ::1] peq_view = peq
+    with nogil:
+        for i in range(m):
+            peq_view[pattern[i], i >> 6] |= 1ULL << (i & 63)
+    return peq
+
+
+def _myers_many(
+        const ull[:, ::1] peq not None,
+        ull m,
+        const string_t[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        ull max_distance,
+        n_threads=1,
+    ):
+    cdef ull q = offsets.shape[0] - 1
+    cdef ull words = peq.shape[1]
+    distances = np.empty(q, dtype=np.int64)
+    cdef np.int64_t[::1] distances_view = distances
+
+    def run(ull start, ull end):
+        cdef ull i
+        cdef ull[:, ::1] buffers = np.empty((3, words), dtype=np.uint64)
+        with nogil:
+            for i in range(start, end):
+                distances_view[i] = _myers_distance(
+                    peq, m, data, offsets[i], offsets[i + 1], max_distance,
+                    &buffers[0, 0], &buffers[1, 0], &buffers[2, 0],
+                )
+
+    _run_in_threads(run, q, n_threads)
+    return distances
+
+
+def _levenshtein_codes(pattern, texts):
+    """
+    Maps the symbols of pattern and texts to [0, sigma)
+    where sigma - 1 is used for symbols absent from pattern.
+    Bytes are kept as is with sigma = 256.
+    """
+    if pattern.dtype == np.uint8 and texts.dtype == np.uint8:
+        return pattern, texts, 256
+    symbols, pattern = np.unique(pattern, return_inverse=True)
+    sigma = len(symbols) + 1
+    codes = np.searchsorted(symbols, texts)
+    absent = codes == len(symbols)
+    codes[absent] = 0
+    if len(symbols):
+        absent |= symbols[codes] != texts
+    codes[absent] = sigma - 1
+    return pattern.astype(np.int32), codes.astype(np.int32), sigma
+
 
+_NO_MAX_DISTANCE = np.iinfo(np.int64).max - 1
+
+
+def levenshtein(a, b, max_distance=None):
+    """
+    Levenshtein distance between a and b with the bit-parallel algorithm
+    of Myers, in O(len(a) * len(b) / 64) time and O(min(len(a), len(b))) memory.
 
-def levenshtein(a, b):
+    If `max_distance` is given, the computation stops as soon as the distance
+    is known to be larger, and max_distance + 1 is returned.
+    """
     a = handle_input(a)
     b = handle_input(b)
-    if isinstance(a, bytes):
-        # tofix
-        a = bytearray(a)
-    if isinstance(b, bytes):
-        # tofix
-        b = bytearray(b)
-    return _levenshtein(a, b)
+    if len(b) < len(a):
+        a, b = b, a
+    pattern, text, sigma = _levenshtein_codes(a, b)
+    if max_distance is None:
+        max_distance = _NO_MAX_DISTANCE
+    offsets = np.array([0, len(text)], dtype=np.int64)
+    return int(
+        _myers_many(_match_table(pattern, sigma), len(pattern), text, offsets, max_distance)[0]
+    )
+
+
+def levenshtein_many(query, candidates, max_distance=None, n_threads=1):
+    """
+    Levenshtein distances between query and each candidate.
+
+    Parameters
+    ----------
+
+    query : string
+    candidates : list or tuple
+        list of strings, or a packed tuple (offsets, data) where
+        the i-th candidate is data[offsets[i]:offsets[i+1]]
+    max_distance : int (default None)
+        distances larger than `max_distance` are reported as max_distance + 1,
+        which lets the computation stop early
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    distances : np.ndarray
+    """
+    query = handle_input(query)
+    if isinstance(candidates, tuple):
+        offsets, data = candidates
+        offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        data = handle_input(data)
+    else:
+        candidates = [handle_input(c) for c in candidates]
+        offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(c) for c in candidates])
+        data = np.concatenate(candidates) if candidates else query[:0]
+    if len(offsets) == 0 or offsets[0] != 0 or offsets[len(offsets) - 1] > len(data):
+        raise ValueError("invalid offsets")
+    pattern, data, sigma = _levenshtein_codes(query, data)
+    if max_distance is None:
+        max_distance = _NO_MAX_DISTANCE
+    return _myers_many(
+        _match_table(pattern, sigma), len(pattern), data, offsets, max_distance, n_threads
+    )
 
 from libcpp.pair cimport pair
 from libcpp.vector cimport vector
-from libcpp.map cimport map as cpp_map
-from libcpp.algorithm cimport sort
+from libcpp.algorithm cimport nth_element, sort, upper_bound
 from libcpp cimport bool
 
-# TODO: in Cython 0.30 reverse can be imported from libcpp.algorithm
-cdef extern from "<algorithm>" namespace "std" nogil:
-    void reverse[Iter](Iter first, Iter last) except +
 
+cdef np.uint8_t _LCP_ESCAPE = ESCAPE
 
-def most_frequent_substrings(
-    np.ndarray[sa_t, ndim=1] lcp not None,
-    sa_t length,
-    sa_t limit = 0,
+
+cdef inline sa_t _next_lcp(
+        const sa_t[::1] lcp,
+        const np.uint8_t[::1] values,
+        const sa_t[::1] exception_values,
+        ull i,
+        ull* exception,
+    ) noexcept nogil:
+    """
+    lcp[i] in a scan by increasing i. If lcp is empty, it is read from
+    the values and exception_values of a CompactLCP, exception being
+    the number of escaped values before row i.
+    """
+    if lcp.shape[0]:
+        return lcp[i]
+    if values[i] < _LCP_ESCAPE:
+        return values[i]
+    exception[0] += 1
+    return exception_values[exception[0] - 1]
+
+
+def _lcp_scan_arrays(lcp, dtype=None):
+    """
+    lcp, values and exception_values for the kernels that scan the LCP
+    array with `_next_lcp`, so that a CompactLCP is not decoded
+    """
+    if isinstance(lcp, CompactLCP):
+        exception_values = np.ascontiguousarray(lcp.exception_values, dtype=dtype)
+        return (
+            np.empty(0, dtype=exception_values.dtype),
+            np.ascontiguousarray(lcp.values),
+            exception_values,
+        )
+    lcp = np.ascontiguousarray(lcp, dtype=dtype)
+    return lcp, np.empty(0, dtype=np.uint8), np.empty(0, dtype=lcp.dtype)
+
+
+def _most_frequent_substrings(
+    const sa_t[::1] lcp not None,
+    const np.uint8_t[::1] values not None,
+    const sa_t[::1] exception_values not None,
+    const sa_t[::1] lengths not None,
+    ull limit = 0,
     sa_t minimum_count = 1
     ):
     """
+    Runs of lcp >= length for each of the sorted lengths, in one pass.
+    Returns a list of (positions, counts) for each length.
+    """
+    cdef ull n = max(lcp.shape[0], values.shape[0])
+    cdef ull exception = 0
+    cdef sa_t h
+    cdef ull m = lengths.shape[0]
+    cdef ull i, j, v, prev, size, k
+    # start[j] is the first row of the current run for lengths[j],
+    # for the lengths smaller than lcp[i - 1]
+    cdef vector[sa_t] start = vector[sa_t](m, 0)
+    cdef vector[vector[pair[sa_t, sa_t]]] count = vector[vector[pair[sa_t, sa_t]]](m)
+    cdef vector[ull] selected = vector[ull](m, 0)
+
+    if minimum_count < 1:
+        minimum_count = 1
+
+    with nogil:
+        prev = 0
+        for i in range(n if m else 0):
+            # the runs of lengths[:v] go on with the next row
+            v = 0
+            if i + 1 < n:
+                h = _next_lcp(lcp, values, exception_values, i, &exception)
+                v = upper_bound(&lengths[0], &lengths[0] + m, h) - &lengths[0]
+            for j in range(v, prev):
+                if i + 1 - start[j] >= <ull>minimum_count:
+                    count[j].push_back(pair[sa_t, sa_t](i + 1 - start[j], start[j]))
+            if minimum_count == 1:
+                for j in range(max(prev, v), m):
+                    count[j].push_back(pair[sa_t, sa_t](1, i))
+            for j in range(prev, v):
+                start[j] = i
+            prev = v
+
+        # select the most frequent ones, which end up sorted at the end
+        for j in range(m):
+            size = count[j].size()
+            k = limit if limit and limit < size else size
+            nth_element(count[j].begin(), count[j].begin() + (size - k), count[j].end())
+            sort(count[j].begin() + (size - k), count[j].end())
+            selected[j] = k
+
+    cdef sa_t[::1] pos_view
+    cdef sa_t[::1] cnt_view
+    results = []
+    for j in range(m):
+        k = selected[j]
+        size = count[j].size()
+        pos = np.empty(k, dtype=np.asarray(lcp).dtype)
+        cnt = np.empty(k, dtype=np.asarray(lcp).dtype)
+        pos_view = pos
+        cnt_view = cnt
+        with nogil:
+            for i in range(k):
+                pos_view[i] = count[j][size - 1 - i].second
+                cnt_view[i] = count[j][size - 1 - i].first
+        results.append((pos, cnt))
+    return results
+
+
+def most_frequent_substrings(
+    lcp, length=None, limit=0, minimum_count=1, lengths=None
+    ):
+    """
     Find the most frequent substrings of a given length in a string.
     If `limit` is not 0, only the `limit` most frequent substrings are returned.
     If `minimum_count` is not 1, only the substrings that occur at least `minimum_count` times are returned.
 
+    The most frequent substrings are selected in linear time, and only
+    the `limit` selected ones are sorted. With `lengths`, the results for
+    all the lengths are computed in a single pass over the LCP array.
+
     Parameters
     ----------
 
-    lcp : np.ndarray
+    lcp : np.ndarray or CompactLCP
         lcp array
     length : int
         length of the substrings to compare
@@ -244,7 +1092,9 @@ def most_frequent_substrings(
         number of substrings to extract, 0 for all of them
     minimum_count : int (default 1)
         ignore the substrings that occur less than `minimum_count` times
-    
+    lengths : list of int (default None)
+        lengths of the substrings, instead of `length`
+
 
     Returns
     -------
@@ -252,57 +1102,41 @@ def most_frequent_substrings(
         position in the suffix array
     counts : np.ndarray
         number of occurrences, decreasing
-    """
-    # TODO: test
-    # TODO: clean <https://stackoverflow.com/q/61176636/5133167>
 
-    cdef ull n, i, cur, cur_count, last    
-    cdef vector[pair[sa_t, sa_t]] count
-    
-    if minimum_count < 1:
-        minimum_count = 1
-
-    n = len(lcp)
-    cur = 0
-    cur_count = 1
-    for i in range(n-1):
-        if lcp[i] >= length:
-            cur_count += 1
-        else:
-            if cur_count >= minimum_count:
-                count.push_back((cur_count, cur))
-            cur = i + 1
-            cur_count = 1
-    if cur_count >= minimum_count:
-        count.push_back((cur_count, cur))
-
-    sort(count.begin(), count.end())
-    reverse(count.begin(), count.end())
-    if limit and limit < count.size():
-        count.resize(limit)
-    
-    n = count.size()
-    cdef np.ndarray[sa_t, ndim=1] pos = np.empty(n, dtype=lcp.dtype) 
-    cdef np.ndarray[sa_t, ndim=1] cnt = np.empty(n, dtype=lcp.dtype) 
-
-    for i in range(n):
-        pos[i] = count[i].second
-        cnt[i] = count[i].first
-
-    return pos, cnt
-
-
-cpdef repeated_substrings(ull[::1] suffix_array, ull[::1] lcp):
+    or, with `lengths`, a dict that maps each length to (positions, counts)
+    """
+    if (length is None) == (lengths is None):
+        raise ValueError("exactly one of length and lengths must be given")
+    lcp, values, exception_values = _lcp_scan_arrays(lcp)
+    if length is not None:
+        return _most_frequent_substrings(
+            lcp,
+            values,
+            exception_values,
+            np.array([length], dtype=lcp.dtype),
+            limit,
+            minimum_count,
+        )[0]
+    lengths = np.unique(np.asarray(lengths, dtype=lcp.dtype))
+    results = _most_frequent_substrings(
+        lcp, values, exception_values, lengths, limit, minimum_count
+    )
+    return dict(zip(lengths.tolist(), results))
+
+
+def repeated_substrings(suffix_array, lcp):
     """
     See https://github.com/louisabraham/pydivsufsort/issues/42 for more details
-    
+
+    Same as `lcp_intervals(lcp)`, as a list.
+
     Parameters
     ----------
     suffix_array : np.ndarray
         suffix array
     lcp : np.ndarray
         lcp array
-    
+
     Returns
     -------
     ranges : list
@@ -310,258 +1144,2147 @@ cpdef repeated_substrings(ull[::1] suffix_array, ull[::1] lcp):
         All positions in suffix_array[start:end] correspond to
         the same repeated substring with that length.
     """
-    cdef vector[pair[ull, ull]] stack
-    cdef pair[ull, ull] key
-    cdef ull n, idx, end_pos, len_range, start, length
-    cdef list ans = []
-    n = len(lcp)
-    for idx in range(n):
-        if stack.empty() or lcp[idx] > stack.back().first:
-            if lcp[idx] > 0:
-                stack.push_back((lcp[idx], idx))
-        else:
-            while not stack.empty() and lcp[idx] < stack.back().first:
-                length, start = stack.back()
+    return list(zip(*(a.tolist() for a in lcp_intervals(lcp))))
+
+
+cdef struct _LCPInterval:
+    np.int64_t length
+    np.int64_t start
+    # common left character of the suffixes, unless diverse
+    np.int64_t left
+    bint diverse
+    bint has_child_interval
+    np.int64_t n_children
+    # reported descendants whose parent is not reported yet
+    np.int64_t pending_head
+    np.int64_t pending_tail
+
+
+cdef enum:
+    _INTERVALS_ALL = 0
+    _INTERVALS_MAXIMAL = 1
+    _INTERVALS_SUPERMAXIMAL = 2
+
+
+cdef inline void _merge_interval(_LCPInterval& parent, const _LCPInterval& child, vector[np.int64_t]& pending_next) noexcept nogil:
+    parent.diverse = parent.diverse or child.diverse or parent.left != child.left
+    parent.n_children += 1
+    if child.pending_head == -1:
+        return
+    if parent.pending_head == -1:
+        parent.pending_head = child.pending_head
+    else:
+        pending_next[parent.pending_tail] = child.pending_head
+    parent.pending_tail = child.pending_tail
+
+
+cdef object _vector_array(sa_t* data, size_t size):
+    """copy of a vector as a numpy array"""
+    if size == 0:
+        return np.empty(0, dtype=np.int32 if sa_t is np.int32_t else np.int64)
+    return np.array(<sa_t[:size]>data)
+
+
+def _lcp_intervals(
+    const sa_t[::1] lcp not None,
+    const np.uint8_t[::1] values not None,
+    const sa_t[::1] exception_values not None,
+    const sa_t[::1] sa not None,
+    const string_t[::1] s not None,
+    int kind,
+    np.int64_t min_length,
+    np.int64_t min_count,
+    bint tree,
+):
+    """
+    Bottom-up traversal of the LCP intervals, see `lcp_intervals`.
+    sa and s are only read for the maximal and supermaximal repeats.
+    """
+    cdef np.int64_t n = max(lcp.shape[0], values.shape[0])
+    cdef ull exception = 0
+    cdef vector[_LCPInterval] stack
+    cdef vector[sa_t] starts, ends, lengths, n_children
+    cdef vector[np.int64_t] parents, pending_next, chars
+    cdef _LCPInterval cur, top
+    cdef np.int64_t r, h, row, i
+    cdef bint report
+
+    with nogil:
+        for r in range(n):
+            # leaf r
+            cur.length = -1
+            cur.start = r
+            cur.left = 0
+            cur.diverse = True
+            if kind != _INTERVALS_ALL and sa[r] > 0:
+                cur.left = <np.int64_t>s[sa[r] - 1]
+                cur.diverse = False
+            cur.has_child_interval = False
+            cur.pending_head = cur.pending_tail = -1
+            # -1 closes all the intervals after the last row
+            if r + 1 < n:
+                h = _next_lcp(lcp, values, exception_values, r, &exception)
+            else:
+                h = -1
+            while True:
+                if stack.empty() or stack.back().length < h:
+                    if h >= 0:
+                        top = cur
+                        top.length = h
+                        top.has_child_interval = cur.length >= 0
+                        top.n_children = 1
+                        stack.push_back(top)
+                    break
+                _merge_interval(stack.back(), cur, pending_next)
+                if cur.length >= 0:
+                    stack.back().has_child_interval = True
+                if stack.back().length == h:
+                    break
+                top = stack.back()
                 stack.pop_back()
-                ans.append((start, idx + 1, length))
 
-            if stack.empty() and lcp[idx] > 0 or lcp[idx] > stack.back().first:
-                stack.push_back((lcp[idx], start))
-    # stack is empty because lcp[n-1] == 0
-    # note: lcp[n-2] is also 0 because of sep
+                report = r + 1 - top.start >= min_count and top.length >= min_length
+                if kind != _INTERVALS_ALL:
+                    report = report and top.diverse
+                if kind == _INTERVALS_SUPERMAXIMAL:
+                    # no interval inside, and distinct left characters
+                    report = report and not top.has_child_interval
+                if kind == _INTERVALS_SUPERMAXIMAL and report:
+                    chars.clear()
+                    for i in range(top.start, r + 1):
+                        if sa[i] > 0:
+                            chars.push_back(<np.int64_t>s[sa[i] - 1])
+                    sort(chars.begin(), chars.end())
+                    for i in range(1, <np.int64_t>chars.size()):
+                        if chars[i] == chars[i - 1]:
+                            report = False
+                            break
+                if report:
+                    row = starts.size()
+                    starts.push_back(top.start)
+                    ends.push_back(r + 1)
+                    lengths.push_back(top.length)
+                    if tree:
+                        n_children.push_back(top.n_children)
+                        parents.push_back(-1)
+                        pending_next.push_back(-1)
+                        i = top.pending_head
+                        while i != -1:
+                            parents[i] = row
+                            i = pending_next[i]
+                        top.pending_head = top.pending_tail = row
+                cur = top
+
+    result = (
+        _vector_array(starts.data(), starts.size()),
+        _vector_array(ends.data(), ends.size()),
+        _vector_array(lengths.data(), lengths.size()),
+    )
+    if tree:
+        result += (
+            _vector_array(parents.data(), parents.size()),
+            _vector_array(n_children.data(), n_children.size()),
+        )
+    return result
+
+
+_INTERVAL_KINDS = {
+    "all": _INTERVALS_ALL,
+    "maximal": _INTERVALS_MAXIMAL,
+    "supermaximal": _INTERVALS_SUPERMAXIMAL,
+}
+
+
+def lcp_intervals(
+    lcp, s=None, sa=None, kind="all", min_length=1, min_count=2, return_tree=False
+):
+    """
+    LCP intervals, the internal nodes of the virtual suffix tree.
 
-    return ans
+    An LCP interval [start, end) of length L is a maximal range of suffix
+    array rows whose suffixes share a prefix of length L, that is
+    a repeated substring that occurs end - start times and cannot be
+    extended to the right. The intervals are enumerated bottom-up in one
+    pass, so each interval comes after all the intervals it contains.
+
+    Parameters
+    ----------
 
+    lcp : np.ndarray or CompactLCP
+        LCP array (int32 and int64 are used without conversion)
+    s : string (default None)
+        text, required for the maximal and supermaximal repeats
+    sa : np.ndarray (default None)
+        suffix array, required for the maximal and supermaximal repeats
+    kind : str (default "all")
+        "all" for all the intervals (the repeats that cannot be extended
+        to the right), "maximal" for the maximal repeats
+        (the characters before the occurrences are not all equal)
+        or "supermaximal" for the supermaximal repeats (maximal repeats
+        that are not contained in another one: the interval contains
+        no other interval and the characters before the occurrences
+        are all distinct)
+    min_length : int (default 1)
+        minimum length of the repeats, 0 to include the root
+    min_count : int (default 2)
+        minimum number of occurrences
+    return_tree : bool (default False)
+        also return the parent and the number of children of each interval
 
-def _common_substrings(np.ndarray[ull, ndim=1] suffix_array, ull[::1] lcp, ull len1, ull limit):
-    n = len(suffix_array)
-    ranges = repeated_substrings(suffix_array, lcp)
-    # origin_cumsum can be use to check faster that
-    # a range contains only suffixes from s1 or s2
-    cdef char [::1] origin = suffix_array < len1
-    cdef np.ndarray[ull, ndim=1] origin_cumsum = np.empty(n + 1, dtype=np.uint64)
-    origin_cumsum[0] = 0
-    origin_cumsum[1:] = np.cumsum(origin)
-
-    cdef cpp_map[pair[ull, ull], ull] ans
-    cdef vector[np.uint64_t] start1, start2
-    ranges.sort(key=lambda x: x[2]) # sort to avoid membership test
-    cdef ull start, end, length, diff, i, j, l
-    for start, end, length in ranges:
-        if length < limit:
-            continue
-        diff = origin_cumsum[end] - origin_cumsum[start]
-        if diff == 0 or diff == end - start:
-            continue
-        start1.clear()
-        start2.clear()
-        for i in range(start, end):
-            pos = suffix_array[i]
-            if origin[i]: # might be faster than pos < len1 thanks to cache lookup
-                start1.push_back(pos)
+    Returns
+    -------
+    start : np.ndarray
+    end : np.ndarray
+        the occurrences of interval i are sa[start[i]:end[i]]
+    length : np.ndarray
+        length of the repeats
+    parent : np.ndarray
+        index of the smallest returned interval that contains interval i,
+        or -1 (only if return_tree is True)
+    n_children : np.ndarray
+        number of children of interval i in the suffix tree, counting
+        the leaves (only if return_tree is True)
+    """
+    if kind not in _INTERVAL_KINDS:
+        raise ValueError(f"kind must be one of {list(_INTERVAL_KINDS)}")
+    if not isinstance(lcp, CompactLCP):
+        lcp = np.asarray(lcp)
+    dtype = lcp.dtype if lcp.dtype in (np.int32, np.int64) else np.int64
+    lcp, values, exception_values = _lcp_scan_arrays(lcp, dtype)
+    if kind == "all":
+        s = np.empty(0, dtype=np.uint8)
+        sa = lcp
+    elif s is None or sa is None:
+        raise ValueError(f"s and sa are required for the {kind} repeats")
+    else:
+        s = handle_input(s)
+        sa = np.ascontiguousarray(sa, dtype=lcp.dtype)
+    result = _lcp_intervals(
+        lcp,
+        values,
+        exception_values,
+        sa,
+        s,
+        _INTERVAL_KINDS[kind],
+        min_length,
+        min_count,
+        return_tree,
+    )
+    return result if return_tree else result[:3]
+
+
+cdef struct _PairGroup:
+    # positions of one string with the same left character, as a linked list
+    # of suffix array rows
+    int origin
+    np.int64_t left
+    np.int64_t head
+    np.int64_t tail
+
+
+cdef inline bint _group_less(const _PairGroup& a, const _PairGroup& b) noexcept nogil:
+    return a.origin < b.origin or a.origin == b.origin and a.left < b.left
+
+
+cdef void _merge_groups(
+    vector[_PairGroup]& groups, size_t first, size_t middle,
+    vector[_PairGroup]& tmp, np.int64_t[::1] nxt
+) noexcept nogil:
+    """merges the sorted groups [first, middle) and [middle, end)"""
+    cdef size_t i = first, j = middle, end = groups.size()
+    cdef _PairGroup g
+    tmp.clear()
+    while i < middle or j < end:
+        if j == end or i < middle and _group_less(groups[i], groups[j]):
+            tmp.push_back(groups[i])
+            i += 1
+        elif i == middle or _group_less(groups[j], groups[i]):
+            tmp.push_back(groups[j])
+            j += 1
+        else:
+            g = groups[i]
+            if g.head == -1:
+                g = groups[j]
+            elif groups[j].head != -1:
+                nxt[g.tail] = groups[j].head
+                g.tail = groups[j].tail
+            tmp.push_back(g)
+            i += 1
+            j += 1
+    groups.resize(first)
+    groups.insert(groups.end(), tmp.begin(), tmp.end())
+
+
+def _maximal_pairs(
+    const np.int64_t[::1] sa not None,
+    const np.int64_t[::1] lcp not None,
+    const np.int64_t[::1] left not None,
+    np.int64_t len1,
+    np.int64_t limit,
+    np.int64_t chunk_size,
+    np.int64_t max_results,
+    bint per_position,
+):
+    """
+    Maximal pairs between s1 and s2 of length at least limit, in chunks.
+
+    sa and lcp are the arrays of s1 + sep + s2, left[r] is the character
+    before the suffix sa[r], or -1 at the start of s1 or s2.
+
+    The LCP intervals are traversed bottom-up. Each interval keeps the
+    positions of its suffixes, grouped by string and left character.
+    When a child is merged into an interval of length L, the positions of
+    the child and of the previous children have a longest common prefix
+    of exactly L, so all the pairs from different strings and with
+    different left characters are maximal. The time is O(n sigma^2 + k)
+    for k results and sigma distinct characters, and each pair is found once.
+
+    With per_position, a position of s1 is reported only with its first
+    pair, which is its longest one since the intervals are traversed
+    bottom-up, and removed from its group.
+
+    Yields
+    ------
+    idx1, idx2, length : np.ndarray
+        int64 arrays of at most chunk_size pairs
+    """
+    cdef np.int64_t n = sa.shape[0]
+    cdef np.int64_t[::1] nxt = np.empty(n, dtype=np.int64)
+    cdef vector[_PairGroup] groups, tmp
+    # (length, first group) of the intervals being built
+    cdef vector[pair[np.int64_t, size_t]] stack
+    cdef _PairGroup leaf
+    cdef size_t first, middle, a, b, ga, gb
+    cdef np.int64_t r, h, length, x, y, prev, count = 0, total = 0
+    cdef np.int64_t[::1] out1, out2, out_len
+    if limit < 1:
+        limit = 1
+
+    out1 = np.empty(chunk_size, dtype=np.int64)
+    out2 = np.empty(chunk_size, dtype=np.int64)
+    out_len = np.empty(chunk_size, dtype=np.int64)
+    stack.push_back(pair[np.int64_t, size_t](0, 0))
+    for r in range(n):
+        middle = groups.size()
+        # the separator is not in any string
+        if sa[r] != len1:
+            leaf.origin = sa[r] > len1
+            leaf.left = left[r]
+            leaf.head = leaf.tail = r
+            nxt[r] = -1
+            groups.push_back(leaf)
+        h = lcp[r] if r + 1 < n else 0
+        while True:
+            length = stack.back().first
+            if length < h:
+                stack.push_back(pair[np.int64_t, size_t](h, middle))
+                break
+            first = stack.back().second
+            if length > h:
+                stack.pop_back()
+
+            if length >= limit:
+                for a in range(middle, groups.size()):
+                    for b in range(first, middle):
+                        if groups[a].origin == groups[b].origin:
+                            continue
+                        if groups[a].left == groups[b].left and groups[a].left != -1:
+                            continue
+                        # ga is the group of s1
+                        if groups[a].origin == 0:
+                            ga, gb = a, b
+                        else:
+                            ga, gb = b, a
+                        if groups[gb].head == -1:
+                            continue
+                        prev = -1
+                        x = groups[ga].head
+                        while x != -1:
+                            y = groups[gb].head
+                            while y != -1:
+                                out1[count] = sa[x]
+                                out2[count] = sa[y] - len1 - 1
+                                out_len[count] = length
+                                count += 1
+                                total += 1
+                                if total == max_results:
+                                    yield (
+                                        np.asarray(out1[:count]),
+                                        np.asarray(out2[:count]),
+                                        np.asarray(out_len[:count]),
+                                    )
+                                    return
+                                if count == chunk_size:
+                                    yield (
+                                        np.asarray(out1),
+                                        np.asarray(out2),
+                                        np.asarray(out_len),
+                                    )
+                                    out1 = np.empty(chunk_size, dtype=np.int64)
+                                    out2 = np.empty(chunk_size, dtype=np.int64)
+                                    out_len = np.empty(chunk_size, dtype=np.int64)
+                                    count = 0
+                                if per_position:
+                                    break
+                                y = nxt[y]
+                            if per_position:
+                                # x is reported, remove it from its group
+                                if prev == -1:
+                                    groups[ga].head = nxt[x]
+                                else:
+                                    nxt[prev] = nxt[x]
+                                if groups[ga].tail == x:
+                                    groups[ga].tail = prev
+                            else:
+                                prev = x
+                            x = nxt[x]
+
+            _merge_groups(groups, first, middle, tmp, nxt)
+            if length == h:
+                break
+            middle = first
+    if count:
+        yield (
+            np.asarray(out1[:count]),
+            np.asarray(out2[:count]),
+            np.asarray(out_len[:count]),
+        )
+
+
+cdef struct _ApproxFrame:
+    # rows [lo, hi) of the suffixes that share their first depth characters
+    np.int64_t lo
+    np.int64_t hi
+    np.int64_t depth
+    # mismatches so far, for the Hamming distance
+    np.int64_t errors
+
+
+def _search_approx(
+    const string_t[::1] s not None,
+    const sa_t[::1] sa not None,
+    const string_t[::1] pattern not None,
+    np.int64_t k,
+    bint edit=False,
+):
+    """
+    Occurrences of pattern in s with at most k mismatches, or at most k
+    edits if `edit`, by backtracking over the suffix array intervals.
+
+    The children of an interval at a given depth are its runs of equal
+    characters at that depth, found by binary search, and a branch is
+    abandoned as soon as its distance exceeds k. With edits, each branch
+    keeps the column of the dynamic programming matrix of its depth, and
+    a row is reported at every depth where the whole pattern matches
+    within k edits, so a position can be reported several times.
+
+    Returns
+    -------
+    positions, distances : np.ndarray
+    """
+    cdef np.int64_t n = s.shape[0]
+    cdef np.int64_t m = pattern.shape[0]
+    cdef np.int64_t width = m + 1
+    cdef vector[_ApproxFrame] stack
+    # the column of depth d is cols[d * width:(d + 1) * width]
+    cdef vector[np.int64_t] cols
+    cdef vector[np.int64_t] positions
+    cdef vector[np.int64_t] distances
+    cdef _ApproxFrame frame
+    cdef np.int64_t lo, hi, mid, d, i, j, dist, best, errors
+    cdef np.int64_t* prev
+    cdef np.int64_t* cur
+    cdef string_t c
+
+    with nogil:
+        if edit:
+            cols.resize(width)
+            for j in range(width):
+                cols[j] = j
+        stack.push_back(_ApproxFrame(0, sa.shape[0], 0, 0))
+        while stack.size():
+            frame = stack.back()
+            stack.pop_back()
+            d = frame.depth
+            if edit:
+                if d:
+                    if <np.int64_t>cols.size() < (d + 1) * width:
+                        cols.resize((d + 1) * width)
+                    prev = &cols[(d - 1) * width]
+                    cur = prev + width
+                    c = s[sa[frame.lo] + d - 1]
+                    cur[0] = best = d
+                    for j in range(1, width):
+                        cur[j] = min(
+                            min(prev[j], cur[j - 1]) + 1,
+                            prev[j - 1] + (pattern[j - 1] != c),
+                        )
+                        best = min(best, cur[j])
+                    if best > k:
+                        continue
+                dist = cols[d * width + m]
             else:
-                start2.push_back(pos - len1 - 1)
-        sort(start1.begin(), start1.end())
-        sort(start2.begin(), start2.end())
-        for i in start1:
-            for j in start2:
-                # deduplicate start positions
-                # needed first to remove smaller matches
-                ans[i, j] = length
-    
-    # deduplicate end positions
-    cdef cpp_map[pair[ull, ull], ull] ans1
-    for (i, j), l in ans:
-        i += l
-        j += l
-        if ans1[i, j] < l:
-            ans1[i, j] = l
-    
-    ans2 = [(i - l, j - l, l) for (i, j), l in ans1]
-    ans2.sort()
-    return ans2
-
-
-cdef inline ull _clip(ull x, ull n):
+                dist = frame.errors if d == m else k + 1
+            if dist <= k:
+                for i in range(frame.lo, frame.hi):
+                    positions.push_back(sa[i])
+                    distances.push_back(dist)
+            if not edit and d == m:
+                continue
+
+            lo = frame.lo
+            # the suffix of length d, if any, comes first and has no child
+            if lo < frame.hi and sa[lo] + d == n:
+                lo += 1
+            while lo < frame.hi:
+                c = s[sa[lo] + d]
+                # first row whose character at depth d is greater than c
+                i = lo + 1
+                hi = frame.hi
+                while i < hi:
+                    mid = (i + hi) >> 1
+                    if s[sa[mid] + d] <= c:
+                        i = mid + 1
+                    else:
+                        hi = mid
+                if edit:
+                    stack.push_back(_ApproxFrame(lo, hi, d + 1, 0))
+                else:
+                    errors = frame.errors + (pattern[d] != c)
+                    if errors <= k:
+                        stack.push_back(_ApproxFrame(lo, hi, d + 1, errors))
+                lo = hi
+
+    return (
+        _vector_array(positions.data(), positions.size()),
+        _vector_array(distances.data(), distances.size()),
+    )
+
+
+cdef inline ull _clip(ull x, ull n) noexcept nogil:
     if x < n:
         return x
     return x - n
 
 
-def _min_rotation(string_t[::1] s):
-    cdef ull a = 0
-    cdef ull n = len(s)
-    cdef ull b = 0, i
-    while b < n:
-        for i in range(n):
-            if a + i == b or s[_clip(a + i, n)] < s[_clip(b + i, n)]:
-                if i > 1:
-                    b += i - 1
-                break
-            if s[_clip(a + i, n)] > s[_clip(b + i, n)]:
-                a = b
-                break
-        b += 1
-    return a
+cdef ull _min_rotation_kernel(const string_t[::1] s) noexcept nogil:
+    """
+    Duval's Lyndon factorization of s + s: the minimum rotation starts
+    at the last Lyndon factor starting in the first half.
+    Each comparison moves i or j forward, so it takes at most 4n comparisons.
+    """
+    cdef ull n = s.shape[0]
+    cdef ull i = 0, j, k, ans = 0
+    while i < n:
+        ans = i
+        j = i + 1
+        k = i
+        while j < 2 * n and s[_clip(k, n)] <= s[_clip(j, n)]:
+            if s[_clip(k, n)] < s[_clip(j, n)]:
+                k = i
+            else:
+                k += 1
+            j += 1
+        while i <= k:
+            i += j - k
+    return ans
 
 
-def _min_rotation_bytes(const unsigned char[::1] s):
-    cdef ull a = 0
-    cdef ull n = len(s)
-    cdef ull b = 0, i
-    while b < n:
-        for i in range(n):
-            if a + i == b or s[_clip(a + i, n)] < s[_clip(b + i, n)]:
-                if i > 1:
-                    b += i - 1
-                break
-            if s[_clip(a + i, n)] > s[_clip(b + i, n)]:
-                a = b
-                break
-        b += 1
-    return a
+cdef void _rotate(const string_t[::1] s, ull k, string_t[::1] out) noexcept nogil:
+    cdef ull n = s.shape[0], i
+    for i in range(n):
+        out[i] = s[_clip(i + k, n)]
 
 
-def min_rotation(s):
-    s = handle_input(s)
-    if isinstance(s, bytes):
-        return _min_rotation_bytes(s)
-    return _min_rotation(s)
+def _min_rotation(const string_t[::1] s not None, bint rotate=False):
+    cdef ull a
+    rotated = np.empty(s.shape[0] if rotate else 0, dtype=np.asarray(s).dtype)
+    cdef string_t[::1] rotated_view = rotated
+    with nogil:
+        a = _min_rotation_kernel(s)
+        if rotate:
+            _rotate(s, a, rotated_view)
+    return rotated if rotate else a
+
+
+def min_rotation(s, rotate=False):
+    """
+    Start of the lexicographically smallest rotation of s (the smallest
+    one if s is periodic), in O(n).
+
+    If `rotate` is True, returns the rotation itself as a numpy array.
+    """
+    return _min_rotation(handle_input(s), rotate)
+
+
+def _min_rotation_many(
+        const string_t[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        np.int64_t[::1] out not None,
+        string_t[::1] rotated not None,
+        bint rotate,
+        n_threads=1,
+    ):
+    def run(ull start, ull end):
+        cdef ull i, a, b
+        with nogil:
+            for i in range(start, end):
+                a = offsets[i]
+                b = offsets[i + 1]
+                out[i] = _min_rotation_kernel(data[a:b])
+                if rotate:
+                    _rotate(data[a:b], out[i], rotated[a:b])
+
+    _run_in_threads(run, offsets.shape[0] - 1, n_threads)
+
+
+def min_rotation_many(records, rotate=False, n_threads=1):
+    """
+    Minimum rotations of many strings, in one call with the GIL released.
+
+    Parameters
+    ----------
+
+    records : list or tuple
+        list of strings, or a packed tuple (offsets, data) where
+        the i-th record is data[offsets[i]:offsets[i+1]]
+        (data can have any integer dtype)
+    rotate : bool (default False)
+        return the rotated records instead of the starts
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    starts : np.ndarray
+        start of the minimum rotation of each record
+
+    or, with `rotate`, the packed tuple (offsets, rotated records)
+    """
+    offsets, data = _pack(records, any_dtype=True)
+    data = as_array(data)
+    starts = np.empty(len(offsets) - 1, dtype=np.int64)
+    rotated = np.empty(len(data) if rotate else 0, dtype=data.dtype)
+    _min_rotation_many(data, offsets, starts, rotated, rotate, n_threads)
+    if rotate:
+        return offsets, rotated[: offsets[len(offsets) - 1]]
+    return starts
 
 
 def _longest_previous_factor(
-        string_t[::1] s not None,
+        const string_t[::1] s not None,
         np.ndarray[sa_t, ndim=1] sa not None,
-        np.ndarray[sa_t, ndim=1] lcp not None
+        np.ndarray[sa_t, ndim=1] lcp not None,
+        bint return_sources=False,
     ):
     """
     Crochemore, Maxime, Lucian Ilie, and William F. Smyth.
     "A simple algorithm for computing the Lempel Ziv factorization."
     Data Compression Conference (DCC 2008). IEEE, 2008.
+
+    The stack holds rows whose positions increase, so the row below
+    the top is the previous smaller position in suffix array order.
+    With return_sources, the previous occurrence (PrevOcc) of the factor
+    is taken from the neighbor with the largest common prefix.
     """
     cdef ull n, i
     n = len(sa)
-    
-    sa = np.concatenate([sa, np.array([-1], dtype=sa.dtype)])
-    lcp = np.concatenate([np.array([0], dtype=sa.dtype), lcp])
-    
-    cdef vector[sa_t] stack = [0]
-    cdef np.ndarray[sa_t, ndim=1] lpf = np.empty(n, dtype=sa.dtype) 
 
+    cdef sa_t[::1] sa_view = np.concatenate([sa, np.array([-1], dtype=sa.dtype)])
+    cdef sa_t[::1] lcp_view = np.concatenate([np.array([0], dtype=sa.dtype), lcp])
 
-    for i in range(1, n + 1):
-        while stack.size() > 0 and (
-            (sa[i] < sa[stack.back()]) or
-            ((sa[i] > sa[stack.back()]) and (lcp[i] <= lcp[stack.back()]))
-        ):
-            if sa[i] < sa[stack.back()]:
-                lpf[sa[stack.back()]] = max(lcp[stack.back()], lcp[i])
-                lcp[i] = min(lcp[stack.back()], lcp[i])
-            else:
-                lpf[sa[stack.back()]] = lcp[stack.back()]
-            stack.pop_back()
-        
-        if i < n:
-            stack.push_back(i)
-    
+    cdef vector[sa_t] stack = [0]
+    cdef sa_t top, source
+    lpf = np.empty(n, dtype=sa.dtype)
+    cdef sa_t[::1] lpf_view = lpf
+    sources = np.empty(n if return_sources else 0, dtype=sa.dtype)
+    cdef sa_t[::1] sources_view = sources
+
+    with nogil:
+        for i in range(1, n + 1):
+            while stack.size() > 0 and (
+                (sa_view[i] < sa_view[stack.back()]) or
+                ((sa_view[i] > sa_view[stack.back()]) and (lcp_view[i] <= lcp_view[stack.back()]))
+            ):
+                top = stack.back()
+                stack.pop_back()
+                # the previous smaller position, or none if the lcp is 0
+                source = sa_view[stack.back()] if lcp_view[top] else -1
+                if sa_view[i] < sa_view[top]:
+                    if lcp_view[i] > lcp_view[top]:
+                        source = sa_view[i]
+                    lpf_view[sa_view[top]] = max(lcp_view[top], lcp_view[i])
+                    lcp_view[i] = min(lcp_view[top], lcp_view[i])
+                else:
+                    lpf_view[sa_view[top]] = lcp_view[top]
+                if return_sources:
+                    sources_view[sa_view[top]] = source
+
+            if i < n:
+                stack.push_back(i)
+
+    if return_sources:
+        return lpf, sources
     return lpf
 
 
-def longest_previous_factor(s, sa=None, lcp=None):
+def longest_previous_factor(s, sa=None, lcp=None, return_sources=False):
+    """
+    Longest previous factor array: lpf[i] is the length of the longest
+    prefix of s[i:] that also starts before i.
+
+    With `return_sources`, also returns the previous occurrence array:
+    s[sources[i]:sources[i] + lpf[i]] == s[i:i + lpf[i]] with
+    sources[i] < i, or -1 if lpf[i] is 0.
+    """
     s = handle_input(s)
     if sa is None:
         sa = divsufsort(s)
     if lcp is None:
         lcp = kasai(s, sa)
-    if isinstance(s, bytes):
-        # tofix
-        s = bytearray(s)
-    return _longest_previous_factor(s, sa, lcp)
+    return _longest_previous_factor(
+        s, sa, np.asarray(lcp, dtype=sa.dtype), return_sources
+    )
 
 
-def lempel_ziv_factorization(np.ndarray[sa_t, ndim=1] lpf not None, bool complexity=False):
-    cdef ull i, n
-    cdef list lz = [<sa_t>0]
+def _lz_factor_starts(const sa_t[::1] lpf not None, bint complexity=False):
+    """
+    Starts of the factors, followed by len(lpf). A factor has length
+    max(1, lpf) (or lpf + 1 for the complexity, the last factor being
+    cut at the end).
+    """
+    cdef ull n = lpf.shape[0], i = 0, k = 0
+    # the number of factors is only known at the end
+    cdef vector[sa_t] starts
+    with nogil:
+        while i < n:
+            starts.push_back(i)
+            i += max(1, lpf[i] + <sa_t>complexity)
+        starts.push_back(min(i, n))
+    return _vector_array(starts.data(), starts.size())
+
+
+def lempel_ziv_factorization(lpf, bool complexity=False):
+    """
+    Lempel-Ziv factorization from the longest previous factor array,
+    as a list of the starts of the factors followed by their end
+    """
+    return _lz_factor_starts(np.ascontiguousarray(lpf), complexity).tolist()
 
-    n = len(lpf)
-    i = 0
-    while lz[i] < n:
-        lz.append(lz[i] + max(1, lpf[lz[i]] + <sa_t>complexity))
-        i += 1
 
-    return lz
+def lempel_ziv_complexity(s, sa=None, lcp=None):
+    lpf = longest_previous_factor(s, sa, lcp)
+    return len(_lz_factor_starts(lpf, True)) - 1
 
 
-def _lempel_ziv_complexity(
-        string_t[::1] s not None,
-        np.ndarray[sa_t, ndim=1] sa not None,
-        np.ndarray[sa_t, ndim=1] lcp not None
+from collections import namedtuple
+
+LZ77Factors = namedtuple("LZ77Factors", ("starts", "lengths", "sources"))
+
+
+def lz77_factorization(s, sa=None, lcp=None):
+    """
+    LZ77 factorization of s, where each factor is the longest previous
+    factor at its start, or a single new character.
+
+    Returns
+    -------
+    starts : np.ndarray
+        start of each factor
+    lengths : np.ndarray
+        length of each factor
+    sources : np.ndarray
+        start of a previous occurrence of each factor, which can overlap it,
+        or -1 for a new character
+    """
+    lpf, sources = longest_previous_factor(s, sa, lcp, return_sources=True)
+    bounds = _lz_factor_starts(lpf)
+    starts = bounds[: len(bounds) - 1]
+    return LZ77Factors(starts, np.diff(bounds), sources[starts])
+
+
+cdef inline void _put_varint(vector[unsigned char]& out, ull x) noexcept nogil:
+    while x >= 0x80:
+        out.push_back(<unsigned char>(x & 0x7F) | 0x80)
+        x >>= 7
+    out.push_back(<unsigned char>x)
+
+
+def _lz77_encode(
+    const unsigned char[::1] s not None,
+    const sa_t[::1] lpf not None,
+    const sa_t[::1] sources not None,
+    ull min_match,
+):
+    """
+    Greedy parse into len(s) followed by sequences of varints:
+    n_literals, literals, match length, distance to the source.
+    The last sequence has a match length of 0 and no distance.
+    """
+    cdef ull n = s.shape[0], i = 0, literals = 0
+    cdef vector[unsigned char] out
+    with nogil:
+        _put_varint(out, n)
+        while i < n:
+            if <ull>lpf[i] < min_match:
+                i += 1
+                continue
+            _put_varint(out, i - literals)
+            out.insert(out.end(), &s[literals], &s[literals] + i - literals)
+            _put_varint(out, lpf[i])
+            _put_varint(out, i - sources[i])
+            i += lpf[i]
+            literals = i
+        _put_varint(out, n - literals)
+        if n > literals:
+            out.insert(out.end(), &s[literals], &s[literals] + n - literals)
+        _put_varint(out, 0)
+    return (<char*> out.data())[:out.size()] if out.size() else b""
+
+
+cdef inline bint _get_varint(const unsigned char[::1] data, ull* pos, ull* x) noexcept nogil:
+    cdef int shift = 0
+    x[0] = 0
+    while pos[0] < <ull>data.shape[0] and shift < 64:
+        x[0] |= <ull>(data[pos[0]] & 0x7F) << shift
+        pos[0] += 1
+        if data[pos[0] - 1] < 0x80:
+            return True
+        shift += 7
+    return False
+
+
+from libc.string cimport memcpy
+
+
+cdef bint _lz77_run(
+        const unsigned char[::1] data, ull pos, ull n, unsigned char* out
+    ) noexcept nogil:
+    """
+    Decodes the sequences of `_lz77_encode` starting at data[pos] into out,
+    or only checks that they decode to n bytes if out is NULL
+    """
+    cdef ull k = 0, literals, length, distance, end = data.shape[0], j
+    cdef bint ok = True
+    while ok:
+        ok = _get_varint(data, &pos, &literals)
+        if not ok or literals > end - pos or literals > n - k:
+            return False
+        if literals and out:
+            memcpy(out + k, &data[pos], literals)
+        pos += literals
+        k += literals
+        ok = _get_varint(data, &pos, &length)
+        if not ok or length == 0:
+            break
+        ok = _get_varint(data, &pos, &distance)
+        if not ok or distance == 0 or distance > k or length > n - k:
+            return False
+        if out:
+            # the source can overlap the copy
+            for j in range(k, k + length):
+                out[j] = out[j - distance]
+        k += length
+    return ok and k == n and pos == end
+
+
+def _lz77_decode(const unsigned char[::1] data not None, ull pos, ull n):
+    """Decodes the sequences of `_lz77_encode` starting at data[pos]"""
+    cdef bint ok
+    # the length in the header is checked before allocating the output
+    with nogil:
+        ok = _lz77_run(data, pos, n, NULL)
+    if not ok:
+        raise ValueError("corrupted LZ77 data")
+    out = bytearray(n)
+    cdef unsigned char[::1] out_view = out
+    with nogil:
+        _lz77_run(data, pos, n, &out_view[0] if n else NULL)
+    return bytes(out)
+
+
+def _aho_corasick(const unsigned char[::1] data not None, const np.int64_t[::1] offsets not None):
+    """
+    Aho-Corasick automaton of the patterns data[offsets[i]:offsets[i+1]],
+    as a complete DFA over byte classes.
+
+    Returns
+    -------
+    byte_class : np.ndarray
+        class of each byte, 0 for the bytes that appear in no pattern
+    delta : np.ndarray
+        transition from state q with class c is delta[q * sigma + c]
+    depth : np.ndarray
+        length of the longest pattern prefix recognized by each state
+    match_len : np.ndarray
+        length of the longest pattern that ends at each state, 0 if none
+    """
+    cdef ull i, k, q, c, head
+    cdef np.int32_t sigma, v, u, f
+
+    used = np.zeros(256, dtype=np.bool_)
+    used[np.asarray(data)] = True
+    byte_class = np.zeros(256, dtype=np.int32)
+    byte_class[used] = np.arange(1, used.sum() + 1, dtype=np.int32)
+    cdef np.int32_t[::1] cls = byte_class
+    sigma = used.sum() + 1
+
+    cdef vector[np.int32_t] delta = vector[np.int32_t](sigma, -1)
+    cdef vector[np.int32_t] depth = vector[np.int32_t](1, 0)
+    cdef vector[np.int32_t] match_len = vector[np.int32_t](1, 0)
+    cdef vector[np.int32_t] fail = vector[np.int32_t](1, 0)
+    cdef vector[np.int32_t] queue
+
+    with nogil:
+        # trie
+        for i in range(<ull>offsets.shape[0] - 1):
+            q = 0
+            for k in range(<ull>offsets[i], <ull>offsets[i + 1]):
+                c = cls[data[k]]
+                if delta[q * sigma + c] == -1:
+                    delta[q * sigma + c] = depth.size()
+                    depth.push_back(depth[q] + 1)
+                    match_len.push_back(0)
+                    fail.push_back(0)
+                    delta.resize(delta.size() + sigma, -1)
+                q = delta[q * sigma + c]
+            match_len[q] = depth[q]
+
+        # failure links in breadth-first order, completing the transitions
+        queue.push_back(0)
+        head = 0
+        while head < queue.size():
+            u = queue[head]
+            head += 1
+            for c in range(<ull>sigma):
+                v = delta[u * sigma + c]
+                f = delta[fail[u] * sigma + c] if u else 0
+                if v == -1:
+                    delta[u * sigma + c] = f
+                    continue
+                fail[v] = f
+                if not match_len[v]:
+                    match_len[v] = match_len[f]
+                queue.push_back(v)
+
+    n_states = depth.size()
+    return (
+        byte_class,
+        np.array(<np.int32_t[:n_states * sigma]> delta.data()),
+        np.array(<np.int32_t[:n_states]> depth.data()),
+        np.array(<np.int32_t[:n_states]> match_len.data()),
+    )
+
+
+cdef inline void _append(
+        vector[unsigned char]& out,
+        const unsigned char* carry,
+        np.int64_t c,
+        const unsigned char* chunk,
+        np.int64_t start,
+        np.int64_t end,
+    ) noexcept nogil:
+    """appends the positions [start, end) of carry + chunk, where chunk starts at 0"""
+    if start >= end:
+        return
+    if start < 0:
+        out.insert(out.end(), carry + c + start, carry + c + min(end, 0))
+    if end > 0:
+        out.insert(out.end(), chunk + max(start, 0), chunk + end)
+
+
+def _aho_corasick_censor(
+        const np.int32_t[::1] byte_class not None,
+        const np.int32_t[::1] delta not None,
+        const np.int32_t[::1] depth not None,
+        const np.int32_t[::1] match_len not None,
+        const unsigned char[::1] carry not None,
+        const unsigned char[::1] chunk not None,
+        const unsigned char[::1] replacement not None,
+        np.int32_t state,
+        np.int64_t deleted_end,
+        const np.int64_t[::1] pending not None,
     ):
-    lpf = longest_previous_factor(s, sa, lcp)
-    return len(lempel_ziv_factorization(lpf, True)) - 1
+    """
+    Censors a chunk, given the bytes held back from the previous chunk.
+
+    Positions are relative to the start of the chunk: the carry occupies
+    [-len(carry), 0). Output is appended by runs, not byte per byte.
+    The union of the occurrences is removed, and each group of
+    overlapping occurrences is replaced once. A group is pending, as
+    start and end pairs, until no later match can start before it: later
+    matches start after the longest pattern prefix recognized by the state,
+    but they can be longer than the previous ones and merge several groups.
+    Once a group is replaced, deleted_end is its end, and a match that
+    overlaps it extends it without a new replacement.
+
+    Returns the output, the new state, the new carry, deleted_end and
+    the pending groups.
+    """
+    cdef np.int64_t c = carry.shape[0]
+    cdef np.int64_t n = chunk.shape[0]
+    cdef np.int64_t sigma = delta.shape[0] // depth.shape[0]
+    cdef np.int64_t i, run, length, start, bound, keep, head
+    cdef const unsigned char* carry_p = &carry[0] if c else NULL
+    cdef const unsigned char* chunk_p = &chunk[0] if n else NULL
+    cdef const unsigned char* rep_p = &replacement[0] if replacement.shape[0] else NULL
+    cdef vector[unsigned char] out
+    # pending groups as (start, end) pairs, from groups[2 * head]
+    cdef vector[np.int64_t] groups
+    cdef np.int64_t p
+
+    for p in range(pending.shape[0]):
+        groups.push_back(pending[p])
+    with nogil:
+        out.reserve(c + n)
+        run = -c
+        head = 0
+        for i in range(n):
+            state = delta[state * sigma + byte_class[chunk_p[i]]]
+            length = match_len[state]
+            if length:
+                start = i + 1 - length
+                if start < deleted_end:
+                    # the pending groups are after deleted_end, they all merge
+                    run = deleted_end = i + 1
+                    groups.resize(2 * head)
+                else:
+                    while (
+                        <np.int64_t>groups.size() > 2 * head
+                        and groups.back() > start
+                    ):
+                        groups.pop_back()
+                        start = min(start, groups.back())
+                        groups.pop_back()
+                    groups.push_back(start)
+                    groups.push_back(i + 1)
+            # the groups starting before bound can only grow to the right
+            bound = i + 1 - depth[state]
+            while <np.int64_t>groups.size() > 2 * head and groups[2 * head] <= bound:
+                _append(out, carry_p, c, chunk_p, run, groups[2 * head])
+                out.insert(out.end(), rep_p, rep_p + replacement.shape[0])
+                run = deleted_end = groups[2 * head + 1]
+                head += 1
+            if 2 * head == <np.int64_t>groups.size():
+                groups.clear()
+                head = 0
+        # hold back the bytes that can still start a match
+        keep = max(run, n - depth[state])
+        _append(out, carry_p, c, chunk_p, run, keep)
+
+    if keep >= 0:
+        new_carry = bytes(chunk[keep:])
+    else:
+        new_carry = bytes(carry[c + keep:]) + bytes(chunk)
+    # any deleted_end before all the possible match starts is equivalent
+    deleted_end = max(deleted_end - n, -<np.int64_t>depth.shape[0] - 1)
+    new_pending = np.array(
+        [groups[p] - n for p in range(2 * head, groups.size())], dtype=np.int64
+    )
+    return (
+        (<char*> out.data())[:out.size()] if out.size() else b"",
+        state,
+        new_carry,
+        deleted_end,
+        new_pending,
+    )
+
+
+from libc.string cimport memcmp
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+def _run_in_threads(func, ull n, n_threads):
+    """
+    Calls func(start, end) on contiguous chunks covering range(n),
+    using n_threads threads (None for all the cores).
+    func is expected to release the GIL.
+    """
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    n_threads = max(1, min(n_threads, n))
+    if n_threads == 1:
+        func(0, n)
+        return
+    with ThreadPoolExecutor(n_threads) as executor:
+        for future in [
+            executor.submit(func, n * k // n_threads, n * (k + 1) // n_threads)
+            for k in range(n_threads)
+        ]:
+            future.result()
+
+
+def _pack(items, any_dtype=False):
+    """
+    Packs a list of strings into (offsets, data) where the i-th string
+    is data[offsets[i]:offsets[i+1]].
+    A tuple is assumed to be already packed.
+    Numpy data must be uint8 unless any_dtype is True.
+    """
+    if isinstance(items, tuple):
+        offsets, data = items
+        offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        data = handle_input(data)
+    elif all(type(item) is bytes for item in items):
+        # bytes do not need to be converted to join them
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(item) for item in items])
+        data = b"".join(items)
+    else:
+        items = [handle_input(item) for item in items]
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(item) for item in items])
+        if items and isinstance(items[0], np.ndarray):
+            data = np.concatenate(items)
+        else:
+            data = b"".join(items)
+    if not any_dtype and isinstance(data, np.ndarray) and data.dtype != np.uint8:
+        raise TypeError("only uint8 strings are supported")
+    if (
+        len(offsets) == 0
+        or offsets[0] != 0
+        or offsets[len(offsets) - 1] > len(data)
+        or (np.diff(offsets) < 0).any()
+    ):
+        raise ValueError("invalid offsets")
+    return offsets, data
 
 
-def lempel_ziv_complexity(s, sa=None, lcp=None):
+cdef inline int _compare_prefix(
+        const unsigned char* s, ull n, ull pos,
+        const unsigned char* pattern, ull m
+    ) noexcept nogil:
+    """
+    Compares the prefix of length m of s[pos:] with pattern.
+    A prefix that is shorter than the pattern is smaller.
+    """
+    cdef ull k = min(m, n - pos)
+    cdef int res = memcmp(s + pos, pattern, k) if k else 0
+    if res == 0 and k < m:
+        return -1
+    return res
+
+
+cdef void _sa_search_range(
+        const unsigned char[::1] s,
+        const sa_t[::1] sa,
+        const unsigned char[::1] data,
+        const np.int64_t[::1] offsets,
+        sa_t[::1] count,
+        sa_t[::1] left,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    cdef ull i, m, lo, hi, mid, first
+    cdef ull n = s.shape[0]
+    cdef ull size = sa.shape[0]
+    cdef const unsigned char* text = &s[0] if n else NULL
+    cdef const unsigned char* pattern
+
+    for i in range(start, end):
+        m = offsets[i + 1] - offsets[i]
+        pattern = &data[0] + offsets[i] if m else NULL
+        # first suffix >= pattern
+        lo = 0
+        hi = size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if _compare_prefix(text, n, sa[mid], pattern, m) < 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+        # first suffix > pattern
+        hi = size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if _compare_prefix(text, n, sa[mid], pattern, m) <= 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        left[i] = first
+        count[i] = lo - first
+
+
+def _sa_search_many(
+        const unsigned char[::1] s not None,
+        const sa_t[::1] sa not None,
+        const unsigned char[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        n_threads=1,
+    ):
+    cdef ull q = offsets.shape[0] - 1
+    count = np.empty(q, dtype=np.asarray(sa).dtype)
+    left = np.empty(q, dtype=np.asarray(sa).dtype)
+    cdef sa_t[::1] count_view = count
+    cdef sa_t[::1] left_view = left
+
+    def run(ull start, ull end):
+        with nogil:
+            _sa_search_range(s, sa, data, offsets, count_view, left_view, start, end)
+
+    _run_in_threads(run, q, n_threads)
+    return count, left
+
+
+def sa_search_many(s, sa, patterns, n_threads=1):
+    """
+    Search many patterns at once in a suffix array.
+
+    Parameters
+    ----------
+
+    s : string
+        the indexed string (uint8 only)
+    sa : np.ndarray
+        suffix array of `s`
+    patterns : list or tuple
+        list of patterns, or a packed tuple (offsets, data) where
+        the i-th pattern is data[offsets[i]:offsets[i+1]]
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    count : np.ndarray
+        number of occurrences of each pattern
+    left : np.ndarray
+        position of the first occurrence of each pattern in the suffix array.
+        If the pattern does not occur, position where it would be inserted.
+    """
     s = handle_input(s)
+    if isinstance(s, np.ndarray) and s.dtype != np.uint8:
+        raise TypeError("only uint8 strings are supported")
+    offsets, data = _pack(patterns)
+    return _sa_search_many(s, np.ascontiguousarray(sa), data, offsets, n_threads)
+
+
+ctypedef int (*_divsufsort32_t)(
+    const unsigned char* T, np.int32_t* SA, np.int32_t n
+) noexcept nogil
+ctypedef int (*_divsufsort64_t)(
+    const unsigned char* T, np.int64_t* SA, np.int64_t n
+) noexcept nogil
+
+# the functions of libdivsufsort are called directly, without ctypes,
+# so that the GIL can be released
+cdef _divsufsort32_t _divsufsort32 = <_divsufsort32_t><size_t>ctypes.cast(
+    libdivsufsort.divsufsort, ctypes.c_void_p
+).value
+cdef _divsufsort64_t _divsufsort64 = <_divsufsort64_t><size_t>ctypes.cast(
+    libdivsufsort64.divsufsort64, ctypes.c_void_p
+).value
+
+
+# shorter records are sorted with SA-IS: libdivsufsort allocates and clears
+# buckets for all the pairs of bytes at each call, which costs more
+cdef enum:
+    _MANY_SAIS_MAX_LENGTH = 4096
+
+
+def _divsufsort_range(
+        const np.uint8_t[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        sa_t[::1] out not None,
+        sa_t[::1] codes not None,
+        ull start,
+        ull end,
+    ):
+    """
+    Sorts the records [start, end), the short ones with SA-IS after
+    copying them into codes, a buffer of _MANY_SAIS_MAX_LENGTH integers.
+    """
+    cdef ull i
+    cdef np.int64_t a, m, j
+    cdef int retval = 0
+    with nogil:
+        for i in range(start, end):
+            a = offsets[i]
+            m = offsets[i + 1] - a
+            if m == 0:
+                continue
+            if m <= _MANY_SAIS_MAX_LENGTH:
+                for j in range(m):
+                    codes[j] = data[a + j]
+                _sais(codes[:m], out[a : a + m], 255)
+            elif sa_t is np.int32_t:
+                retval = _divsufsort32(&data[a], &out[a], m)
+            else:
+                retval = _divsufsort64(&data[a], &out[a], m)
+            if retval:
+                break
+    if retval:
+        raise Exception("libdivsufsort error", retval)  # pragma: no cover
+
+
+def _divsufsort_many(
+        const np.uint8_t[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        sa_t[::1] out not None,
+        n_threads=1,
+    ):
+    dtype = np.asarray(out).dtype
+
+    def run(ull start, ull end):
+        # integer copy of one record for SA-IS, per thread
+        codes = np.empty(_MANY_SAIS_MAX_LENGTH, dtype=dtype)
+        _divsufsort_range(data, offsets, out, codes, start, end)
+
+    _run_in_threads(run, offsets.shape[0] - 1, n_threads)
+
+
+def _kasai_many(
+        const np.uint8_t[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        const sa_t[::1] sa not None,
+        sa_t[::1] out not None,
+        n_threads=1,
+    ):
+    # permuted LCP arrays of the records
+    cdef sa_t[::1] plcp = np.empty_like(sa)
+
+    def run(ull start, ull end):
+        cdef ull i, a, b
+        with nogil:
+            for i in range(start, end):
+                a = offsets[i]
+                b = offsets[i + 1]
+                _phi_range(sa[a:b], plcp[a:b], 0, b - a)
+                _plcp_range(data[a:b], plcp[a:b], 0, b - a)
+                _gather_range(plcp[a:b], sa[a:b], out[a:b], 0, b - a)
+
+    _run_in_threads(run, offsets.shape[0] - 1, n_threads)
+
+
+def divsufsort_many(records, force64=False, n_threads=1):
+    """
+    Suffix arrays of many strings, in one call.
+
+    All the records are sorted with the GIL released, so the cost per
+    record is that of libdivsufsort itself.
+
+    Parameters
+    ----------
+
+    records : list or tuple
+        list of strings, or a packed tuple (offsets, data) where
+        the i-th record is data[offsets[i]:offsets[i+1]] (uint8 only)
+    force64 : bool (default False)
+        use int64 even if int32 is enough
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    offsets : np.ndarray
+        the suffix array of the i-th record is sa[offsets[i]:offsets[i+1]]
+    sa : np.ndarray
+        concatenated suffix arrays, with positions relative to their record
+    """
+    offsets, data = _pack(records)
+    lengths = np.diff(offsets)
+    if force64 or lengths.max(initial=0) > np.iinfo(np.int32).max:
+        dtype = np.int64
+    else:
+        dtype = np.int32
+    sa = np.empty(offsets[len(offsets) - 1], dtype=dtype)
+    _divsufsort_many(as_array(data), offsets, sa, n_threads)
+    return offsets, sa
+
+
+def kasai_many(records, sa=None, n_threads=1):
+    """
+    LCP arrays of many strings, in one call.
+
+    Parameters
+    ----------
+
+    records : list or tuple
+        list of strings, or a packed tuple (offsets, data) (uint8 only)
+    sa : np.ndarray (default None)
+        concatenated suffix arrays, as returned by `divsufsort_many`,
+        computed if not provided
+    n_threads : int (default 1)
+        number of threads, None for all the cores
+
+    Returns
+    -------
+    offsets : np.ndarray
+        the LCP array of the i-th record is lcp[offsets[i]:offsets[i+1]]
+    lcp : np.ndarray
+        concatenated LCP arrays
+    """
+    offsets, data = _pack(records)
     if sa is None:
-        sa = divsufsort(s)
-    if lcp is None:
-        lcp = kasai(s, sa)
-    if isinstance(s, bytes):
-        # tofix
-        s = bytearray(s)
-    return _lempel_ziv_complexity(s, sa, lcp)
-
-
-cdef vector[ull] _prefix_function(const unsigned char[::1] s):
-    cdef ull n = len(s)
-    cdef vector[ull] pi = vector[ull](n)
-    cdef ull i, j = 0
-    for i in range(1, n):
-        while j > 0 and s[i] != s[j]:
-            j = pi[j - 1]
-        j += s[i] == s[j]
-        pi[i] = j
-    return pi
-
-from libcpp.deque cimport deque
-
-def kmp_censor_stream(censor, stream):
-    """
-    Uses KMP algorithm to censor text from a stream of str.
-    """
-    censor = censor.encode("utf-8")
-    cdef vector[ull] pi = _prefix_function(censor)
-    cdef deque[unsigned char] buffer
-    cdef bytearray out
-    cdef ull j = 0
+        sa = divsufsort_many((offsets, data), n_threads=n_threads)[1]
+    sa = np.ascontiguousarray(sa)
+    if len(sa) != offsets[len(offsets) - 1]:
+        raise ValueError("sa must have the total length of the records")
+    lcp = np.empty_like(sa)
+    _kasai_many(as_array(data), offsets, sa, lcp, n_threads)
+    return offsets, lcp
+
+
+ctypedef fused doc_t:
+    np.uint8_t
+    np.uint16_t
+    np.uint32_t
+    np.uint64_t
+
+
+cdef void _doc_search_range(
+        const unsigned char[::1] s,
+        const sa_t[::1] sa,
+        const doc_t[::1] doc_ids,
+        const np.int64_t[::1] starts,
+        const unsigned char[::1] data,
+        const np.int64_t[::1] offsets,
+        sa_t[::1] count,
+        sa_t[::1] left,
+        ull start,
+        ull end,
+    ) noexcept nogil:
+    """
+    Same as _sa_search_range, except that each suffix
+    stops at the end of its document.
+    """
+    cdef ull i, m, lo, hi, mid, first
+    cdef ull size = sa.shape[0]
+    cdef const unsigned char* text = &s[0] if s.shape[0] else NULL
+    cdef const unsigned char* pattern
+
+    for i in range(start, end):
+        m = offsets[i + 1] - offsets[i]
+        pattern = &data[0] + offsets[i] if m else NULL
+        lo = 0
+        hi = size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if _compare_prefix(text, starts[doc_ids[mid] + 1], sa[mid], pattern, m) < 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+        hi = size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if _compare_prefix(text, starts[doc_ids[mid] + 1], sa[mid], pattern, m) <= 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        left[i] = first
+        count[i] = lo - first
+
+
+def _doc_search_many(
+        const unsigned char[::1] s not None,
+        const sa_t[::1] sa not None,
+        const doc_t[::1] doc_ids not None,
+        const np.int64_t[::1] starts not None,
+        const unsigned char[::1] data not None,
+        const np.int64_t[::1] offsets not None,
+        n_threads=1,
+    ):
+    cdef ull q = offsets.shape[0] - 1
+    count = np.empty(q, dtype=np.asarray(sa).dtype)
+    left = np.empty(q, dtype=np.asarray(sa).dtype)
+    cdef sa_t[::1] count_view = count
+    cdef sa_t[::1] left_view = left
+
+    def run(ull start, ull end):
+        with nogil:
+            _doc_search_range(
+                s, sa, doc_ids, starts, data, offsets, count_view, left_view, start, end
+            )
+
+    _run_in_threads(run, q, n_threads)
+    return count, left
+
+
+cdef extern from *:
+    """
+    static inline int _popcount64(unsigned long long x) {
+    #if defined(_MSC_VER)
+        x = x - ((x >> 1) & 0x5555555555555555ULL);
+        x = (x & 0x3333333333333333ULL) + ((x >> 2) & 0x3333333333333333ULL);
+        x = (x + (x >> 4)) & 0x0F0F0F0F0F0F0F0FULL;
+        return (int)((x * 0x0101010101010101ULL) >> 56);
+    #else
+        return __builtin_popcountll(x);
+    #endif
+    }
+    """
+    int _popcount64(ull x) nogil
+
+# the occurrence counts are stored every 2**_FM_SUPER_SHIFT positions
+# and, relative to them, every block_size positions
+cdef enum:
+    _FM_SUPER_SHIFT = 16
+
+
+def _fm_occ_tables(
+        const unsigned char[::1] bwt not None,
+        const np.int16_t[::1] code not None,
+        int sigma,
+        int block_shift,
+    ):
+    """
+    Occurrence counts of each symbol before each superblock and block
+    """
+    cdef ull n = bwt.shape[0]
+    cdef ull i, j
+    superblocks = np.zeros(((n >> _FM_SUPER_SHIFT) + 1, sigma), dtype=np.int64)
+    blocks = np.zeros(((n >> block_shift) + 1, sigma), dtype=np.uint16)
+    cdef np.int64_t[:, ::1] super_view = superblocks
+    cdef np.uint16_t[:, ::1] block_view = blocks
+    cdef vector[np.int64_t] counts = vector[np.int64_t](sigma, 0)
+    cdef ull block_mask = (1ULL << block_shift) - 1
+    cdef ull super_mask = (1ULL << _FM_SUPER_SHIFT) - 1
+
+    with nogil:
+        for i in range(n + 1):
+            if i & super_mask == 0:
+                for j in range(sigma):
+                    super_view[i >> _FM_SUPER_SHIFT, j] = counts[j]
+            if i & block_mask == 0:
+                for j in range(sigma):
+                    block_view[i >> block_shift, j] = (
+                        counts[j] - super_view[i >> _FM_SUPER_SHIFT, j]
+                    )
+            if i < n:
+                counts[code[bwt[i]]] += 1
+    return superblocks, blocks
+
+
+cdef inline np.int64_t _fm_occ(
+        const unsigned char[::1] bwt,
+        const np.int64_t[:, ::1] superblocks,
+        const np.uint16_t[:, ::1] blocks,
+        int block_shift,
+        int j,
+        unsigned char c,
+        ull i,
+    ) noexcept nogil:
+    """number of c (whose code is j) in bwt[:i]"""
+    cdef np.int64_t res = superblocks[i >> _FM_SUPER_SHIFT, j]
+    res += blocks[i >> block_shift, j]
+    cdef ull t
+    for t in range((i >> block_shift) << block_shift, i):
+        res += bwt[t] == c
+    return res
+
+
+cdef inline np.int64_t _fm_lf(
+        const unsigned char[::1] bwt,
+        ull primary,
+        const np.int64_t[::1] C,
+        const np.int16_t[::1] code,
+        const np.int64_t[:, ::1] superblocks,
+        const np.uint16_t[:, ::1] blocks,
+        int block_shift,
+        unsigned char c,
+        ull row,
+    ) noexcept nogil:
+    """
+    LF mapping in the BWT matrix with n + 1 rows, whose last column is
+    bwt[:primary] + [sentinel] + bwt[primary:]
+    """
+    if row > primary:
+        row -= 1
+    return C[c] + _fm_occ(bwt, superblocks, blocks, block_shift, code[c], c, row)
+
+
+def _fm_backward_search(
+        const unsigned char[::1] bwt not None,
+        ull primary,
+        const np.int64_t[::1] C not None,
+        const np.int16_t[::1] code not None,
+        const np.int64_t[:, ::1] superblocks not None,
+        const np.uint16_t[:, ::1] blocks not None,
+        int block_shift,
+        const unsigned char[::1] pattern not None,
+    ):
+    """Returns the range [lo, hi) of rows prefixed by pattern"""
+    cdef ull lo = 0, hi = bwt.shape[0] + 1
+    cdef ull k = pattern.shape[0]
+    cdef unsigned char c
+    with nogil:
+        while k > 0 and lo < hi:
+            k -= 1
+            c = pattern[k]
+            if code[c] < 0:
+                lo = hi = 0
+                break
+            lo = _fm_lf(bwt, primary, C, code, superblocks, blocks, block_shift, c, lo)
+            hi = _fm_lf(bwt, primary, C, code, superblocks, blocks, block_shift, c, hi)
+    if pattern.shape[0] == 0:
+        # the empty suffix is not an occurrence
+        lo = 1
+    return lo, hi
+
+
+cdef inline ull _rank1(const ull[::1] words, const sa_t[::1] word_rank, ull i) noexcept nogil:
+    """number of set bits before position i"""
+    cdef ull w = i >> 6
+    cdef ull b = i & 63
+    cdef ull res = word_rank[w]
+    if b:
+        res += _popcount64(words[w] & ((1ULL << b) - 1))
+    return res
+
+
+def _fm_locate(
+        const unsigned char[::1] bwt not None,
+        ull primary,
+        const np.int64_t[::1] C not None,
+        const np.int16_t[::1] code not None,
+        const np.int64_t[:, ::1] superblocks not None,
+        const np.uint16_t[:, ::1] blocks not None,
+        int block_shift,
+        const ull[::1] marks not None,
+        const sa_t[::1] marks_rank not None,
+        const sa_t[::1] samples not None,
+        ull lo,
+        ull hi,
+    ):
+    """Text positions of the rows in [lo, hi), using the sampled suffix array"""
+    cdef ull i, row, steps
     cdef unsigned char c
-    cdef bytes bytes_s
-
-    for s in stream:
-        bytes_s = s.encode("utf-8")
-        out = bytearray()
-
-        for c in bytes_s:
-            buffer.push_back(c)
-            while j > 0 and c != censor[j]:
-                j = pi[j - 1]
-            j += c == censor[j]
-            
-            if j == len(censor):
-                buffer.clear()
-                j = pi[j - 1]
-
-            for i in range(int(buffer.size()) - j):
-                out.append(buffer.front())
-                buffer.pop_front()
+    positions = np.empty(hi - lo, dtype=np.asarray(samples).dtype)
+    cdef sa_t[::1] positions_view = positions
+    with nogil:
+        for i in range(lo, hi):
+            row = i
+            steps = 0
+            while not (marks[row >> 6] >> (row & 63)) & 1:
+                # the row of position 0, whose last column is the sentinel,
+                # is always marked
+                c = bwt[row if row < primary else row - 1]
+                row = _fm_lf(bwt, primary, C, code, superblocks, blocks, block_shift, c, row)
+                steps += 1
+            positions_view[i - lo] = samples[_rank1(marks, marks_rank, row)] + steps
+    return positions
+
+
+cdef inline np.int64_t _upper_bound(
+        const np.int64_t[::1] a, np.int64_t first, np.int64_t last, np.int64_t x
+    ) noexcept nogil:
+    """first index of a[first:last] whose value is > x"""
+    cdef np.int64_t mid
+    while first < last:
+        mid = (first + last) >> 1
+        if a[mid] <= x:
+            first = mid + 1
+        else:
+            last = mid
+    return first
+
+
+cdef inline np.int64_t _rl_rank(
+        const np.int64_t[::1] run_starts,
+        const np.int64_t[::1] char_offsets,
+        const np.int64_t[::1] char_runs,
+        const np.int64_t[::1] char_cumlen,
+        int c,
+        np.int64_t i,
+    ) noexcept nogil:
+    """number of c in the first i characters of the run-length BWT"""
+    cdef np.int64_t k, t, run
+    if i == 0:
+        return 0
+    # run containing i - 1
+    k = _upper_bound(run_starts, 0, run_starts.shape[0], i - 1) - 1
+    # last run of c up to k
+    t = _upper_bound(char_runs, char_offsets[c], char_offsets[c + 1], k) - 1
+    if t < char_offsets[c]:
+        return 0
+    run = char_runs[t]
+    if run == k:
+        return char_cumlen[t] + i - run_starts[run]
+    return char_cumlen[t] + run_starts[run + 1] - run_starts[run]
+
+
+def _rl_backward_search(
+        const np.int64_t[::1] run_starts not None,
+        const np.int16_t[::1] run_chars not None,
+        const np.int64_t[::1] C not None,
+        const np.int64_t[::1] char_offsets not None,
+        const np.int64_t[::1] char_runs not None,
+        const np.int64_t[::1] char_cumlen not None,
+        const np.int64_t[::1] end_samples not None,
+        const unsigned char[::1] pattern not None,
+    ):
+    """
+    Returns the range [lo, hi) of rows prefixed by pattern, and the
+    text position of row hi - 1 (the toehold).
 
-        if out:
-            yield out.decode("utf-8")
-
-    out = bytearray()
-    while not buffer.empty():
-        out.append(buffer.front())
-        buffer.pop_front()
-    if out:
-        yield out.decode("utf-8")
+    If the last character of the range is c, the toehold follows the
+    LF mapping, otherwise the new last row comes from the last run of c
+    in the range, whose text position is sampled at the end of the run.
+    """
+    cdef np.int64_t n_rows = run_starts[run_starts.shape[0] - 1]
+    cdef np.int64_t lo = 0, hi = n_rows, k, t
+    cdef np.int64_t toehold = end_samples[end_samples.shape[0] - 1]
+    cdef ull j = pattern.shape[0]
+    cdef unsigned char c
+    with nogil:
+        while j > 0 and lo < hi:
+            j -= 1
+            c = pattern[j]
+            k = _upper_bound(run_starts, 0, run_starts.shape[0], hi - 1) - 1
+            if run_chars[k] == c:
+                toehold -= 1
+            else:
+                t = _upper_bound(char_runs, char_offsets[c], char_offsets[c + 1], k) - 1
+                if t < char_offsets[c] or run_starts[char_runs[t] + 1] <= lo:
+                    lo = hi = 0
+                    break
+                toehold = end_samples[char_runs[t]] - 1
+            lo = C[c] + _rl_rank(run_starts, char_offsets, char_runs, char_cumlen, c, lo)
+            hi = C[c] + _rl_rank(run_starts, char_offsets, char_runs, char_cumlen, c, hi)
+    if pattern.shape[0] == 0:
+        # the empty suffix is not an occurrence
+        lo = 1
+    return lo, hi, toehold
+
+
+def _rl_locate(
+        const np.int64_t[::1] phi_keys not None,
+        const np.int64_t[::1] phi_values not None,
+        np.int64_t toehold,
+        np.int64_t count,
+    ):
+    """
+    Text positions of the count rows ending with the row of toehold,
+    in suffix array order, with the phi function: if q is the largest key
+    <= p, the position of the row before the row of p is
+    phi_values[q] + p - q.
+    """
+    positions = np.empty(count, dtype=np.int64)
+    cdef np.int64_t[::1] positions_view = positions
+    cdef np.int64_t i, k, p = toehold
+    with nogil:
+        for i in range(count - 1, -1, -1):
+            positions_view[i] = p
+            if i:
+                k = _upper_bound(phi_keys, 0, phi_keys.shape[0], p) - 1
+                p = phi_values[k] + p - phi_keys[k]
+    return positions
+
+
+cdef extern from *:
+    """
+    #include <algorithm>
+    #include <cstring>
+    #include <functional>
+    #include <queue>
+    #include <vector>
+
+    /* compares the suffixes of t (of length n) starting at a and b,
+       a shorter suffix being smaller when it is a prefix of the other */
+    static inline int _suffix_compare(
+        const unsigned char* t, npy_int64 n, npy_int64 a, npy_int64 b, npy_int64 skip
+    ) {
+        npy_int64 la = n - a, lb = n - b;
+        npy_int64 k = (la < lb ? la : lb) - skip;
+        int res = k > 0 ? memcmp(t + a + skip, t + b + skip, k) : 0;
+        if (res) return res;
+        return la < lb ? -1 : la > lb;
+    }
+
+    static inline npy_int64 _suffix_lcp(
+        const unsigned char* t, npy_int64 n, npy_int64 a, npy_int64 b
+    ) {
+        npy_int64 k = 0;
+        while (a + k < n && b + k < n && t[a + k] == t[b + k]) k++;
+        return k;
+    }
+
+    /* sorts the suffixes offset + first[i] of t, which share a prefix
+       of length skip */
+    template <typename T>
+    static void _sort_suffixes(
+        const unsigned char* t, npy_int64 n, T* first, T* last,
+        npy_int64 offset, npy_int64 skip
+    ) {
+        std::sort(first, last, [=](T a, T b) {
+            return _suffix_compare(t, n, offset + a, offset + b, skip) < 0;
+        });
+    }
+
+    /* places the suffixes of the block sa[first:last] that are cut at the
+       end of the block (b - sa[x] == lcp[x]) among the others, which are
+       already in order */
+    template <typename T>
+    static void _fix_undecided_range(
+        const unsigned char* t, npy_int64 n, T* sa, const T* lcp, npy_int64 b,
+        npy_int64 offset, npy_int64 first, npy_int64 last
+    ) {
+        std::vector<T> cut, rest;
+        for (npy_int64 x = first; x < last; x++)
+            (b - sa[x] == lcp[x] ? cut : rest).push_back(sa[x]);
+        /* all the suffixes of the range share the first cut suffix */
+        npy_int64 skip = b - sa[first];
+        auto less = [=](T a, T c) {
+            return _suffix_compare(t, n, offset + a, offset + c, skip) < 0;
+        };
+        std::sort(cut.begin(), cut.end(), less);
+        auto it = rest.begin();
+        T* out = sa + first;
+        for (T c : cut) {
+            auto pos = std::lower_bound(it, rest.end(), c, less);
+            out = std::copy(it, pos, out);
+            *out++ = c;
+            it = pos;
+        }
+        std::copy(it, rest.end(), out);
+    }
+
+    /* 8 bytes of t from a, padded with zeros */
+    static inline npy_uint64 _suffix_key(
+        const unsigned char* t, npy_int64 n, npy_int64 a
+    ) {
+        npy_uint64 key = 0;
+        if (a + 8 <= n) {
+            const unsigned char* c = t + a;
+            return (npy_uint64)c[0] << 56 | (npy_uint64)c[1] << 48
+                | (npy_uint64)c[2] << 40 | (npy_uint64)c[3] << 32
+                | (npy_uint64)c[4] << 24 | (npy_uint64)c[5] << 16
+                | (npy_uint64)c[6] << 8 | (npy_uint64)c[7];
+        }
+        for (npy_int64 i = a; i < a + 8; i++)
+            key = key << 8 | (i < n ? t[i] : 0);
+        return key;
+    }
+
+    /* sorts the suffixes sa[0:k] of t by their first 16 bytes, then sorts
+       the groups of suffixes with the same first 16 bytes on the text */
+    template <typename T>
+    static void _sort_sparse_suffixes(
+        const unsigned char* t, npy_int64 n, T* sa, npy_int64 k
+    ) {
+        struct Entry {
+            npy_uint64 key0, key1;
+            T pos;
+        };
+        std::vector<Entry> entries(k);
+        for (npy_int64 i = 0; i < k; i++)
+            entries[i] = {_suffix_key(t, n, sa[i]), _suffix_key(t, n, sa[i] + 8), sa[i]};
+        auto same = [](const Entry& a, const Entry& b) {
+            return a.key0 == b.key0 && a.key1 == b.key1;
+        };
+        std::sort(entries.begin(), entries.end(), [](const Entry& a, const Entry& b) {
+            return a.key0 != b.key0 ? a.key0 < b.key0 : a.key1 < b.key1;
+        });
+        for (npy_int64 i = 0; i < k; i++) sa[i] = entries[i].pos;
+        for (npy_int64 i = 0, j; i < k; i = j) {
+            for (j = i + 1; j < k && same(entries[i], entries[j]); j++) {}
+            if (j - i > 1) _sort_suffixes(t, n, sa + i, sa + j, 0, 16);
+        }
+    }
+
+    /* k-way merge of the sorted runs runs[starts[r]:ends[r]], with the LCP
+       of consecutive output suffixes if lcp is not NULL (except the last).
+       The heap caches the first 16 bytes of the head of each run, so that
+       most comparisons do not read the text. */
+    template <typename T>
+    static void _merge_suffix_runs(
+        const unsigned char* t, npy_int64 n, const T* runs,
+        const npy_int64* starts, const npy_int64* ends, npy_int64 k,
+        T* out, T* lcp
+    ) {
+        std::vector<npy_int64> head(starts, starts + k);
+        std::vector<npy_uint64> key(2 * k);
+        std::vector<npy_int64> heap;
+        auto less = [&](npy_int64 x, npy_int64 y) {
+            if (key[2 * x] != key[2 * y]) return key[2 * x] < key[2 * y];
+            if (key[2 * x + 1] != key[2 * y + 1])
+                return key[2 * x + 1] < key[2 * y + 1];
+            return _suffix_compare(t, n, runs[head[x]], runs[head[y]], 16) < 0;
+        };
+        auto load = [&](npy_int64 r) {
+            npy_int64 a = runs[head[r]];
+            key[2 * r] = _suffix_key(t, n, a);
+            key[2 * r + 1] = _suffix_key(t, n, a + 8);
+        };
+        auto sift_down = [&](size_t i) {
+            size_t size = heap.size();
+            npy_int64 r = heap[i];
+            while (2 * i + 1 < size) {
+                size_t c = 2 * i + 1;
+                if (c + 1 < size && less(heap[c + 1], heap[c])) c++;
+                if (!less(heap[c], r)) break;
+                heap[i] = heap[c];
+                i = c;
+            }
+            heap[i] = r;
+        };
+        for (npy_int64 r = 0; r < k; r++) {
+            if (head[r] < ends[r]) {
+                load(r);
+                heap.push_back(r);
+            }
+        }
+        for (size_t i = heap.size(); i-- > 0;) sift_down(i);
+        npy_int64 i = 0;
+        while (!heap.empty()) {
+            npy_int64 r = heap[0];
+            out[i] = runs[head[r]];
+            if (lcp && i) lcp[i - 1] = (T)_suffix_lcp(t, n, out[i - 1], out[i]);
+            i++;
+            if (++head[r] < ends[r]) {
+    #ifdef __GNUC__
+                if (head[r] + 16 < ends[r])
+                    __builtin_prefetch(t + runs[head[r] + 16]);
+    #endif
+                load(r);
+            } else {
+                heap[0] = heap.back();
+                heap.pop_back();
+            }
+            if (!heap.empty()) sift_down(0);
+        }
+    }
+
+    /* positions in each sorted run of the first suffix not smaller
+       than the suffix starting at splitter */
+    template <typename T>
+    static void _split_suffix_runs(
+        const unsigned char* t, npy_int64 n, const T* runs,
+        const npy_int64* bounds, npy_int64 k, npy_int64 splitter,
+        npy_int64* positions
+    ) {
+        for (npy_int64 r = 0; r < k; r++)
+            positions[r] = std::lower_bound(
+                runs + bounds[r], runs + bounds[r + 1], splitter,
+                [=](T a, npy_int64 b) {
+                    return _suffix_compare(t, n, a, b, 0) < 0;
+                }
+            ) - runs;
+    }
+    """
+    void _sort_suffixes[T](
+        const unsigned char* t, np.int64_t n, T* first, T* last,
+        np.int64_t offset, np.int64_t skip
+    ) nogil
+    void _fix_undecided_range[T](
+        const unsigned char* t, np.int64_t n, T* sa, const T* lcp, np.int64_t b,
+        np.int64_t offset, np.int64_t first, np.int64_t last
+    ) nogil
+    void _merge_suffix_runs[T](
+        const unsigned char* t, np.int64_t n, const T* runs,
+        const np.int64_t* starts, const np.int64_t* ends, np.int64_t k,
+        T* out, T* lcp
+    ) nogil
+    void _split_suffix_runs[T](
+        const unsigned char* t, np.int64_t n, const T* runs,
+        const np.int64_t* bounds, np.int64_t k, np.int64_t splitter,
+        np.int64_t* positions
+    ) nogil
+    np.int64_t _suffix_lcp(
+        const unsigned char* t, np.int64_t n, np.int64_t a, np.int64_t b
+    ) nogil
+    void _sort_sparse_suffixes[T](
+        const unsigned char* t, np.int64_t n, T* sa, np.int64_t k
+    ) nogil
+
+
+def _undecided_ranges(const sa_t[::1] block_sa not None, const sa_t[::1] lcp not None):
+    """
+    block_sa and lcp are the suffix and LCP arrays of a block, where the
+    suffixes are cut at the end of the block. The cut suffix in row k is
+    a prefix of the rows [k, j] such that lcp[k:j] >= its length: their
+    order depends on the text after the block. Returns the maximal such
+    ranges as (starts, ends), ends being exclusive.
+    """
+    cdef np.int64_t b = block_sa.shape[0]
+    cdef np.int64_t k
+    cdef vector[np.int64_t] stack
+    cdef vector[np.int64_t] starts
+    cdef vector[np.int64_t] ends
+    with nogil:
+        for k in range(b - 1):
+            # the ranges of the stack are nested, with increasing lengths
+            if stack.size():
+                while stack.size() and b - block_sa[stack.back()] > lcp[k]:
+                    stack.pop_back()
+                if stack.size() == 0:
+                    ends.push_back(k + 1)
+            if lcp[k] == b - block_sa[k]:
+                if stack.size() == 0:
+                    starts.push_back(k)
+                stack.push_back(k)
+        if stack.size():
+            ends.push_back(b)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def _fix_undecided_ranges(
+        const unsigned char[::1] text not None,
+        sa_t[::1] block_sa not None,
+        const sa_t[::1] lcp not None,
+        const np.int64_t[::1] starts not None,
+        const np.int64_t[::1] ends not None,
+        np.int64_t offset,
+    ):
+    """
+    block_sa is the suffix array of text[offset:offset + len(block_sa)],
+    where a suffix is cut at the end of the block, and lcp its LCP array.
+    In the ranges block_sa[starts[i]:ends[i]] from `_undecided_ranges`,
+    the cut suffixes are moved to their place on the whole text.
+    """
+    cdef np.int64_t n = text.shape[0]
+    cdef np.int64_t b = block_sa.shape[0]
+    cdef ull i
+    cdef const unsigned char* t = &text[0] if n else NULL
+    with nogil:
+        for i in range(<ull>starts.shape[0]):
+            _fix_undecided_range(
+                t, n, &block_sa[0], &lcp[0], b, offset, starts[i], ends[i]
+            )
+
+
+# number of samples per run and per part to choose the splitters
+cdef enum:
+    _SPLIT_OVERSAMPLING = 16
+
+
+def _merge_runs(
+        const unsigned char[::1] text not None,
+        sa_t[::1] runs not None,
+        const np.int64_t[::1] bounds not None,
+        sa_t[::1] out not None,
+        sa_t[::1] lcp,
+        n_threads=1,
+    ):
+    """
+    Merges the sorted runs runs[bounds[r]:bounds[r + 1]] of suffixes of text
+    into out, and writes their LCP array to lcp if it is not None.
+    With several threads, the output is cut into parts by splitter suffixes
+    sampled from the runs, and the parts are merged independently.
+    """
+    cdef np.int64_t n = text.shape[0]
+    cdef np.int64_t k = bounds.shape[0] - 1
+    cdef const unsigned char* t = &text[0] if n else NULL
+    cdef sa_t* lcp_p = &lcp[0] if lcp is not None and n else NULL
+    cdef np.int64_t q, r, n_parts
+    cdef np.int64_t[:, ::1] splits
+    cdef np.int64_t[::1] out_starts
+    cdef sa_t[::1] samples
+    if n == 0:
+        return
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    n_parts = max(1, min(n_threads, n // (_SPLIT_OVERSAMPLING * k)))
+
+    splits = np.empty((n_parts + 1, k), dtype=np.int64)
+    splits[0] = bounds[:k]
+    splits[n_parts] = bounds[1:]
+    if n_parts > 1:
+        n_samples = _SPLIT_OVERSAMPLING * n_parts
+        samples = np.concatenate([
+            np.asarray(runs)[
+                bounds[r] + (bounds[r + 1] - bounds[r]) * np.arange(n_samples)
+                // n_samples
+            ]
+            for r in range(k)
+        ])
+        with nogil:
+            _sort_suffixes(t, n, &samples[0], &samples[0] + samples.shape[0], 0, 0)
+            for q in range(1, n_parts):
+                _split_suffix_runs(
+                    t, n, &runs[0], &bounds[0], k,
+                    samples[samples.shape[0] * q // n_parts], &splits[q, 0],
+                )
+    out_starts = (np.asarray(splits) - np.asarray(bounds[:k])).sum(axis=1)
+
+    def run(ull start, ull end):
+        cdef np.int64_t q
+        with nogil:
+            for q in range(<np.int64_t>start, <np.int64_t>end):
+                _merge_suffix_runs(
+                    t, n, &runs[0], &splits[q, 0], &splits[q + 1, 0], k,
+                    &out[out_starts[q]], lcp_p + out_starts[q] if lcp_p else NULL,
+                )
+
+    _run_in_threads(run, n_parts, n_parts)
+    if lcp_p:
+        for q in range(1, n_parts):
+            if 0 < out_starts[q] < n:
+                lcp_p[out_starts[q] - 1] = <sa_t>_suffix_lcp(
+                    t, n, out[out_starts[q] - 1], out[out_starts[q]]
+                )
+        lcp_p[n - 1] = 0
+
+
+def _sparse_suffix_array(
+        const unsigned char[::1] text not None,
+        sa_t[::1] sa not None,
+        sa_t[::1] lcp,
+    ):
+    """
+    Sorts the suffixes of text starting at the positions sa in place,
+    and writes their LCP array to lcp if it is not None.
+    """
+    cdef np.int64_t n = text.shape[0]
+    cdef np.int64_t k = sa.shape[0]
+    cdef np.int64_t i
+    cdef const unsigned char* t = &text[0] if n else NULL
+    if k == 0:
+        return
+    with nogil:
+        _sort_sparse_suffixes(t, n, &sa[0], k)
+        if lcp is not None:
+            for i in range(k - 1):
+                lcp[i] = <sa_t>_suffix_lcp(t, n, sa[i], sa[i + 1])
+            lcp[k - 1] = 0
+
+
+def sparse_suffix_array(inp, positions, return_lcp=False):
+    """
+    Suffix array of the suffixes of inp starting at the given positions,
+    e.g. the starts of the words for a word-level index.
+
+    The k suffixes are sorted by their first 16 bytes in O(k log k),
+    and the groups that share them are sorted by comparing the text.
+    This takes O(k log k * L) time in the worst case, where L is the
+    longest common prefix of two sorted suffixes, so highly repetitive
+    texts are slow (e.g. b"a" * n). The memory is O(k) instead of O(n).
+    The result can be searched with `sa_search` and `sa_search_many`,
+    which find the occurrences that start at one of the positions.
+
+    Parameters
+    ----------
+
+    inp : string
+        the string (uint8 only)
+    positions : np.ndarray
+        positions of the suffixes to sort, duplicates are ignored
+    return_lcp : bool (default False)
+        also return the LCP array of the sparse suffix array:
+        lcp[i] is the longest common prefix of the suffixes starting
+        at sa[i] and sa[i + 1], and lcp[-1] = 0
+
+    Returns
+    -------
+    sa : np.ndarray
+        the positions in the lexicographic order of their suffixes,
+        int32 if the string fits, int64 otherwise
+    lcp : np.ndarray
+        only if `return_lcp`
+    """
+    inp = handle_input(inp)
+    if isinstance(inp, np.ndarray) and inp.dtype != np.uint8:
+        raise TypeError("only uint8 strings are supported")
+    n = len(inp)
+    dtype = np.int32 if n <= np.iinfo(np.int32).max else np.int64
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    if len(positions) and (positions[0] < 0 or positions[len(positions) - 1] >= n):
+        raise ValueError("positions must be in [0, len(inp))")
+    sa = positions.astype(dtype)
+    lcp = np.empty_like(sa) if return_lcp else None
+    _sparse_suffix_array(inp, sa, lcp)
+    if return_lcp:
+        return sa, lcp
+    return sa
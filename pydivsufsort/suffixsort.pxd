@@ -0,0 +1,7 @@
+cimport numpy as np
+
+ctypedef fused sa_t:
+    np.int32_t
+    np.int64_t
+
+cdef void _sais(sa_t[::1] s, sa_t[::1] sa, sa_t upper) noexcept nogil
@@ -0,0 +1,180 @@
+# cython: language_level=3, wraparound=False, boundscheck=False
+
+"""
+Suffix sorting routines that do not go through libdivsufsort
+"""
+
+cimport numpy as np
+import numpy as np
+
+np.import_array()
+
+from libcpp.vector cimport vector
+from libcpp cimport bool
+
+cdef void _induce(
+        sa_t[::1] s,
+        sa_t[::1] sa,
+        vector[np.uint8_t]& ls,
+        vector[sa_t]& sum_l,
+        vector[sa_t]& sum_s,
+        vector[sa_t]& lms,
+    ) noexcept nogil:
+    cdef sa_t n = s.shape[0]
+    cdef sa_t i, v, d
+    cdef vector[sa_t] buf = sum_s
+
+    for i in range(n):
+        sa[i] = -1
+    for d in lms:
+        if d == n:
+            continue
+        sa[buf[s[d]]] = d
+        buf[s[d]] += 1
+
+    buf = sum_l
+    sa[buf[s[n - 1]]] = n - 1
+    buf[s[n - 1]] += 1
+    for i in range(n):
+        v = sa[i]
+        if v >= 1 and not ls[v - 1]:
+            sa[buf[s[v - 1]]] = v - 1
+            buf[s[v - 1]] += 1
+
+    buf = sum_l
+    for i in range(n - 1, -1, -1):
+        v = sa[i]
+        if v >= 1 and ls[v - 1]:
+            buf[s[v - 1] + 1] -= 1
+            sa[buf[s[v - 1] + 1]] = v - 1
+
+
+cdef void _sais(sa_t[::1] s, sa_t[::1] sa, sa_t upper) noexcept nogil:
+    """
+    SA-IS on an integer string whose values are in [0, upper].
+    The end of the string acts as a virtual sentinel.
+
+    Nong, Ge, Sen Zhang, and Wai Hong Chan.
+    "Linear suffix array construction by almost pure induced-sorting."
+    Data Compression Conference (DCC 2009). IEEE, 2009.
+    """
+    cdef sa_t n = s.shape[0]
+    cdef sa_t i, m, l, r, end_l, end_r, rec_upper
+    cdef bool same
+
+    if n == 0:
+        return
+    if n == 1:
+        sa[0] = 0
+        return
+    if n == 2:
+        if s[0] < s[1]:
+            sa[0] = 0
+            sa[1] = 1
+        else:
+            sa[0] = 1
+            sa[1] = 0
+        return
+
+    cdef vector[np.uint8_t] ls = vector[np.uint8_t](n, 0)
+    for i in range(n - 2, -1, -1):
+        ls[i] = ls[i + 1] if s[i] == s[i + 1] else s[i] < s[i + 1]
+
+    cdef vector[sa_t] sum_l = vector[sa_t](upper + 2, 0)
+    cdef vector[sa_t] sum_s = vector[sa_t](upper + 2, 0)
+    for i in range(n):
+        if not ls[i]:
+            sum_s[s[i]] += 1
+        else:
+            sum_l[s[i] + 1] += 1
+    for i in range(upper + 1):
+        sum_s[i] += sum_l[i]
+        if i < upper:
+            sum_l[i + 1] += sum_s[i]
+
+    # LMS positions, and their index among LMS positions
+    cdef vector[sa_t] lms
+    cdef vector[sa_t] lms_map = vector[sa_t](n + 1, -1)
+    m = 0
+    for i in range(1, n):
+        if not ls[i - 1] and ls[i]:
+            lms_map[i] = m
+            m += 1
+            lms.push_back(i)
+
+    _induce(s, sa, ls, sum_l, sum_s, lms)
+
+    if m == 0:
+        return
+
+    cdef vector[sa_t] sorted_lms
+    sorted_lms.reserve(m)
+    for i in range(n):
+        if lms_map[sa[i]] != -1:
+            sorted_lms.push_back(sa[i])
+
+    # name the LMS substrings and sort the reduced string recursively.
+    # LMS positions are not adjacent so 2 * m <= n, and sa is free
+    # until the final induction.
+    cdef sa_t[::1] rec_s = sa[:m]
+    cdef sa_t[::1] rec_sa = sa[m : 2 * m]
+
+    rec_upper = 0
+    rec_s[lms_map[sorted_lms[0]]] = 0
+    for i in range(1, m):
+        l = sorted_lms[i - 1]
+        r = sorted_lms[i]
+        end_l = lms[lms_map[l] + 1] if lms_map[l] + 1 < m else n
+        end_r = lms[lms_map[r] + 1] if lms_map[r] + 1 < m else n
+        same = True
+        if end_l - l != end_r - r:
+            same = False
+        else:
+            while l < end_l:
+                if s[l] != s[r]:
+                    break
+                l += 1
+                r += 1
+            if l == n or s[l] != s[r]:
+                same = False
+        if not same:
+            rec_upper += 1
+        rec_s[lms_map[sorted_lms[i]]] = rec_upper
+
+    lms_map.clear()
+    lms_map.shrink_to_fit()
+
+    _sais(rec_s, rec_sa, rec_upper)
+
+    for i in range(m):
+        sorted_lms[i] = lms[rec_sa[i]]
+    _induce(s, sa, ls, sum_l, sum_s, sorted_lms)
+
+
+def sais(sa_t[::1] s not None, sa_t upper, out=None):
+    """
+    Suffix array of an integer string in linear time.
+
+    Parameters
+    ----------
+
+    s : np.ndarray
+        int32 or int64 array with values in [0, upper]
+    upper : int
+        upper bound on the values of `s`, the buckets use O(upper) memory
+    out : np.ndarray (default None)
+        preallocated output with the same dtype and length as `s`
+
+    Returns
+    -------
+    sa : np.ndarray
+        suffix array, with the same dtype as `s`
+    """
+    if out is None:
+        out = np.empty(s.shape[0], dtype=np.asarray(s).dtype)
+    cdef sa_t[::1] sa_view = out
+    if sa_view.shape[0] != s.shape[0]:
+        raise ValueError("out must have the same length as s")
+    with nogil:
+        _sais(s, sa_view, upper)
+    return out
@@ -7,31 +7,149 @@ from . import (
     kasai,
     lcp_query,
     lcp_segtree,
+    lcp_sparse_table,
     most_frequent_substrings,
     sa_search,
+    sa_search_many,
+    sparse_suffix_array,
+)
+from .buffers import as_array
+from .compact import CompactLCP
+from .storage import load_arrays, save_arrays
+from .stringalg import (
+    _inverse_suffix_array,
+    _matching_statistics,
+    _maximal_pairs,
+    _search_approx,
 )
-from .stringalg import _common_substrings
 
 SearchResult = namedtuple("SearchResult", ("count", "position"))
 
 MFSResult = namedtuple("MFSResult", ("positions", "counts"))
 
+MSResult = namedtuple("MSResult", ("lengths", "positions"))
+
+MEMResult = namedtuple("MEMResult", ("query_positions", "positions", "lengths"))
+
+ApproxResult = namedtuple("ApproxResult", ("positions", "distances"))
+
+
+def cast_to_numpy(inp, copy=False):
+    inp = as_array(inp)
+    return inp.copy() if copy else inp
+
+
+LCP_BACKENDS = ("segtree", "sparse_table")
 
-def cast_to_numpy(inp, copy=True):
-    if isinstance(inp, str):
-        try:
-            inp = inp.encode("ascii")
-        except UnicodeEncodeError:
-            raise TypeError("str must only contain ascii chars")
-    if isinstance(inp, bytes):
-        inp = np.frombuffer(inp, dtype=np.uint8)
-    return np.ascontiguousarray(np.array(inp, copy=copy))
+APPROX_METRICS = ("hamming", "edit")
 
 
 class WonderString:
-    def __init__(self, inp, copy=True):
+    """
+    Parameters
+    ----------
+
+    inp : string or np.ndarray
+        any input accepted by the other functions (str, bytes, mmap,
+        numpy array...)
+    copy : bool (default False)
+        copy the input. By default, the WonderString uses a view of `inp`
+        which must not be modified afterwards.
+    lcp_backend : str (default "segtree")
+        structure used by `lcp`: "segtree" uses 2n integers and answers
+        queries in O(log n), "sparse_table" uses n log n integers and
+        answers queries in O(1)
+    compact_lcp : bool (default False)
+        store `lcp_array` as a `CompactLCP`, with one byte per value
+    sparse : np.ndarray (default None)
+        only index the suffixes starting at these positions (byte strings
+        only), see `sparse_suffix_array`. `search` and
+        `most_frequent_substrings` then only find the occurrences that
+        start at one of the positions, and the LCP queries are not available.
+    """
+
+    def __init__(
+        self, inp, copy=False, lcp_backend="segtree", compact_lcp=False, sparse=None
+    ):
+        if lcp_backend not in LCP_BACKENDS:
+            raise ValueError(f"lcp_backend must be one of {LCP_BACKENDS}")
         self.string = cast_to_numpy(inp, copy)
         self.itemsize = self.string.dtype.itemsize
+        self.lcp_backend = lcp_backend
+        self.compact_lcp = compact_lcp
+        self.sparse = sparse is not None
+        if self.sparse:
+            if self.itemsize != 1:
+                raise NotImplementedError("sparse only supports byte strings.")
+            self._sparse_positions = sparse
+
+    _COMPACT_LCP_PARTS = ["values", "exception_rows", "exception_values"]
+
+    _CACHED = [
+        "suffix_array",
+        "suffix_array_bytes",
+        "lcp_array",
+        "rank",
+        "segtree",
+        "sparse_table",
+    ]
+
+    def _cached_arrays(self):
+        arrays = {"string": self.string}
+        for name in self._CACHED:
+            if hasattr(self, "_" + name):
+                arrays[name] = getattr(self, "_" + name)
+        if isinstance(arrays.get("lcp_array"), CompactLCP):
+            lcp = arrays.pop("lcp_array")
+            for part in self._COMPACT_LCP_PARTS:
+                arrays["lcp_array_" + part] = getattr(lcp, part)
+        return arrays
+
+    def save(self, path):
+        """
+        Save the string and all the structures computed so far.
+
+        The file contains raw aligned arrays that `WonderString.open`
+        can map in memory, so several processes can share the same index.
+        Compute the structures you need before saving, e.g. by accessing
+        `suffix_array` and `lcp_array` or calling `lcp`.
+        """
+        if self.sparse:
+            # the positions are only stored in the suffix array
+            self.suffix_array
+        metadata = {
+            "type": type(self).__name__,
+            "lcp_backend": self.lcp_backend,
+            "compact_lcp": self.compact_lcp,
+            "sparse": self.sparse,
+        }
+        save_arrays(path, self._cached_arrays(), metadata)
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        """
+        Load a WonderString saved with `save`.
+
+        If `mmap` is True, the arrays are memory-mapped instead of read,
+        which makes opening nearly instantaneous and lets the OS share
+        the pages between processes.
+        """
+        metadata, arrays = load_arrays(path, mmap)
+        if metadata.get("type") != cls.__name__:
+            raise ValueError(f"{path} does not contain a {cls.__name__}")
+        self = cls.__new__(cls)
+        self.string = arrays.pop("string")
+        self.itemsize = self.string.dtype.itemsize
+        self.lcp_backend = metadata.get("lcp_backend", "segtree")
+        self.compact_lcp = metadata.get("compact_lcp", False)
+        self.sparse = metadata.get("sparse", False)
+        if "lcp_array_values" in arrays:
+            self._lcp_array = CompactLCP.from_arrays(
+                *[arrays.pop("lcp_array_" + part) for part in self._COMPACT_LCP_PARTS]
+            )
+        for name, arr in arrays.items():
+            setattr(self, "_" + name, arr)
+        return self
 
     @property
     def bytes(self):
@@ -51,15 +169,17 @@ class WonderString:
     @property
     def suffix_array(self):
         if not hasattr(self, "_suffix_array"):
-            if self.itemsize == 1:
+            if self.sparse:
+                # the sparse LCP array is cheap to get with the sort
+                self._suffix_array, lcp = sparse_suffix_array(
+                    self.string, self._sparse_positions, return_lcp=True
+                )
+                if not hasattr(self, "_lcp_array"):
+                    self._lcp_array = CompactLCP(lcp) if self.compact_lcp else lcp
+            elif self.itemsize == 1:
                 self._suffix_array = self.suffix_array_bytes
             else:
-                self._suffix_array = np.ascontiguousarray(
-                    self.suffix_array_bytes[
-                        self.suffix_array_bytes % self.itemsize == 0
-                    ]
-                    // self.itemsize
-                )
+                self._suffix_array = divsufsort(self.string)
         return self._suffix_array
 
     def search(self, pattern, return_positions=False):
@@ -87,39 +207,159 @@ class WonderString:
             return self.suffix_array[ans.position : ans.position + ans.count]
         return ans
 
+    def search_approx(self, pattern, k, metric="hamming"):
+        """
+        Approximate occurrences of pattern.
+
+        The suffix array is explored like a suffix tree, following the
+        characters of pattern and abandoning a branch as soon as it
+        exceeds the distance k. The cost grows with the number of
+        branches within distance k, not with the length of the string.
+
+        Parameters
+        ----------
+
+        pattern : string or np.ndarray
+            converted to the dtype of the string
+        k : int
+            maximum distance
+        metric : str (default "hamming")
+            "hamming" counts the mismatches with string[i:i + len(pattern)],
+            "edit" is the smallest Levenshtein distance between pattern and
+            a substring starting at i
+
+        Returns
+        -------
+        positions : np.ndarray
+            start of each occurrence in the string, increasing
+        distances : np.ndarray
+            distance of each occurrence
+        """
+        if metric not in APPROX_METRICS:
+            raise ValueError(f"metric must be one of {APPROX_METRICS}")
+        if k < 0:
+            raise ValueError("k must be non-negative")
+        pattern = cast_to_numpy(pattern)
+        if pattern.dtype != self.string.dtype:
+            pattern = pattern.astype(self.string.dtype)
+        edit = metric == "edit"
+        # no distance exceeds len(pattern)
+        k = min(k, len(pattern))
+        positions, distances = _search_approx(
+            self.string, self.suffix_array, pattern, k, edit
+        )
+        # with edits, keep the smallest distance of each position
+        order = np.lexsort((distances, positions))
+        positions = positions[order]
+        distances = distances[order]
+        if edit and len(positions):
+            first = np.ones(len(positions), dtype=bool)
+            first[1:] = positions[1:] != positions[:-1]
+            positions = positions[first]
+            distances = distances[first]
+        return ApproxResult(positions, distances)
+
+    def search_many(self, patterns, n_threads=1):
+        """
+        Search many patterns at once.
+
+        Parameters
+        ----------
+
+        patterns : list or tuple
+            list of patterns, or a packed tuple (offsets, data) where
+            the i-th pattern is data[offsets[i]:offsets[i+1]]
+        n_threads : int (default 1)
+            number of threads, None for all the cores
+
+        Returns
+        -------
+        count : np.ndarray
+            number of occurrences of each pattern
+        position : np.ndarray
+            position of the first occurrence of each pattern in the suffix array
+        """
+        if self.itemsize != 1:
+            raise NotImplementedError("search_many only supports byte strings.")
+        return SearchResult(
+            *sa_search_many(self.string, self.suffix_array, patterns, n_threads)
+        )
+
     @property
     def lcp_array(self):
         if not hasattr(self, "_lcp_array"):
-            self._lcp_array = kasai(self.string, self.suffix_array)
+            if self.sparse:
+                _, lcp = sparse_suffix_array(
+                    self.string, self.suffix_array, return_lcp=True
+                )
+                self._lcp_array = CompactLCP(lcp) if self.compact_lcp else lcp
+            elif self.compact_lcp:
+                self._lcp_array = kasai(self.string, self.suffix_array, compact=True)
+            else:
+                # reuse the rank array if it was already computed
+                self._lcp_array = kasai(
+                    self.string, self.suffix_array, rank=getattr(self, "_rank", None)
+                )
         return self._lcp_array
 
     @property
-    def _lcp_segtree(self):
-        if not hasattr(self, "__lcp_segtree"):
-            self.__lcp_segtree = lcp_segtree(
-                self.string, self.suffix_array, self.lcp_array
-            )
-        return self.__lcp_segtree
+    def rank(self):
+        """inverse of the suffix array"""
+        if self.sparse:
+            raise NotImplementedError("not supported with a sparse suffix array.")
+        if not hasattr(self, "_rank"):
+            self._rank = _inverse_suffix_array(self.suffix_array)
+        return self._rank
+
+    def _lcp_structure(self, backend):
+        # the rank array is computed once and shared with kasai
+        if backend == "segtree":
+            if not hasattr(self, "_segtree"):
+                rank = self.rank
+                _, self._segtree = lcp_segtree(
+                    self.string, self.suffix_array, self.lcp_array, rank
+                )
+            return self.rank, self._segtree
+        if backend == "sparse_table":
+            if not hasattr(self, "_sparse_table"):
+                rank = self.rank
+                _, self._sparse_table = lcp_sparse_table(
+                    self.string, self.suffix_array, self.lcp_array, rank
+                )
+            return self.rank, self._sparse_table
+        raise ValueError(f"backend must be one of {LCP_BACKENDS}")
+
+    def lcp(self, *args, backend=None, n_threads=1):
+        """
+        Longest common prefix of the suffixes starting at two positions.
 
-    def lcp(self, *args):
+        `lcp(i, j)` returns a single value and `lcp(queries)` returns
+        an array for a (q, 2) array of pairs of positions, answered
+        with `n_threads` threads (None for all the cores).
+        `backend` overrides `lcp_backend` for this call.
+        """
+        structure = self._lcp_structure(backend or self.lcp_backend)
         if len(args) == 1:
-            return lcp_query(self._lcp_segtree, args[0])
+            return lcp_query(structure, args[0], n_threads)
         elif len(args) == 2:
-            return lcp_query(self._lcp_segtree, [args])[0]
+            return lcp_query(structure, [args])[0]
 
-    def most_frequent_substrings(self, length, limit=0, minimum_count=1):
+    def most_frequent_substrings(
+        self, length=None, limit=0, minimum_count=1, lengths=None
+    ):
         """
         Parameters
         ----------
 
-        lcp : np.ndarray
-            LCP array
         length : int
             length of the substrings to compare
         limit : int (default 0)
             number of substrings to extract, 0 for all of them
         minimum_count : int (default 1)
             ignore the substrings that occur less than `minimum_count` times
+        lengths : list of int (default None)
+            lengths of the substrings, instead of `length`, computed in
+            a single pass over the LCP array
 
 
         Returns
@@ -128,15 +368,119 @@ class WonderString:
             position in the string
         counts : np.ndarray
             number of occurrences, decreasing
+
+        or, with `lengths`, a dict that maps each length to (positions, counts)
+        """
+        res = most_frequent_substrings(
+            self.lcp_array, length, limit, minimum_count, lengths
+        )
+        if lengths is None:
+            pos, cnt = res
+            return MFSResult(self.suffix_array[pos], cnt)
+        return {
+            length: MFSResult(self.suffix_array[pos], cnt)
+            for length, (pos, cnt) in res.items()
+        }
+
+    def _matching_statistics(self, query, backend):
+        query = cast_to_numpy(query)
+        if query.dtype != self.string.dtype:
+            query = query.astype(self.string.dtype)
+        rank, tree = self._lcp_structure(backend or self.lcp_backend)
+        # the kernel takes either a segment tree or a sparse table
+        segtree = np.empty(0, tree.dtype) if tree.ndim == 2 else tree
+        table = tree if tree.ndim == 2 else np.empty((0, 0), tree.dtype)
+        return _matching_statistics(
+            self.string, self.suffix_array, rank, segtree, table, query
+        )
+
+    def matching_statistics(self, query, backend=None):
+        """
+        Longest match in the string of each suffix of query.
+
+        The suffix array, its inverse and the LCP structure of `lcp` are
+        reused, and the matches are extended along suffix links. Each
+        character of query costs O(log n) range minimum queries (fewer when
+        the matches occur rarely), answered in O(1) with the "sparse_table"
+        backend and in O(log n) with the "segtree" backend.
+
+        Parameters
+        ----------
+
+        query : string or np.ndarray
+            converted to the dtype of the string
+        backend : str (default None)
+            overrides `lcp_backend`
+
+        Returns
+        -------
+        lengths : np.ndarray
+            query[i:i + lengths[i]] occurs in the string and is the longest
+            such prefix of query[i:]
+        positions : np.ndarray
+            position of one of its occurrences, -1 if lengths[i] is 0
+        """
+        lengths, lo, _ = self._matching_statistics(query, backend)
+        if len(self.suffix_array) == 0:
+            return MSResult(lengths, np.full(len(lengths), -1, dtype=np.int64))
+        positions = self.suffix_array[lo].astype(np.int64)
+        positions[lengths == 0] = -1
+        return MSResult(lengths, positions)
+
+    def mems(self, query, min_len=1, backend=None):
         """
-        pos, cnt = most_frequent_substrings(
-            self.lcp_array, length, limit, minimum_count
+        Maximal exact matches (MEMs) induced by the matching statistics,
+        of length at least min_len.
+
+        For each query position i, the longest match query[i:i + length]
+        of the matching statistics is reported with all its occurrences in
+        the string if it is not contained in the match of query[i - 1:].
+        No occurrence can then be extended on either side, so these are
+        MEMs, but not all of them: a shorter match at i that is maximal at
+        another position of the string, because the longer match does not
+        occur there, is not reported. See `matching_statistics`.
+
+        Returns
+        -------
+        query_positions : np.ndarray
+            start of the match in query
+        positions : np.ndarray
+            start of the occurrence in the string
+        lengths : np.ndarray
+            length of the match
+
+        sorted by query position, then by position in the string
+        """
+        lengths, lo, hi = self._matching_statistics(query, backend)
+        selected = lengths >= max(min_len, 1)
+        # the match of query[i:] is contained in the match of query[i - 1:]
+        selected[1:] &= lengths[:-1] != lengths[1:] + 1
+        starts = np.flatnonzero(selected)
+        counts = hi[starts] - lo[starts]
+        rows = np.repeat(lo[starts] - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
         )
-        return MFSResult(self.suffix_array[pos], cnt)
+        query_positions = np.repeat(starts, counts)
+        positions = self.suffix_array[rows].astype(np.int64)
+        order = np.lexsort((positions, query_positions))
+        return MEMResult(
+            query_positions[order],
+            positions[order],
+            np.repeat(lengths[starts], counts)[order],
+        )
+
 
+def iter_common_substrings(
+    s1, s2, limit=25, max_results=None, per_position=False, chunk_size=1 << 16
+):
+    """Maximal common substrings of length at least limit, in chunks.
 
-def common_substrings(s1, s2, limit=25):
-    """All common substrings of length more than limit.
+    A common substring s1[idx1:idx1+length] == s2[idx2:idx2+length] is
+    maximal if it cannot be extended to the left or to the right.
+    The pairs are enumerated in time proportional to the number of results
+    (times the square of the alphabet size), without materializing the
+    pairs of occurrences of each repeated substring, and the memory used
+    is independent of the number of results.
 
     Parameters
     ----------
@@ -144,24 +488,67 @@ def common_substrings(s1, s2, limit=25):
     s1 : string or np.ndarray
     s2 : string or np.ndarray
     limit : int (default 25)
+    max_results : int (default None)
+        stop after this number of results
+    per_position : bool (default False)
+        report each position of s1 at most once, with its longest
+        maximal common substring
+    chunk_size : int (default 65536)
+        maximum number of results per chunk
 
-    Returns
-    -------
+    Yields
+    ------
 
-    result : list of tuples
-        (idx1, idx2, length) where idx1 and idx2 are positions in s1 and s2
-        length >= limit and the pairs are sorted by (idx1, idx2)
+    idx1, idx2, length : np.ndarray
+        int64 arrays of positions in s1 and s2 and lengths, in no particular
+        order
     """
-    # TODO: in Cython 0.30, use fused types to avoid casting
     s1 = cast_to_numpy(s1)
     s2 = cast_to_numpy(s2)
+    if not len(s1) or not len(s2) or max_results == 0:
+        return
     sep = max(s1.max(), s2.max()) + 1
     s = np.empty(len(s1) + len(s2) + 1, dtype=np.result_type(s1[0], s2[0], sep))
     s[: len(s1)] = s1
     s[len(s1)] = sep
     s[len(s1) + 1 :] = s2
-    suffix_array = divsufsort(s)
+    suffix_array = divsufsort(s, force64=True)
     lcp = kasai(s, suffix_array)
-    return _common_substrings(
-        suffix_array.astype(np.uint64), lcp.astype(np.uint64), len(s1), limit
+    # character before each suffix, -1 at the start of s1 and s2
+    left = s[suffix_array - 1].astype(np.int64)
+    left -= left.min()
+    left[(suffix_array == 0) | (suffix_array == len(s1) + 1)] = -1
+    yield from _maximal_pairs(
+        suffix_array,
+        lcp,
+        left,
+        len(s1),
+        limit,
+        chunk_size,
+        -1 if max_results is None else max_results,
+        per_position,
+    )
+
+
+def common_substrings(s1, s2, limit=25, max_results=None, per_position=False):
+    """All maximal common substrings of length at least limit.
+
+    See `iter_common_substrings` for the parameters.
+
+    Returns
+    -------
+
+    result : list of tuples
+        (idx1, idx2, length) where idx1 and idx2 are positions in s1 and s2
+        length >= limit and the pairs are sorted by (idx1, idx2)
+    """
+    chunks = list(
+        iter_common_substrings(
+            s1, s2, limit, max_results=max_results, per_position=per_position
+        )
     )
+    if not chunks:
+        return []
+    idx1, idx2, length = (np.concatenate(arrays) for arrays in zip(*chunks))
+    order = np.lexsort((idx2, idx1))
+    return list(zip(idx1[order].tolist(), idx2[order].tolist(), length[order].tolist()))
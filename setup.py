@@ -90,7 +90,21 @@ extensions = [
         include_dirs=[numpy.get_include()],
         language="c++",
         define_macros=[("CYTHON_TRACE", "1")] if PROFILE else None,
-    )
+    ),
+    Extension(
+        "pydivsufsort.suffixsort",
+        ["pydivsufsort/suffixsort.pyx"],
+        include_dirs=[numpy.get_include()],
+        language="c++",
+        define_macros=[("CYTHON_TRACE", "1")] if PROFILE else None,
+    ),
+    Extension(
+        "pydivsufsort.buffers",
+        ["pydivsufsort/buffers.pyx"],
+        include_dirs=[numpy.get_include()],
+        language="c++",
+        define_macros=[("CYTHON_TRACE", "1")] if PROFILE else None,
+    ),
 ]
 
 setup(
@@ -104,3 +104,100 @@ def all_common_substrings(s1, s2):
 def min_rotation(s):
     s = list(s)
     return min(range(len(s)), key=lambda i: s[i:] + s[:i])
+
+
+def levenshtein(a, b):
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a):
+        cur = [i + 1]
+        for j, y in enumerate(b):
+            cur.append(min(prev[j + 1] + 1, cur[j] + 1, prev[j] + (x != y)))
+        prev = cur
+    return prev[-1]
+
+
+def censor(patterns, text, replacement):
+    """
+    the union of the occurrences of all the patterns is deleted,
+    and each group of overlapping occurrences is replaced once
+    """
+    spans = sorted(
+        (i, i + len(p))
+        for p in patterns
+        for i in range(len(text) - len(p) + 1)
+        if text[i : i + len(p)] == p
+    )
+    groups = []
+    for a, b in spans:
+        if groups and a < groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], b)
+        else:
+            groups.append([a, b])
+    out = text[:0]
+    start = 0
+    for a, b in groups:
+        out += text[start:a] + replacement
+        start = b
+    return out + text[start:]
+
+
+def most_frequent_substrings(lcp, length, limit=0, minimum_count=1):
+    """runs of lcp >= length as (count, first row), by decreasing count"""
+    runs = []
+    start = 0
+    for i in range(len(lcp)):
+        if i == len(lcp) - 1 or lcp[i] < length:
+            runs.append((i + 1 - start, start))
+            start = i + 1
+    runs = sorted((r for r in runs if r[0] >= minimum_count), reverse=True)
+    return runs[:limit] if limit else runs
+
+
+def repeats(s):
+    """right-maximal, maximal and supermaximal repeats of s"""
+    occurrences = defaultdict(list)
+    for i in range(len(s)):
+        for j in range(i + 1, len(s) + 1):
+            occurrences[s[i:j]].append(i)
+    repeated = {w: occ for w, occ in occurrences.items() if len(occ) > 1}
+    right_maximal = set()
+    maximal = set()
+    supermaximal = set()
+    for w, occ in repeated.items():
+        # None stands for the start or the end of s
+        left = [s[i - 1] if i else None for i in occ]
+        right = [s[i + len(w)] if i + len(w) < len(s) else None for i in occ]
+        if None in right or len(set(right)) > 1:
+            right_maximal.add(w)
+            if None in left or len(set(left)) > 1:
+                maximal.add(w)
+        if len(set(left)) == len(left) and len(set(right)) == len(right):
+            supermaximal.add(w)
+    return right_maximal, maximal, supermaximal
+
+
+def matching_statistics(s, query):
+    """length of the longest prefix of each suffix of query that occurs in s"""
+    lengths = []
+    for i in range(len(query)):
+        k = 0
+        while i + k < len(query) and query[i : i + k + 1] in s:
+            k += 1
+        lengths.append(k)
+    return lengths
+
+
+def approximate_occurrences(s, pattern, k, edit=False):
+    """(position, distance) of the matches within distance k, naively"""
+    m = len(pattern)
+    ans = []
+    for i in range(len(s)):
+        if edit:
+            d = min(levenshtein(pattern, s[i:j]) for j in range(i, len(s) + 1))
+        elif i + m <= len(s):
+            d = sum(a != b for a, b in zip(pattern, s[i : i + m]))
+        else:
+            continue
+        if d <= k:
+            ans.append((i, d))
+    return ans
@@ -1,29 +1,69 @@
 import array
+import importlib
+import mmap
+import os
 import random
+import tracemalloc
+import warnings
 
 import numpy as np
 import pytest
-from reference import BWT, all_common_substrings, iBWT, longest_common_prefix
+from reference import (
+    BWT,
+    all_common_substrings,
+    approximate_occurrences,
+    censor,
+    iBWT,
+    longest_common_prefix,
+    matching_statistics,
+    repeats,
+)
+from reference import levenshtein as levenshtein_ref
 from reference import min_rotation as min_rotation_ref
+from reference import most_frequent_substrings as mfs_ref
 from reference import suffix_array
 
 from pydivsufsort import (
+    AhoCorasick,
+    CompactLCP,
+    DocumentIndex,
+    FMIndex,
+    RLBWTIndex,
+    WonderString,
     bw_transform,
+    bw_transform_file,
+    censor_stream,
     common_substrings,
     divsufsort,
+    divsufsort_file,
+    divsufsort_many,
     inverse_bw_transform,
+    iter_common_substrings,
     kasai,
+    kasai_many,
     kmp_censor_stream,
+    lcp_intervals,
     lcp_query,
     lcp_segtree,
+    lcp_sparse_table,
     lempel_ziv_complexity,
     lempel_ziv_factorization,
     levenshtein,
+    levenshtein_many,
     longest_previous_factor,
+    lz77_compress,
+    lz77_decompress,
+    lz77_factorization,
     min_rotation,
+    min_rotation_many,
     most_frequent_substrings,
+    plcp,
     sa_search,
+    sa_search_many,
+    sparse_suffix_array,
 )
+from pydivsufsort.buffers import as_array
+from pydivsufsort.stringalg import repeated_substrings
 from pydivsufsort.divsufsort import _SUPPORTED_DTYPES, _minimize_dtype
 
 
@@ -58,6 +98,8 @@ def assert_correct(inp, queries=None):
     lcp_opt = lcp_query(segtree, queries)
     lcp_naive = [longest_common_prefix(inp, i, j) for i, j in queries]
     assert (lcp_opt == lcp_naive).all(), (inp, lcp_naive, lcp_opt)
+    lcp_opt = lcp_query(lcp_sparse_table(inp), queries)
+    assert (lcp_opt == lcp_naive).all(), (inp, lcp_naive, lcp_opt)
 
     if not (isinstance(inp, np.ndarray) and inp.dtype != np.uint8):
         bwt_opt = bw_transform(inp)
@@ -107,6 +149,12 @@ def test_containers():
     for cast in CASTS:
         assert_correct(cast(inp))
 
+    # lists and tuples are converted, not read as buffers
+    assert list(divsufsort([1, 2, 3, 1, 2])) == [3, 0, 4, 1, 2]
+    assert list(divsufsort((1, 2, 3, 1, 2))) == [3, 0, 4, 1, 2]
+    assert list(WonderString([1, 2, 3, 1, 2]).suffix_array) == [3, 0, 4, 1, 2]
+    assert common_substrings([1, 2, 3, 4], [9, 2, 3, 4], limit=2) == [(1, 1, 3)]
+
 
 def test_small():
     for dtype in _SUPPORTED_DTYPES:
@@ -126,6 +174,17 @@ def test_minimize_dtype():
         assert _minimize_dtype(inp).dtype.itemsize == np.dtype(dtype).itemsize, inp
 
 
+def test_integer_alphabet():
+    for n in [1, 2, 3, 10, 100]:
+        for high in [2, 300, 70_000, 2**40]:
+            inp = np.random.randint(0, high, size=n, dtype=np.int64)
+            sa = suffix_array(list(inp))
+            assert (divsufsort(inp) == sa).all(), inp
+            out = divsufsort(inp.astype(np.uint64) * 7919, force64=True)
+            assert out.dtype == np.int64
+            assert (out == sa).all(), inp
+
+
 def test_kasai():
     inp = np.array(list(b"banana"), dtype="uint8")
     out = np.array([1, 3, 0, 0, 2, 0])
@@ -133,6 +192,89 @@ def test_kasai():
     for cast in CASTS:
         assert (kasai(cast(inp)) == out).all()
 
+    for n in [0, 1, 2, 100, 1000]:
+        inp = np.random.randint(2, size=n, dtype=np.uint8)
+        sa = divsufsort(inp)
+        lcp = kasai(inp, sa)
+        naive = [longest_common_prefix(inp, i, j) for i, j in zip(sa[:-1], sa[1:])]
+        assert lcp.tolist() == naive + [0] * bool(n)
+        rank, _ = lcp_segtree(inp, sa)
+        assert (kasai(inp, sa, rank=rank) == lcp).all()
+        assert (plcp(inp, sa)[sa] == lcp).all()
+        buffer = np.empty_like(sa)
+        assert kasai(inp, sa, out=buffer) is buffer
+        assert (buffer == lcp).all()
+        assert plcp(inp, sa, out=buffer) is buffer
+    with pytest.raises(ValueError):
+        kasai(inp, sa, out=np.empty(len(sa) + 1, dtype=sa.dtype))
+
+
+def test_compact_lcp():
+    for text in ["", "a", "banana", "ab" * 1000, "".join(random.choices("ab", k=3000))]:
+        sa = divsufsort(text)
+        lcp = kasai(text, sa)
+        for compact in [CompactLCP(lcp), kasai(text, sa, compact=True, n_threads=3)]:
+            assert len(compact) == len(lcp)
+            assert compact.dtype == lcp.dtype
+            assert (np.asarray(compact) == lcp).all()
+            assert (compact.exception_rows == np.flatnonzero(lcp >= 255)).all()
+            assert all(compact[i] == lcp[i] for i in range(-len(lcp), len(lcp), 7))
+            assert (compact[10:-3:2] == lcp[10:-3:2]).all()
+            rows = np.random.randint(-len(lcp), len(lcp), size=100 * (len(lcp) > 0))
+            assert (compact[rows] == lcp[rows]).all()
+            assert (compact[lcp > 100] == lcp[lcp > 100]).all()
+        if len(text) > 1000 and lcp.max() < 255:
+            assert compact.nbytes < lcp.nbytes / 3
+
+        lpf = longest_previous_factor(text, sa, compact)
+        assert (lpf == longest_previous_factor(text)).all()
+        assert lempel_ziv_complexity(text, sa, compact) == lempel_ziv_complexity(text)
+        for length in [1, 300]:
+            for res, ref in zip(
+                most_frequent_substrings(compact, length),
+                most_frequent_substrings(lcp, length),
+            ):
+                assert (res == ref).all()
+        rank, segtree = lcp_segtree(text, sa, compact)
+        # the first node of the segment tree is not used
+        assert (segtree[1:] == lcp_segtree(text, sa)[1][1:]).all()
+        rank, table = lcp_sparse_table(text, sa, compact)
+        assert (table == lcp_sparse_table(text, sa)[1]).all()
+        assert repeated_substrings(sa, compact) == repeated_substrings(sa, lcp)
+        for res, ref in zip(
+            lcp_intervals(compact, text, sa, kind="maximal"),
+            lcp_intervals(lcp, text, sa, kind="maximal"),
+        ):
+            assert (res == ref).all()
+    with pytest.raises(ValueError):
+        kasai("banana", compact=True, out=np.empty(6, np.int32))
+
+    # the linear scans read the compact array without decoding it
+    lcp = kasai("".join(random.choices("ab", k=1 << 18)))
+    compact = CompactLCP(lcp)
+    limit = lcp.nbytes // 4
+    assert peak_allocation(most_frequent_substrings, compact, 5, limit=10) < limit
+    assert peak_allocation(lcp_intervals, compact, min_length=30) < limit
+
+
+def test_threads():
+    inp = np.random.randint(3, size=10_000, dtype=np.uint8)
+    sa = divsufsort(inp)
+    lcp = kasai(inp, sa)
+    rank, segtree = lcp_segtree(inp, sa)
+    queries = np.random.randint(len(inp), size=(1000, 2))
+    expected = lcp_query((rank, segtree), queries)
+    for n_threads in [2, 3, None]:
+        assert (kasai(inp, sa, n_threads=n_threads) == lcp).all()
+        assert (kasai(inp, sa, rank=rank, n_threads=n_threads) == lcp).all()
+        assert (plcp(inp, sa, n_threads=n_threads)[sa] == lcp).all()
+        structure = lcp_segtree(inp, sa, n_threads=n_threads)
+        assert (structure[0] == rank).all()
+        assert (structure[1][1:] == segtree[1:]).all()
+        assert (lcp_query(structure, queries, n_threads=n_threads) == expected).all()
+        structure = lcp_sparse_table(inp, sa, n_threads=n_threads)
+        assert (lcp_query(structure, queries, n_threads=n_threads) == expected).all()
+
 
 def test_non_contiguous():
     for dtype in _SUPPORTED_DTYPES:
@@ -168,8 +310,187 @@ def test_sa_search():
                 assert (count, left) == sa_search(inp, sa, query)
 
 
+def test_sa_search_many():
+    for n in [0, 4, 100]:
+        inp = np.random.randint(3, size=n, dtype=np.uint8)
+        sa = divsufsort(inp)
+        patterns = [np.random.randint(3, size=m, dtype=np.uint8) for m in range(1, 5)]
+        patterns *= 10
+        count, left = sa_search_many(inp, sa, patterns, n_threads=3)
+        packed = sa_search_many(
+            inp.tobytes(),
+            sa,
+            (np.cumsum([0] + [len(p) for p in patterns]), np.concatenate(patterns)),
+        )
+        assert (packed[0] == count).all() and (packed[1] == left).all()
+        for pattern, c, l in zip(patterns, count, left):
+            assert sa_search(inp, sa, pattern) == (c, l if c else None)
+
+    sa = divsufsort("banana", force64=True)
+    count, left = sa_search_many("banana", sa, ["an", ""])
+    assert count.dtype == np.int64
+    assert list(count) == [2, 6] and list(left) == [1, 0]
+
+
+def test_sparse_suffix_array():
+    for n in [1, 30, 200]:
+        for _ in range(10):
+            # long runs make suffixes share more than their 16 cached bytes
+            inp = np.repeat(np.random.randint(3, size=n, dtype=np.uint8), 7)
+            positions = np.random.choice(len(inp), np.random.randint(1, 50))
+            sa, lcp = sparse_suffix_array(inp, positions, return_lcp=True)
+            full = divsufsort(inp)
+            expected = full[np.isin(full, positions)]
+            assert (sa == expected).all()
+            assert lcp[-1] == 0
+            for i in range(len(sa) - 1):
+                assert lcp[i] == longest_common_prefix(inp, sa[i], sa[i + 1])
+            for m in range(1, 5):
+                query = inp[positions[0] : positions[0] + m]
+                m = len(query)
+                count, left = sa_search(inp, sa, query)
+                matches = [
+                    p for p in set(positions) if np.array_equal(inp[p : p + m], query)
+                ]
+                assert count == len(matches)
+                assert sorted(sa[left : left + count]) == sorted(matches)
+                assert sa_search_many(inp, sa, [query])[0][0] == count
+
+    assert len(sparse_suffix_array("banana", [])) == 0
+    assert list(sparse_suffix_array("banana", [5, 1, 3, 3])) == [5, 3, 1]
+    with pytest.raises(ValueError):
+        sparse_suffix_array("banana", [6])
+    with pytest.raises(TypeError):
+        sparse_suffix_array(np.arange(3, dtype=np.uint16), [0])
+
+
+def test_fm_index():
+    for n in [0, 1, 5, 300]:
+        inp = np.random.randint(97, 100, size=n, dtype=np.uint8)
+        text = inp.tobytes()
+        for sample_rate, block_size in [(1, 1), (3, 4), (32, 256)]:
+            fm = FMIndex(inp, sample_rate=sample_rate, block_size=block_size)
+            for m in [0, 1, 2, 4]:
+                pattern = np.random.randint(97, 101, size=m, dtype=np.uint8).tobytes()
+                matches = [i for i in range(n - m + 1) if text[i : i + m] == pattern]
+                if not m:
+                    matches = list(range(n))
+                assert fm.count(pattern) == len(matches)
+                assert sorted(fm.locate(pattern)) == matches
+
+    fm = FMIndex("banana")
+    assert fm.count("ana") == 2
+    assert list(fm.locate("ana")) == [3, 1]
+    inp = np.random.randint(4, size=100_000, dtype=np.uint8)
+    assert FMIndex(inp).nbytes < 2 * len(inp)
+    with pytest.raises(ValueError):
+        FMIndex("banana", block_size=3)
+
+
+def test_rlbwt_index():
+    for n in [0, 1, 5, 300]:
+        inp = np.random.randint(97, 100, size=n, dtype=np.uint8)
+        text = inp.tobytes()
+        sa = divsufsort(inp)
+        index = RLBWTIndex(inp)
+        for m in [0, 1, 2, 4]:
+            pattern = np.random.randint(97, 101, size=m, dtype=np.uint8).tobytes()
+            matches = [i for i in range(n - m + 1) if text[i : i + m] == pattern]
+            if not m:
+                matches = list(range(n))
+            assert index.count(pattern) == len(matches)
+            # in suffix array order
+            assert list(index.locate(pattern)) == [p for p in sa if p in matches]
+
+    index = RLBWTIndex("banana")
+    assert index.count("ana") == 2
+    assert list(index.locate("ana")) == [3, 1]
+    # 200 versions of the same text with a few edits
+    inp = np.tile(np.random.randint(4, size=500, dtype=np.uint8), 200)
+    inp[np.random.randint(len(inp), size=20)] = 4
+    index = RLBWTIndex(inp)
+    assert index.n_runs < len(inp) / 20
+    assert index.nbytes < FMIndex(inp).nbytes / 3
+    assert index.count(inp[:10]) == FMIndex(inp).count(inp[:10])
+
+
+def test_document_index():
+    random.seed(0)
+    documents = [
+        "".join(random.choices("ab", k=random.randint(0, 12))) for _ in range(50)
+    ]
+    index = DocumentIndex(documents)
+    assert len(index) == len(documents)
+    assert index.document(3).tobytes() == documents[3].encode()
+    suffixes = [
+        documents[d][o:]
+        for d, o in zip(
+            index.doc_ids, index.suffix_array - index.starts[index.doc_ids]
+        )
+    ]
+    assert suffixes == sorted(suffixes)
+    assert index.lcp_array.tolist() == [
+        len(os.path.commonprefix([a, b]))
+        for a, b in zip(suffixes, suffixes[1:] + [""])
+    ]
+    for pattern in ["a", "ab", "bba", "abab", "aaaaaaaaaaaaa"]:
+        expected = sorted(
+            (d, o)
+            for d, doc in enumerate(documents)
+            for o in range(len(doc))
+            if doc.startswith(pattern, o)
+        )
+        doc_ids, offsets = index.locate(pattern)
+        assert sorted(zip(doc_ids.tolist(), offsets.tolist())) == expected
+        assert index.search(pattern).count == len(expected)
+        assert index.documents(pattern).tolist() == sorted({d for d, _ in expected})
+
+    # no match across documents
+    index = DocumentIndex(["ab", "cd"])
+    assert index.search("bc").count == 0
+    assert index.search_many(["b", "bc", "c"], n_threads=2).count.tolist() == [1, 0, 1]
+    docs, counts = DocumentIndex(["aa", "b", "a"]).documents("a", return_counts=True)
+    assert docs.tolist() == [0, 2]
+    assert counts.tolist() == [2, 1]
+
+
 def test_levenshtein():
     assert levenshtein("kitten", "sitting") == 3
+    assert levenshtein("", "abc") == 3
+    assert levenshtein("kitten", "sitting", max_distance=2) == 3
+    assert levenshtein("kitten", "sitting", max_distance=3) == 3
+
+    random.seed(0)
+    for _ in range(300):
+        # lengths around 64 exercise the block boundaries
+        a = "".join(random.choices("abc", k=random.randint(0, 150)))
+        b = list(a[: random.randint(0, 150)])
+        for _ in range(random.randint(0, 10)):
+            if b:
+                b[random.randrange(len(b))] = random.choice("abcd")
+        b = "".join(b)
+        d = levenshtein_ref(a, b)
+        assert levenshtein(a, b) == d
+        k = random.randint(0, 20)
+        assert levenshtein(a, b, max_distance=k) == min(d, k + 1)
+        a_int = np.array([ord(c) << 20 for c in a], dtype=np.int64)
+        b_int = np.array([ord(c) << 20 for c in b], dtype=np.int32)
+        assert levenshtein(a_int, b_int) == d
+
+
+def test_levenshtein_many():
+    candidates = ["kitten", "sitting", "", "kit", b"mitten"]
+    expected = [levenshtein("kitten", c) for c in candidates]
+    assert levenshtein_many("kitten", candidates).tolist() == expected
+    assert levenshtein_many("kitten", candidates, max_distance=2).tolist() == [
+        min(d, 3) for d in expected
+    ]
+    data = b"".join(c.encode() if isinstance(c, str) else c for c in candidates)
+    offsets = np.cumsum([0] + [len(c) for c in candidates])
+    assert (
+        levenshtein_many("kitten", (offsets, data), n_threads=2).tolist() == expected
+    )
+    assert len(levenshtein_many("kitten", [])) == 0
 
 
 def test_mfs():
@@ -180,6 +501,108 @@ def test_mfs():
     assert (sa[pos] == [6, 5]).all()
     assert (cnt == [4, 3]).all()
 
+    for _ in range(20):
+        s = "".join(random.choices("abc", k=random.randrange(1, 300)))
+        lcp = kasai(s)
+        lengths = [0, 1, 2, 3, 5, 8]
+        for limit in [0, 1, 5]:
+            for minimum_count in [1, 2, 4]:
+                spectrum = most_frequent_substrings(
+                    lcp, limit=limit, minimum_count=minimum_count, lengths=lengths
+                )
+                assert sorted(spectrum) == lengths
+                for length in lengths:
+                    ref = mfs_ref(lcp, length, limit, minimum_count)
+                    pos, cnt = most_frequent_substrings(
+                        lcp, length, limit, minimum_count
+                    )
+                    assert list(zip(cnt, pos)) == ref
+                    assert (spectrum[length][0] == pos).all()
+                    assert (spectrum[length][1] == cnt).all()
+    with pytest.raises(ValueError):
+        most_frequent_substrings(lcp)
+
+
+def test_lcp_intervals():
+    for _ in range(200):
+        s = "".join(np.random.choice(list("abc"), size=np.random.randint(1, 25)))
+        sa = divsufsort(s)
+        lcp = kasai(s, sa)
+        ans = dict(zip(("all", "maximal", "supermaximal"), repeats(s)))
+        for kind, ref in ans.items():
+            start, end, length = lcp_intervals(lcp, s, sa, kind)
+            words = [s[sa[i] : sa[i] + k] for i, k in zip(start, length)]
+            assert set(words) == ref, (s, kind)
+            if kind == "all":
+                assert len(words) == len(ref)
+            for i, j, word in zip(start, end, words):
+                assert j - i == sum(s.startswith(word, p) for p in range(len(s)))
+        assert repeated_substrings(sa, lcp) == list(
+            zip(*(a.tolist() for a in lcp_intervals(lcp)))
+        )
+
+        # the parents with a filter are the closest returned ancestors
+        start, end, length, parent, n_children = lcp_intervals(
+            lcp, s, sa, "maximal", min_count=3, return_tree=True
+        )
+        for i in range(len(start)):
+            ancestors = [
+                k
+                for k in range(len(start))
+                if start[k] <= start[i] and end[i] <= end[k] and length[k] < length[i]
+            ]
+            assert parent[i] == max(ancestors, key=length.__getitem__, default=-1)
+            assert end[i] - start[i] >= 3
+
+        start, end, length, parent, n_children = lcp_intervals(
+            lcp, min_length=0, return_tree=True
+        )
+        for i in range(len(start)):
+            inner = np.flatnonzero(parent == i)
+            leaves = end[i] - start[i] - (end[inner] - start[inner]).sum()
+            assert n_children[i] == len(inner) + leaves
+    with pytest.raises(ValueError):
+        lcp_intervals(lcp, kind="maximal")
+
+
+def test_matching_statistics():
+    for _ in range(100):
+        s = "".join(np.random.choice(list("abc"), size=np.random.randint(1, 30)))
+        query = "".join(np.random.choice(list("abcd"), size=np.random.randint(30)))
+        ref = matching_statistics(s, query)
+        mems = [
+            (i, p, k)
+            for i, k in enumerate(ref)
+            if k >= 2 and (i == 0 or ref[i - 1] != k + 1)
+            for p in range(len(s))
+            if s.startswith(query[i : i + k], p)
+        ]
+        for backend in ["segtree", "sparse_table"]:
+            ws = WonderString(s, lcp_backend=backend)
+            lengths, positions = ws.matching_statistics(query)
+            assert lengths.tolist() == ref
+            for i, (k, p) in enumerate(zip(lengths, positions)):
+                assert s[p : p + k] == query[i : i + k] if k else p == -1
+            assert list(zip(*(a.tolist() for a in ws.mems(query, 2)))) == mems
+
+
+def test_search_approx():
+    for _ in range(100):
+        s = "".join(np.random.choice(list("abc"), size=np.random.randint(1, 30)))
+        pattern = "".join(np.random.choice(list("abc"), size=np.random.randint(5)))
+        k = np.random.randint(3)
+        ws = WonderString(s)
+        for metric in ["hamming", "edit"]:
+            ref = approximate_occurrences(s, pattern, k, edit=metric == "edit")
+            positions, distances = ws.search_approx(pattern, k, metric)
+            assert list(zip(positions.tolist(), distances.tolist())) == ref
+
+    ws = WonderString(np.array([3, 1, 4, 1, 5], dtype=np.uint32))
+    pattern = np.array([1, 5], dtype=np.uint32)
+    assert ws.search_approx(pattern, 1).positions.tolist() == [1, 3]
+    with pytest.raises(ValueError):
+        ws.search_approx(pattern, 1, metric="jaccard")
+
 
 def test_common_substrings():
     s1 = "ananas"
@@ -196,9 +619,31 @@ def test_common_substrings():
             s2,
         )
 
+    for _ in range(100):
+        s1 = np.random.randint(0, 3, size=np.random.randint(1, 30), dtype="uint8")
+        s2 = np.random.randint(0, 3, size=np.random.randint(1, 30), dtype="uint8")
+        ref = [m for m in all_common_substrings(s1, s2) if m[2] >= 2]
+        assert common_substrings(s1, s2, limit=2) == ref
+
+        longest = {}
+        for i, _, k in ref:
+            longest[i] = max(longest.get(i, 0), k)
+        ans = common_substrings(s1, s2, limit=2, per_position=True)
+        assert set(ans) <= set(ref)
+        assert dict((i, k) for i, _, k in ans) == longest
+        assert len(ans) == len(longest)
+
+        chunks = list(iter_common_substrings(s1, s2, 2, max_results=5, chunk_size=2))
+        assert all(len(idx1) <= 2 for idx1, _, _ in chunks)
+        found = [m for chunk in chunks for m in zip(*(c.tolist() for c in chunk))]
+        assert len(found) == min(5, len(ref))
+        assert set(found) <= set(ref)
+
 
 def test_warnings_errors():
-    with pytest.warns(UserWarning):
+    with warnings.catch_warnings():
+        # str are used without conversion
+        warnings.simplefilter("error")
         divsufsort("a" * 1000)
     import ctypes
 
@@ -219,6 +664,151 @@ def test_warnings_errors():
         bw_transform(np.array([0]))
 
 
+def peak_allocation(func, *args, **kwargs):
+    """peak memory allocated by Python and numpy during the call"""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_zero_copy(tmp_path):
+    n = 1 << 20
+    text = "".join(random.choices("ab", k=n))
+    path = tmp_path / "text"
+    path.write_text(text)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    inputs = [text, text.encode(), bytearray(text.encode()), memoryview(text.encode())]
+    inputs.append(mapped)
+    sa = divsufsort(text)
+    rank = lcp_segtree(text, sa)[0]
+    lcp = np.empty_like(sa)
+    bwt = np.empty(n, dtype=np.uint8)
+
+    for inp in inputs:
+        arr = as_array(inp)
+        assert arr.tobytes() == text.encode()
+        # none of these calls copy the input
+        assert peak_allocation(as_array, inp) < n // 10
+        assert peak_allocation(divsufsort, inp, out=sa) < n // 10
+        assert peak_allocation(kasai, inp, sa, rank=rank, out=lcp) < n // 10
+        assert peak_allocation(bw_transform, inp, out=bwt) < n // 10
+        assert peak_allocation(sa_search, inp, sa, "abba") < n // 10
+        assert peak_allocation(min_rotation, inp) < n // 10
+    assert not as_array(text).flags["WRITEABLE"]
+    assert (lcp == kasai(text)).all()
+    with pytest.raises(TypeError):
+        as_array("é")
+
+
+def test_divsufsort_many():
+    records = [
+        "".join(random.choices("ab", k=random.randrange(100))) for _ in range(100)
+    ]
+    records += ["", "a" * 5000, "".join(random.choices("acgt", k=10000))]
+    records += [bytes(random.choices(range(256), k=300)) for _ in range(10)]
+    for n_threads in [1, 4]:
+        offsets, sa = divsufsort_many(records, n_threads=n_threads)
+        offsets, lcp = kasai_many(records, sa, n_threads=n_threads)
+        assert len(offsets) == len(records) + 1
+        for i, record in enumerate(records):
+            rows = slice(offsets[i], offsets[i + 1])
+            assert (sa[rows] == divsufsort(record)).all()
+            assert (lcp[rows] == kasai(record)).all()
+        assert (kasai_many(records)[1] == lcp).all()
+
+    data = b"".join(r.encode() if isinstance(r, str) else r for r in records)
+    packed = (offsets, data)
+    offsets64, sa64 = divsufsort_many(packed, force64=True)
+    assert sa64.dtype == np.int64
+    assert (offsets64 == offsets).all() and (sa64 == sa).all()
+    with pytest.raises(ValueError):
+        kasai_many(records, sa[1:])
+
+
+def test_divsufsort_threads(monkeypatch):
+    module = importlib.import_module("pydivsufsort.divsufsort")
+    # the parallel path only runs on several cores and long texts
+    monkeypatch.setattr(module, "_available_cores", lambda: 8)
+    monkeypatch.setattr(module, "_PARALLEL_MIN_LENGTH", 1 << 16)
+    n = 1 << 17
+    periodic = "".join(random.choices("ab", k=1000)) * (n // 1000)
+    texts = [
+        "".join(random.choices("acgt", k=n)),
+        "".join(random.choices("ab", k=n)),
+        bytes(random.choices(range(256), k=n)),
+        periodic + "".join(random.choices("ab", k=n)),
+        "ab" * n,
+        "a" * n,
+    ]
+    for text in texts:
+        sa = divsufsort(text)
+        for n_threads in [2, 3, 8, None]:
+            assert (divsufsort(text, n_threads=n_threads) == sa).all()
+        sa64 = divsufsort(text, force64=True, n_threads=4)
+        assert sa64.dtype == np.int64
+        assert (sa64 == sa).all()
+        out = bytearray(4 * len(sa))
+        divsufsort(text, out=out, n_threads=4)
+        assert (np.frombuffer(out, dtype=np.int32) == sa).all()
+
+    # a single core falls back to the single-threaded sort
+    monkeypatch.setattr(module, "_available_cores", lambda: 1)
+
+    def parallel(*args):
+        raise AssertionError("the blocks should not be sorted in parallel")
+
+    external = importlib.import_module("pydivsufsort.external")
+    monkeypatch.setattr(external, "_divsufsort_parallel", parallel)
+    assert (divsufsort(texts[0], n_threads=4) == divsufsort(texts[0])).all()
+
+
+def test_divsufsort_file(tmp_path):
+    texts = ["", "a", "banana", "a" * 1000, "ab" * 500, "abcabd" * 300 + "abc"]
+    texts += ["".join(random.choices("ab", k=3000)) for _ in range(3)]
+    texts.append(bytes(random.choices(range(256), k=5000)))
+    path = tmp_path / "text"
+    for text in texts:
+        text = text.encode() if isinstance(text, str) else text
+        path.write_bytes(text)
+        sa_ref = divsufsort(text)
+        lcp_ref = kasai(text, sa_ref)
+        bwt_ref = bw_transform(text)
+        # small limits give many blocks
+        for memory_limit in [12, 120, 1200, 1 << 20]:
+            sa, lcp = divsufsort_file(
+                path, tmp_path / "sa", tmp_path / "lcp", memory_limit=memory_limit
+            )
+            assert (sa == sa_ref).all()
+            assert (lcp == lcp_ref).all()
+            idx = bw_transform_file(path, tmp_path / "bwt", memory_limit=memory_limit)
+            assert idx == bwt_ref[0]
+            assert (tmp_path / "bwt").read_bytes() == bwt_ref[1].tobytes()
+        idx = bw_transform_file(text, tmp_path / "bwt", sa_path=tmp_path / "sa")
+        assert idx == bwt_ref[0]
+
+    sa = divsufsort_file(b"banana", tmp_path / "sa64", force64=True)
+    assert sa.dtype == np.int64
+    assert (sa == divsufsort("banana")).all()
+
+    # the blocks stay within memory_limit with int64 suffix arrays
+    text = bytes(random.choices(range(256), k=1 << 18))
+    memory_limit = 1 << 20
+    path = tmp_path / "sa64"
+    peak = peak_allocation(
+        divsufsort_file, text, path, memory_limit=memory_limit, force64=True
+    )
+    assert peak <= memory_limit
+
+    # a suffix array file of the wrong size is not read
+    (tmp_path / "sa").write_bytes(b"\0" * 10)
+    with pytest.raises(ValueError):
+        bw_transform_file(b"banana", tmp_path / "bwt", sa_path=tmp_path / "sa")
+
+
 def test64():
     s = "banana"
     sa = divsufsort(s, force64=True)
@@ -233,12 +823,72 @@ def test64():
     assert res == (2, 1)
 
 
+def test_output_buffers():
+    s = b"banana"
+    sa = divsufsort(s)
+    out = np.zeros(6, dtype=np.int64)
+    assert divsufsort(s, out=out) is out
+    assert (out == sa).all()
+    buf = bytearray(6 * 4)
+    assert (divsufsort(s, out=buf) == sa).all()
+    assert (np.frombuffer(buf, dtype=np.int32) == sa).all()
+    out = np.zeros(6, dtype=np.int32)
+    divsufsort(np.array([0, 256, 0, 256, 0, 256]), out=out)
+    assert (out == [4, 2, 0, 5, 3, 1]).all()
+    with pytest.raises(TypeError):
+        divsufsort(s, out=np.zeros(6, dtype=np.uint32))
+    with pytest.raises(ValueError):
+        divsufsort(s, out=np.zeros(5, dtype=np.int32))
+
+    idx, bwt = bw_transform(s)
+    out = mmap.mmap(-1, 6)
+    assert bw_transform(s, out=out)[0] == idx
+    assert out[:] == bwt.tobytes()
+    tr = np.zeros(6, dtype=np.uint8)
+    assert inverse_bw_transform(idx, out, out=tr) is tr
+    assert tr.tobytes() == s
+
+    for cast in [bytearray, cast_to_array, lambda x: np.array(list(x), "uint8")]:
+        inp = cast(s)
+        assert bw_transform(inp, sa.copy(), inplace=True)[0] == idx
+        assert bytes(inp) == bwt.tobytes()
+        assert bw_transform(cast(s), inplace=True)[0] == idx
+        inverse_bw_transform(idx, inp, inplace=True)
+        assert bytes(inp) == s
+    with pytest.raises(TypeError):
+        bw_transform(s, inplace=True)
+
+
 def test_lpf():
     s = "abbaabbbaaabab"
     lpf = longest_previous_factor(s)
     assert (lpf == np.array([0, 0, 1, 1, 3, 2, 4, 3, 2, 3, 2, 2, 2, 1])).all()
 
 
+def test_min_rotation():
+    records = []
+    for _ in range(300):
+        s = np.random.randint(3, size=np.random.randint(1, 20), dtype=np.uint8)
+        if np.random.rand() < 0.3:
+            # periodic strings have several minimum rotations
+            s = np.tile(s[: len(s) // 3 + 1], 3)
+        records.append(s)
+        k = min_rotation(s)
+        assert k == min_rotation_ref(s)
+        assert (min_rotation(s, rotate=True) == np.roll(s, -k)).all()
+
+    starts = min_rotation_many(records)
+    assert list(starts) == [min_rotation_ref(s) for s in records]
+    records = [s.astype(np.int32) for s in records]
+    offsets, rotated = min_rotation_many(records, rotate=True)
+    assert rotated.dtype == np.int32
+    for s, k, a, b in zip(records, starts, offsets, offsets[1:]):
+        assert (rotated[a:b] == np.roll(s, -k)).all()
+    assert list(min_rotation_many(["bca", b"", "aab"])) == [2, 0, 0]
+    offsets, rotated = min_rotation_many(["bca", "aab"], rotate=True, n_threads=2)
+    assert rotated.tobytes() == b"abcaab"
+
+
 def test_lz():
     s = "abbaabbbaaabab"
     lz = lempel_ziv_factorization(longest_previous_factor(s))
@@ -255,6 +905,40 @@ def test_lz():
     assert lempel_ziv_complexity("") == 0
     assert lempel_ziv_complexity("0001") == 2
     assert lempel_ziv_complexity("010") == 3
+    # the last factor 0 + 1 reaches the end of the string
+    lpf = longest_previous_factor("010")
+    assert lempel_ziv_factorization(lpf, True) == [0, 1, 2, 3]
+
+
+def test_lz77():
+    s = "abbaabbbaaabab"
+    starts, lengths, sources = lz77_factorization(s)
+    assert list(starts) == lempel_ziv_factorization(longest_previous_factor(s))[:-1]
+    assert list(lengths) == [1, 1, 1, 1, 3, 3, 2, 2]
+    assert list(sources[:2]) == [-1, -1]
+
+    for _ in range(200):
+        s = "".join(np.random.choice(list("abc"), size=np.random.randint(1, 40)))
+        lpf, sources = longest_previous_factor(s, return_sources=True)
+        for i, (k, p) in enumerate(zip(lpf, sources)):
+            assert p < i and s[p : p + k] == s[i : i + k] if k else p == -1
+        for min_match in [1, 4]:
+            data = lz77_compress(s, min_match)
+            assert lz77_decompress(data) == s.encode()
+
+    s = b"".join(b"GET /index.html %d\n" % (i % 10) for i in range(1000))
+    data = lz77_compress(s)
+    assert len(data) < len(s) / 20
+    assert lz77_decompress(bytearray(data)) == s
+    assert lz77_decompress(lz77_compress(b"")) == b""
+    for corrupted in [data[:-1], data + b"\0", data[:4], b"LZ77\x01\x02\x00\x01\x05"]:
+        with pytest.raises(ValueError):
+            lz77_decompress(corrupted)
+    # a huge length in the header is rejected without allocating it
+    with pytest.raises(ValueError):
+        lz77_decompress(b"LZ77\x01" + b"\xff" * 8 + b"\x0f" + b"\x02ab\x00")
+    with pytest.raises(TypeError):
+        lz77_compress(np.arange(3))
 
 
 def test_kmp_censor_stream():
@@ -268,3 +952,37 @@ def test_kmp_censor_stream():
     assert "".join(out) == "bnbn"
 
     out = list(kmp_censor_stream("a", "bonne journée"))
+
+
+def test_censor_stream():
+    assert "".join(censor_stream(["an", "b"], ["ba", "na", "na"], "*")) == "***a"
+    assert list(censor_stream([b"nan"], [b"bana", b"nana"])) == [b"ba", b"a"]
+    # overlapping occurrences are replaced once
+    assert AhoCorasick(["nan"]).censor("bananana", "*") == "ba*a"
+    # a pattern inside a longer one does not split it
+    assert AhoCorasick([b"abc", b"b"]).censor(b"abc", b"#") == b"#"
+    assert AhoCorasick([b"abc", b"b"]).censor(b"xabcx", b"#") == b"x#x"
+    assert AhoCorasick(["abcd", "bc"]).censor("xabcdx", "#") == "x#x"
+    assert AhoCorasick(["abcd", "bc"]).censor("xabcx", "#") == "xa#x"
+    for chunks in [["xa", "bc", "dx"], ["xab", "c", "d", "x"], list("xabcdx")]:
+        out = "".join(censor_stream(["abcd", "bc"], chunks, "#"))
+        assert out == "x#x"
+    assert "".join(censor_stream(["abc", "b"], ["xa", "bcab", "x"], "#")) == "x#a#x"
+
+    random.seed(0)
+    for _ in range(300):
+        patterns = list(
+            {bytes(random.choices(b"abc", k=random.randint(1, 4))) for _ in range(5)}
+        )
+        text = bytes(random.choices(b"abcd", k=random.randint(0, 40)))
+        replacement = random.choice([b"", b"*", b"XY"])
+        cuts = sorted(random.choices(range(len(text) + 1), k=random.randint(0, 5)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        automaton = AhoCorasick(patterns)
+        out = b"".join(automaton.censor_stream(chunks, replacement))
+        assert out == censor(patterns, text, replacement)
+        # the automaton can be reused
+        assert automaton.censor(text, replacement) == out
+
+    with pytest.raises(ValueError):
+        AhoCorasick(["a", ""])
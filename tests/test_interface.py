@@ -1,7 +1,7 @@
 import numpy as np
 import pytest
 
-from pydivsufsort import WonderString
+from pydivsufsort import CompactLCP, RLBWTIndex, WonderString
 
 
 def test_base():
@@ -11,7 +11,40 @@ def test_base():
     assert s.search("bc").count == 2
     assert set(s.search("bc", True)) == {1, 5}
     assert s.search("cb", True).size == 0
+    count, position = s.search_many(["bc", "cb", "abcd"])
+    assert list(count) == [2, 0, 2]
+    assert position[0] == s.search("bc").position
     assert np.array_equal(s.most_frequent_substrings(length=4, limit=1), ([4], [2]))
+    spectrum = s.most_frequent_substrings(lengths=[1, 4], limit=1)
+    assert np.array_equal(spectrum[4], ([4], [2]))
+    assert spectrum[1].counts[0] == 2
+    lengths, positions = s.matching_statistics("bcdx")
+    assert list(lengths) == [3, 2, 1, 0]
+    assert list(positions[:3] % 4) == [1, 2, 3]
+    assert positions[3] == -1
+    query_positions, positions, lengths = s.mems("xabcdy", 2)
+    assert list(query_positions) == [1, 1]
+    assert list(positions) == [0, 4]
+    assert list(lengths) == [4, 4]
+    # "bc" at 5 is maximal there but shorter than the match of "abc" at 0
+    query_positions, positions, lengths = WonderString("abcdxbc").mems("abc")
+    assert list(zip(query_positions, positions, lengths)) == [(0, 0, 3)]
+    # nothing matches in an empty string
+    lengths, positions = WonderString(b"").matching_statistics(b"abc")
+    assert list(lengths) == [0, 0, 0] and list(positions) == [-1, -1, -1]
+    assert len(WonderString(b"").mems(b"abc").lengths) == 0
+
+
+def test_lcp_backend():
+    for backend in ["segtree", "sparse_table"]:
+        s = WonderString("abcdabcd", lcp_backend=backend)
+        assert s.lcp(0, 4) == 4
+        assert s.lcp(3, 3) == 5
+        assert list(s.lcp(np.array([[0, 4], [1, 5], [0, 1]]))) == [4, 3, 0]
+        assert s.lcp(0, 4, backend="segtree") == 4
+        assert s.lcp(0, 4, backend="sparse_table") == 4
+    with pytest.raises(ValueError):
+        WonderString("abcd", lcp_backend="unknown")
 
 
 def test_exceptions():
@@ -34,3 +67,88 @@ def test_larger_dtype():
     pat = np.array([257], np.uint16)
     ans = s.search(pat, return_positions=True)
     assert sorted(ans) == [0, 1]
+
+
+def test_save_open(tmp_path):
+    path = tmp_path / "index"
+    s = WonderString("abcdabcd")
+    s.save(path)
+    for mmap in [True, False]:
+        t = WonderString.open(path, mmap=mmap)
+        assert (t.string == s.string).all()
+        assert not hasattr(t, "_suffix_array")
+        assert t.search("bc").count == 2
+
+    assert s.lcp(0, 4) == 4
+    s.save(path)
+    for mmap in [True, False]:
+        t = WonderString.open(path, mmap=mmap)
+        for name in ["_suffix_array", "_lcp_array", "_rank", "_segtree"]:
+            assert (getattr(t, name) == getattr(s, name)).all()
+        assert t.lcp(0, 4) == 4
+        assert set(t.search("bc", True)) == {1, 5}
+
+    a = np.array([0, 256, 0, 256], np.uint16)
+    s = WonderString(a)
+    s.search(np.array([0, 256], np.uint16), return_positions=True)
+    s.save(path)
+    t = WonderString.open(path)
+    assert t.string.dtype == np.uint16
+    assert (t.suffix_array_bytes == s.suffix_array_bytes).all()
+    ans = t.search(np.array([0, 256], np.uint16), return_positions=True)
+    assert sorted(ans) == [0, 2]
+
+    path.write_bytes(b"not an index" * 10)
+    with pytest.raises(ValueError):
+        WonderString.open(path)
+
+
+def test_save_open_rlbwt(tmp_path):
+    path = tmp_path / "index"
+    index = RLBWTIndex("abcdabcd" * 10)
+    index.save(path)
+    for mmap in [True, False]:
+        loaded = RLBWTIndex.open(path, mmap=mmap)
+        assert loaded.n == 80
+        assert loaded.count("bcd") == 20
+        assert (loaded.locate("da") == index.locate("da")).all()
+    WonderString("abcd").save(path)
+    with pytest.raises(ValueError):
+        RLBWTIndex.open(path)
+
+
+def test_compact_lcp(tmp_path):
+    path = tmp_path / "index"
+    text = "abcdabcd" + "x" * 300 + "abcd" + "x" * 300
+    s = WonderString(text, compact_lcp=True)
+    assert isinstance(s.lcp_array, CompactLCP)
+    assert s.lcp(8, 312) == 300
+    assert s.lcp(0, 4) == 4
+    mfs = WonderString(text).most_frequent_substrings(length=4, limit=3)
+    assert np.array_equal(s.most_frequent_substrings(length=4, limit=3), mfs)
+    s.save(path)
+    t = WonderString.open(path)
+    assert isinstance(t.lcp_array, CompactLCP)
+    assert (np.asarray(t.lcp_array) == np.asarray(s.lcp_array)).all()
+    assert t.lcp(8, 312) == 300
+
+
+def test_sparse(tmp_path):
+    path = tmp_path / "index"
+    text = "the cat sat on the mat the cat"
+    words = [0] + [i + 1 for i, c in enumerate(text) if c == " "]
+    s = WonderString(text, sparse=words)
+    assert len(s.suffix_array) == len(words)
+    assert sorted(s.search("the", return_positions=True)) == [0, 15, 23]
+    assert s.search("at").count == 0
+    mfs = s.most_frequent_substrings(length=3, limit=2)
+    assert list(mfs.counts) == [3, 2]
+    with pytest.raises(NotImplementedError):
+        s.lcp(0, 15)
+    s.save(path)
+    t = WonderString.open(path)
+    assert t.sparse
+    assert (t.suffix_array == s.suffix_array).all()
+    assert t.search("cat").count == 2
+    with pytest.raises(NotImplementedError):
+        WonderString(np.arange(3, dtype=np.uint16), sparse=[0])